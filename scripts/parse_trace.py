@@ -1,8 +1,16 @@
 #!/usr/bin/python3
+import csv
 import json
 import argparse
 import sys
 import re
+import os
+import hashlib
+import glob
+import itertools
+import concurrent.futures
+
+import numpy as np
 
 # Number of different trace types, currently 4
 # core:    pkt type 0
@@ -14,13 +22,45 @@ NUM_EVENTS = 8  # number of events we can view per trace
 
 DEBUG = False
 
+# Words of the trace file decoded at a time, whole packets of 8 words
+TRACE_CHUNK_WORDS = 1 << 12
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--filename", help="Trace file", required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--filename", help="Trace file")
+    source.add_argument(
+        "--batch",
+        metavar="DIR",
+        help="parse every .txt trace of DIR, all taken of the design of --mlir, into a .json next to it",
+    )
     parser.add_argument("--mlir", help="mlir source file", required=True)
     parser.add_argument(
-        "--colshift", help="column shift adjustment to source mlir", required=False
+        "--colshift",
+        help="column shift adjustment to source mlir, 1 by default as the npu1 array starts at column 1",
+        required=False,
+    )
+    parser.add_argument(
+        "--phases",
+        help="phases the cores mark, written by aie2.py --trace-phases",
+        required=False,
+    )
+    parser.add_argument(
+        "--phase-table",
+        help="CSV file to write the cycles of every phase of every core and transform to, needs --phases; --batch writes one per trace with --phases",
+        required=False,
+    )
+    parser.add_argument(
+        "--outdir",
+        help="directory to write the .json files of --batch to, DIR by default",
+        required=False,
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="processes parsing the traces of --batch, one per CPU by default",
+        required=False,
     )
     # TODO tracelabels removed since we can have multiple sets of labels for each pkt_type & loc combination
     # parser.add_argument('--tracelabels',
@@ -29,33 +69,62 @@ def parse_args():
     return parser.parse_args(sys.argv[1:])
 
 
-def check_odd_word_parity(word):
-    val = 0
-    for i in range(32):
-        val = val ^ ((word >> i) & 0x1)
-    return val == 1
+def check_odd_word_parity(words):
+    # Parity of every word of an array, folded down to bit 0
+    w = words ^ (words >> 16)
+    w = w ^ (w >> 8)
+    w = w ^ (w >> 4)
+    w = w ^ (w >> 2)
+    w = w ^ (w >> 1)
+    return (w & 0x1) == 1
 
 
-def parse_pkt_hdr_in_stream(word):
+# Headers of an array of packet header words, as arrays of their fields
+def parse_pkt_hdr_in_stream(words):
     hdr = dict()
-    w = int(word)
-    hdr["valid"] = check_odd_word_parity(w)
+    hdr["valid"] = check_odd_word_parity(words)
     # TODO can we assume non used fields must be 0 to rule out other data packets?
     # what about bit[5:10]?
-    if (((w >> 5) & 0x7F) != 0) or (((w >> 19) & 0x1) != 0) or (((w >> 28) & 0x7) != 0):
-        hdr["valid"] = False
-    else:
-        # TODO Do we need to check for valid row/col for given device?
-        hdr["col"] = (w >> 21) & 0x7F
-        hdr["row"] = (w >> 16) & 0x1F
-        hdr["type"] = (w >> 12) & 0x3
-        hdr["id"] = w & 0x1F
+    hdr["valid"] &= (
+        (((words >> 5) & 0x7F) == 0)
+        & (((words >> 19) & 0x1) == 0)
+        & (((words >> 28) & 0x7) == 0)
+    )
+    # TODO Do we need to check for valid row/col for given device?
+    hdr["col"] = (words >> 21) & 0x7F
+    hdr["row"] = (words >> 16) & 0x1F
+    hdr["type"] = (words >> 12) & 0x3
+    hdr["id"] = words & 0x1F
     return hdr
 
 
+# Words of a list of hex tokens, up to the first blank one
+def parse_words(word_stream):
+    end = word_stream.index("") if "" in word_stream else len(word_stream)
+    toks = word_stream[:end]
+    if set(map(len, toks)) <= {8}:
+        return np.frombuffer(bytes.fromhex("".join(toks)), ">u4").astype(np.uint32)
+    return np.fromiter((int(t, 16) for t in toks), np.uint32, end)
+
+
 # toks_list:   list (idx = types of traces, currently 4, value = stream_dict)
-# stream_dict: dict (key = row,col, value = list of word streams)
-def core_trace_and_mem_trace_de_interleave(word_stream):
+# stream_dict: dict (key = row,col, value = array of the data words)
+def core_trace_and_mem_trace_de_interleave(word_stream, pkt_ids=None):
+    return de_interleave_words(parse_words(word_stream), None, pkt_ids)[0]
+
+
+# De-interleave words starting on a packet boundary. Every packet is a
+# header and 7 data words. Packets under an invalid header belong to the
+# stream of the last valid one, last is that of the words before.
+# pkt_ids gets the packet ID of every stream, a tile sending two is an
+# error.
+#
+# pkt_ids: dict (key = (type, row,col), value = packet ID)
+# return (toks_list, last): the streams and the last valid header,
+# (key, type, row,col), of these words
+def de_interleave_words(words, last=None, pkt_ids=None):
+    if pkt_ids is None:
+        pkt_ids = dict()
     toks_list = list()
     for t in range(NumTraceTypes):
         toks_list.append(dict())
@@ -65,93 +134,154 @@ def core_trace_and_mem_trace_de_interleave(word_stream):
     # intfc_stream = dict()   # pkt type 2
     # memtile_stream = dict() # pkt type 3
 
-    # index lists based on row/col and if its not null, that means it already exists
-
-    curr_pkt_type = 0
-    curr_loc = ""
-    curr_vld = False  # only used in the beginning
-
-    # print(len(word_stream))
-    for i in range(len(word_stream)):
-        if word_stream[i] == "":
-            break  # TODO Assumes a blank line is the last line
-        if (i % 8) == 0:
-            # print(str(i)+':'+word_stream[i])
-            pkt_hdr = parse_pkt_hdr_in_stream(int(word_stream[i], 16))
-            if pkt_hdr["valid"]:
-                curr_loc = str(pkt_hdr["row"]) + "," + str(pkt_hdr["col"])
-                valid_type_found = False
-                for tt in range(NumTraceTypes):
-                    if pkt_hdr["type"] == tt:
-                        curr_pkt_type = tt
-                        if toks_list[tt].get(curr_loc) == None:
-                            toks_list[tt][curr_loc] = list()
-                        valid_type_found = True
-                if not valid_type_found:
-                    sys.exit("Error: Invalid packet type")
-            # Crate a list for the loc if it doesn't exist
-            curr_vld = True
-        else:
-            if (
-                curr_vld
-            ):  # ignores first 8 chunks of data is pkt hdr was invalid. TODO Is this right?
-                # or shoudl we require valid header in first chunk of data
-                toks_list[curr_pkt_type][curr_loc].append(
-                    word_stream[i]
-                )  # TODO assuem curr_pkt_type is valid
-                # for tt in range(NumTraceTypes):
-                #     if curr_pkt_type == tt:
-                #         toks_list[tt][curr_loc].append(word_stream[i])
-    return toks_list
+    end = len(words)
+    hdr = parse_pkt_hdr_in_stream(words[::8])
+
+    # Packet of the last valid header of every packet, -1 before the first
+    valid = np.flatnonzero(hdr["valid"])
+    owner = np.full(len(hdr["valid"]), -1)
+    owner[valid] = valid
+    owner = np.maximum.accumulate(owner)
+    key = (hdr["type"].astype(np.int64) << 16) | (hdr["row"] << 8) | hdr["col"]
+    owner_key = np.where(owner >= 0, key[np.maximum(owner, 0)], -1 if last is None else last[0])
+
+    # Streams in the order their first packet arrived
+    streams = list()
+    if last is not None and len(owner) and owner[0] < 0:
+        streams.append(last)
+    keys, first = np.unique(key[valid], return_index=True)
+    for k, pkt in sorted(zip(keys.tolist(), valid[first].tolist()), key=lambda kp: kp[1]):
+        tt = k >> 16
+        curr_loc = str(int(hdr["row"][pkt])) + "," + str(int(hdr["col"][pkt]))
+        ids = hdr["id"][valid[key[valid] == k]]
+        pkt_ids.setdefault((tt, curr_loc), int(ids[0]))
+        if np.any(ids != pkt_ids[tt, curr_loc]):
+            raise ValueError("Tile " + curr_loc + " sends packets with two IDs")
+        if k not in [stream[0] for stream in streams]:
+            streams.append((k, tt, curr_loc))
+    for k, tt, curr_loc in streams:
+        pkts = np.flatnonzero(owner_key == k)
+        data = (8 * pkts[:, None] + np.arange(1, 8)).ravel()
+        toks_list[tt][curr_loc] = words[data[data < end]]
+    if len(valid):
+        pkt = valid[-1]
+        last = next(stream for stream in streams if stream[0] == key[pkt])
+    return toks_list, last
 
 
 # toks_list is a list of toks dictionaries where each dictionary is a type (core, mem, intfc, memtile)
-# each dictionary key is a tile location (row,col) whose value is a list of stream data
+# each dictionary key is a tile location (row,col) whose value is an array of stream data
 def convert_to_byte_stream(toks_list):
     byte_stream_list = list()
     for l in toks_list:
         byte_stream_dict = dict()
         for loc, stream in l.items():
-            # byte_stream = list()
-            byte_stream_dict[loc] = list()
-            f = ["", "a5a5a5a5"]
-            toks = [t for t in stream if not t in f]
-            events = [int(t, 16) for t in toks]
-            for event in events:
-                for top in range(4):
-                    byte = 3 - top
-                    opcode = event >> (byte * 8) & 0xFF
-                    byte_stream_dict[loc].append(opcode)
-        # for key, value in l.items():
-        #     # byte_stream = list()
-        #     byte_stream_dict[key] = list()
-        #     f = ['', 'a5a5a5a5']
-        #     toks = [t for t in value if not t in f]
-        #     events = [int(t,16) for t in toks]
-        #     for (i,event) in enumerate(events):
-        #         if ((i % 8) == 0): # assumed hdr every 8 words and ignores it
-        #             pass
-        #         else: # breaks line into list of bytes
-        #             for top in range(4):
-        #                 byte = 3-top
-        #                 opcode = (event >> (byte * 8) & 0xff)
-        #                 byte_stream_dict[key].append(opcode)
+            # Bytes of the words most significant first, without the padding
+            events = stream[stream != 0xA5A5A5A5]
+            byte_stream_dict[loc] = events.astype(">u4").view(np.uint8)
         byte_stream_list.append(byte_stream_dict)
     return byte_stream_list
 
 
+# Trace commands by their first byte: type, bytes they take and bytes
+# they read. Bytes matching no command are skipped.
+COMMAND_TYPES = [
+    None,  # unknown
+    "Start",
+    None,  # 0b110111xx, we don't care about these
+    "Single0",
+    "Single1",
+    "Single2",
+    "Multiple0",
+    "Multiple1",
+    "Multiple2",
+    "Repeat0",
+    "Repeat1",
+    None,  # filler
+    "Event_Sync",
+]
+COMMAND_LENGTHS = np.array([1, 8, 4, 1, 2, 3, 2, 3, 4, 1, 2, 1, 1])
+COMMAND_READS = np.array([1, 8, 1, 1, 2, 3, 2, 3, 4, 1, 2, 1, 1])
+
+
+def command_table():
+    table = np.zeros(256, np.int64)
+    for byte in range(256):
+        if (byte & 0b11111011) == 0b11110000:
+            table[byte] = 1
+        elif (byte & 0b11111100) == 0b11011100:
+            table[byte] = 2
+        elif (byte & 0b10000000) == 0b00000000:
+            table[byte] = 3
+        elif (byte & 0b11100000) == 0b10000000:
+            table[byte] = 4
+        elif (byte & 0b11100000) == 0b10100000:
+            table[byte] = 5
+        elif (byte & 0b11110000) == 0b11000000:
+            table[byte] = 6
+        elif (byte & 0b11111100) == 0b11010000:
+            table[byte] = 7
+        elif (byte & 0b11111100) == 0b11010100:
+            table[byte] = 8
+        elif (byte & 0b11110000) == 0b11100000:
+            table[byte] = 9
+        elif (byte & 0b11111100) == 0b11011000:
+            table[byte] = 10
+        elif byte == 0b11111110:
+            table[byte] = 11
+        elif byte == 0b11111111:
+            table[byte] = 12
+    return table
+
+
+COMMAND_TABLE = command_table()
+COMMAND_KEPT = np.array([name is not None for name in COMMAND_TYPES])
+START, SINGLE, MULTIPLE, REPEAT = 1, (3, 4, 5), (6, 7, 8), (9, 10)
+
+# A command: opcode indexes COMMAND_TYPES, events has bit # set for the
+# event # of a Single and each of a Multiple, cycles are those of a Single
+# or a Multiple or the timer value of a Start, repeats those of a Repeat
+COMMAND_DTYPE = np.dtype(
+    [("opcode", np.uint8), ("events", np.uint8), ("cycles", np.int64), ("repeats", np.int64)]
+)
+
+
+# Offsets of the commands of a byte stream and their kinds, indices into
+# COMMAND_TYPES. A command cut short by the end of the stream ends it.
+# Unless final, the stream goes on and the cut command is left for the
+# next bytes.
+#
+# return (offsets, kinds, end): end is the offset of the cut command
+def command_offsets(byte_stream, zero=True, final=True):
+    n = len(byte_stream)
+    kinds = COMMAND_TABLE[byte_stream]
+    # Offset of the next command after each byte, n past the end. Jumping
+    # over 1, 2, 4, ... commands at a time from the commands found so far
+    # doubles them until no jump stays in the stream.
+    jump = np.minimum(np.arange(n + 1) + COMMAND_LENGTHS[np.append(kinds, 0)], n)
+    found = [np.zeros(1, np.int64)]
+    reached = found[0]
+    while len(reached) and n > 0:
+        reached = jump[np.concatenate(found)]
+        reached = reached[reached < n]
+        found.append(reached)
+        jump = jump[jump]
+    offsets = np.sort(np.concatenate(found)) if n > 0 else np.zeros(0, np.int64)
+    kinds = kinds[offsets]
+    reads = COMMAND_READS[kinds] if final else COMMAND_LENGTHS[kinds].copy()
+    if zero and final:
+        reads[kinds == 1] = 1
+    cut = np.flatnonzero(offsets + reads > n)
+    if len(cut):
+        return offsets[: cut[0]], kinds[: cut[0]], int(offsets[cut[0]])
+    return offsets, kinds, n
+
+
 # byte_stream_list: list (idx = trace type, value = word_stream_dict)
-# word_stream_dict: dict (key = row,col, value = list of words)
+# word_stream_dict: dict (key = row,col, value = array of bytes)
 #
 # return commands:  list (idx = trace type, value = byte_stream_dict)
-# byte_stream_dict: dict (key = row,col, value = list of commands)
-#
-# command: dict
-#   keys: type (Single0/1, Multiple0/1/2, Start, Repeat0/1, EventSync)
-#         event (integer value)
-#         cycles (integer value)
-#         event# (integer value matching event number #)
-#         repeats (integer value)
+# byte_stream_dict: dict (key = row,col, value = array of COMMAND_DTYPE)
 def convert_to_commands(byte_stream_list, zero=True):
     # commands = dict()
     commands = list()
@@ -160,142 +290,130 @@ def convert_to_commands(byte_stream_list, zero=True):
 
     for t in range(NumTraceTypes):
         for key, byte_stream in byte_stream_list[t].items():
-            cursor = 0
-            commands[t][key] = list()
-            try:
-                while True:
-                    if (byte_stream[cursor] & 0b11111011) == 0b11110000:
-                        com = {"type": "Start", "timer_value": 0}
-                        if not zero:
-                            for i in range(7):
-                                com["timer_value"] += (byte_stream[cursor + i + 1]) * (
-                                    256 ** (6 - i)
-                                )
-                        commands[t][key].append(com)
-                        cursor = cursor + 8
-                    if (byte_stream[cursor] & 0b11111100) == 0b11011100:
-                        # We don't care about these
-                        cursor = cursor + 4
-                    if (byte_stream[cursor] & 0b10000000) == 0b00000000:
-                        com = {"type": "Single0"}
-                        com["event"] = (byte_stream[cursor]) >> 4 & 0b111
-                        com["cycles"] = (byte_stream[cursor]) & 0b1111
-                        commands[t][key].append(com)
-                        cursor = cursor + 1
-                    if (byte_stream[cursor] & 0b11100000) == 0b10000000:
-                        com = {"type": "Single1"}
-                        com["event"] = (byte_stream[cursor]) >> 2 & 0b111
-                        com["cycles"] = ((byte_stream[cursor]) & 0b11) * 256
-                        com["cycles"] += byte_stream[cursor + 1]
-                        commands[t][key].append(com)
-                        cursor = cursor + 2
-                    if (byte_stream[cursor] & 0b11100000) == 0b10100000:
-                        com = {"type": "Single2"}
-                        com["event"] = (byte_stream[cursor]) >> 2 & 0b111
-                        com["cycles"] = ((byte_stream[cursor]) & 0b11) * 256 * 256
-                        com["cycles"] += byte_stream[cursor + 1] * 256
-                        com["cycles"] += byte_stream[cursor + 2]
-                        commands[t][key].append(com)
-                        cursor = cursor + 3
-                    if (byte_stream[cursor] & 0b11110000) == 0b11000000:
-                        com = {"type": "Multiple0"}
-                        com["cycles"] = byte_stream[cursor + 1] & 0b1111
-                        events = (byte_stream[cursor] & 0b1111) << 4
-                        events = events + (byte_stream[cursor + 1] >> 4)
-                        for i in range(0, 8):
-                            e = (events >> i) & 0b1
-                            if e:
-                                com["event" + str(i)] = (
-                                    i  # TODO is this how event# is stored in IR?
-                                )
-                        commands[t][key].append(com)
-                        cursor = cursor + 2
-                    if (byte_stream[cursor] & 0b11111100) == 0b11010000:
-                        # TODO Don't we need to extract events here?
-                        # print("Multiple1")
-                        com = {"type": "Multiple1"}
-                        cycles = (byte_stream[cursor + 1] & 0b11) << 8
-                        com["cycles"] = cycles + (byte_stream[cursor + 2])
-                        events = (byte_stream[cursor] & 0b11) << 6
-                        events = events + (byte_stream[cursor + 1] >> 2)
-                        for i in range(0, 8):
-                            e = (events >> i) & 0b1
-                            if e:
-                                com["event" + str(i)] = (
-                                    i  # TODO is this how event# is stored in IR?
-                                )
-                        commands[t][key].append(com)
-                        cursor = cursor + 3
-                    if (byte_stream[cursor] & 0b11111100) == 0b11010100:
-                        # TODO Don't we need to extract events here?
-                        # print("Multiple2")
-                        com = {"type": "Multiple2"}
-                        cycles = (byte_stream[cursor + 1] & 0b11) << 16
-                        cycles = cycles + ((byte_stream[cursor + 2]) << 8)
-                        com["cycles"] = cycles + (byte_stream[cursor + 3])
-                        events = (byte_stream[cursor] & 0b11) << 6
-                        events = events + (byte_stream[cursor + 1] >> 2)
-                        for i in range(0, 8):
-                            e = (events >> i) & 0b1
-                            if e:
-                                com["event" + str(i)] = (
-                                    i  # TODO is this how event# is stored in IR?
-                                )
-                        commands[t][key].append(com)
-                        cursor = cursor + 4
-                    if (byte_stream[cursor] & 0b11110000) == 0b11100000:
-                        com = {"type": "Repeat0"}
-                        com["repeats"] = (byte_stream[cursor]) & 0b1111
-                        commands[t][key].append(com)
-                        cursor = cursor + 1
-                    if (byte_stream[cursor] & 0b11111100) == 0b11011000:
-                        com = {"type": "Repeat1"}
-                        com["repeats"] = ((byte_stream[cursor]) & 0b11) * 256
-                        com["repeats"] += byte_stream[cursor + 1]
-                        commands[t][key].append(com)
-                        cursor = cursor + 2
-                    if (byte_stream[cursor] & 0b11111111) == 0b11111110:
-                        # No one likes you filler, get out of here
-                        cursor = cursor + 1
-                    if (byte_stream[cursor] & 0b11111111) == 0b11111111:
-                        com = {"type": "Event_Sync"}
-                        commands[t][key].append(com)
-                        cursor = cursor + 1
-            except IndexError:
-                pass
+            offsets, kinds, end = command_offsets(byte_stream, zero)
+            commands[t][key] = decode_commands(byte_stream, offsets, kinds, zero)
 
     return commands
 
 
+# Commands at offsets of a byte stream, of the kinds command_offsets found
+def decode_commands(byte_stream, offsets, kinds, zero=True):
+    # The first four bytes of every command, zero past the end
+    b = np.concatenate([byte_stream, np.zeros(8, np.uint8)]).astype(np.int64)
+    b0, b1, b2, b3 = (b[offsets + i] for i in range(4))
+
+    # event and cycles (Single), cycles and event mask (Multiple)
+    # or repeats (Repeat) of every command
+    event = np.where(kinds == 3, (b0 >> 4) & 0b111, (b0 >> 2) & 0b111)
+    mask = np.where(kinds == 6, ((b0 & 0b1111) << 4) + (b1 >> 4), ((b0 & 0b11) << 6) + (b1 >> 2))
+    value = np.select(
+        [kinds == 3, kinds == 4, kinds == 5, kinds == 6, kinds == 7, kinds == 8, kinds == 9],
+        [
+            b0 & 0b1111,
+            (b0 & 0b11) * 256 + b1,
+            (b0 & 0b11) * 256 * 256 + b1 * 256 + b2,
+            b1 & 0b1111,
+            ((b1 & 0b11) << 8) + b2,
+            ((b1 & 0b11) << 16) + (b2 << 8) + b3,
+            b0 & 0b1111,
+        ],
+        (b0 & 0b11) * 256 + b1,
+    )
+
+    single = np.isin(kinds, SINGLE)
+    multiple = np.isin(kinds, MULTIPLE)
+    cmds = np.zeros(len(kinds), COMMAND_DTYPE)
+    cmds["opcode"] = kinds
+    cmds["events"] = np.where(single, 1 << event, np.where(multiple, mask, 0))
+    cmds["cycles"] = np.where(single | multiple, value, 0)
+    cmds["repeats"] = np.where(np.isin(kinds, REPEAT), value, 0)
+    if not zero:
+        # Timer value of a Start, the 7 bytes after its first
+        start = np.flatnonzero(kinds == START)
+        timer = np.zeros(len(start), np.int64)
+        for i in range(1, 8):
+            timer = (timer << 8) | b[offsets[start] + i]
+        cmds["cycles"][start] = timer
+    return cmds[COMMAND_KEPT[kinds]]
+
+
+# ------------------------------------------------------------------------------
+# Streaming stages, each a generator over the chunks of the one before:
+# words -> packets -> bytes -> commands -> events. Only a chunk of each and
+# the bytes of a command cut at the end of a chunk are held at a time.
+# ------------------------------------------------------------------------------
+
+
+# Words of the trace file f, chunk words at a time, up to the first blank line
+def read_words(f, chunk=TRACE_CHUNK_WORDS):
+    while True:
+        toks = [line.rstrip("\n") for line in itertools.islice(f, chunk)]
+        words = parse_words(toks)
+        if len(words):
+            yield words
+        if len(words) < chunk:
+            return
+
+
+# Streams of every chunk of words, see de_interleave_words
+def trace_packets(word_chunks, pkt_ids=None):
+    last = None
+    for words in word_chunks:
+        toks_list, last = de_interleave_words(words, last, pkt_ids)
+        yield toks_list
+
+
+def trace_bytes(packet_chunks):
+    for toks_list in packet_chunks:
+        yield convert_to_byte_stream(toks_list)
+
+
+# Commands of every chunk of byte streams. The bytes of a command cut at the
+# end of a chunk are put in front of the next bytes of its stream, and the
+# commands left at the end come last.
+def trace_commands(byte_chunks, zero=True):
+    rest = list()
+    for t in range(NumTraceTypes):
+        rest.append(dict())
+
+    for byte_stream_list in byte_chunks:
+        commands = list()
+        for t in range(NumTraceTypes):
+            commands.append(dict())
+            for key, byte_stream in byte_stream_list[t].items():
+                if key in rest[t]:
+                    byte_stream = np.concatenate([rest[t][key], byte_stream])
+                offsets, kinds, end = command_offsets(byte_stream, zero, final=False)
+                rest[t][key] = byte_stream[end:]
+                commands[t][key] = decode_commands(byte_stream, offsets, kinds, zero)
+        yield commands
+
+    yield convert_to_commands(rest, zero)
+
+
 def make_event_lists(commands):
     events = {}
     ts = 0
-    for i, command in enumerate(commands):
-        if command["type"] == "Start":
-            ts = command["timer_value"]
-        if command["type"] == "Event_Sync":
+    for c in commands.tolist():
+        opcode, mask, cycles = c[0], c[1], c[2]
+        if opcode == START:
+            ts = cycles
+        if COMMAND_TYPES[opcode] == "Event_Sync":
             ts += 0x3FFFF  # Typo in spec
-        if "Single" in command["type"]:
-            ts += command["cycles"]
-            if command["event"] in events:
-                events[command["event"]].append(ts)
-            else:
-                events[command["event"]] = [ts]
+        if opcode in SINGLE:
+            ts += cycles
+            events.setdefault(mask.bit_length() - 1, list()).append(ts)
     return events
 
 
 # testing a flattening of repeat commands
 def flatten_repeat_command(commands):
-    prev = 0
-    flat_commands = list()
-    for c in commands:
-        if c["type"] == "Repeat0" or c["type"] == "Repeat1":
-            for i in range(int(c["repeats"])):
-                flat_commands.append(prev)
-        else:
-            flat_commands.append(c)
-            prev = c
-    return flat_commands
+    # A Repeat stands for repeats of the command before it
+    repeat = np.isin(commands["opcode"], REPEAT)
+    prev = np.maximum.accumulate(np.where(repeat, -1, np.arange(len(commands))))
+    counts = np.where(repeat, commands["repeats"], 1)
+    keep = prev >= 0
+    return np.repeat(commands[prev[keep]], counts[keep])
 
 
 # Using trace_event_0 = 0x4B222125, trace_event_1 = 0x2D2C1A4F
@@ -344,194 +462,181 @@ def lookupEventNameInStr(event, pid, pid_events):
     #         return "Mm2s1FinishedTask"
 
 
-# multiples is a list of events that are being activated
-def deactivate(
-    multiples, active_events, timer, cycles, pid, trace_type, loc, pid_events
-):
-    for k in active_events.keys():  # an active event
-        if cycles > 0 or (cycles == 0 and not k in multiples):
-            # if not k in multiples: # active event it not in multiples list
-            if active_events[k] > 0:
-                # trace_event = {'name':"Event"+str(k)}
-                # trace_event = {'name':events_to_name[k]}
-                # trace_event = {'name':lookupEventNameInStr(str(k), pid, pid_events)}
-                # trace_event = {'name':lookup_event_name_by_type(trace_type, str(k), pid_events)} # TODO remove
-                trace_event = {
-                    "name": lookup_event_name_by_type(
-                        trace_type, pid_events[trace_type][loc][k]
-                    )
-                }  # TODO remove
-                # trace_event['args']['name'] = lookup_event_name_by_type(trace_type, pid_events[trace_type][loc][k])
-                #                trace_event['ts'] = active_events[k]
-                trace_event["ts"] = timer
-                trace_event["ph"] = "E"
-                # trace_event['pid'] = 0
-                trace_event["pid"] = pid
-                trace_event["tid"] = k
-                trace_event["args"] = {}
-                # trace_event['keys'] = multiples
-                # trace_event['active_events'] = active_events.keys()
-                # trace_event['opcode'] = "Deactivate" + str(multiples)
-
-                trace_events.append(trace_event)
-            active_events[k] = 0
-
-
-# def update(t):
-#     for k in active_events.keys():
-#         if active_events[k]:
-#             active_events[k] = t
-
-
-# def convert_commands_to_json(trace_events, commands, pid, pid_events):
-# TODO iterate over commands which is ...
-#
+# An event: ph is B when the event begins and E when it ends, tid is its
+# event #, ts the timer value
+EVENT_DTYPE = np.dtype([("pid", np.int32), ("tid", np.uint8), ("ph", "S1"), ("ts", np.int64)])
+
+
 # commands:  list (idx = trace type, value = byte_stream_dict)
-# byte_stream_dict: dict (key = row,col, value = list of commands)
-def convert_commands_to_json(trace_events, commands, pid_events):
-    # for bsd in commands: # byte_stream_dict for each trace type. TODO how to get index of bsd?
-    for tt in range(
-        len(commands)
-    ):  # byte_stream_dict for each trace type. TODO how to get index of bsd?
-        byte_stream_dict = commands[tt]
-
-        for loc, command in byte_stream_dict.items():  # row,col with list of commands
-            timer = 0  # TODO Some way to set this or sync this between trace types and row,col
-            # timer on each execution is the time for the last execution
-            # so we by default will increment it by 1 for each event
-            pid = pid_events[tt][loc][NUM_EVENTS]
-
-            active_events = dict()
-            for i in range(16):  # TODO we only have 8 events at a time though right?
-                active_events[i] = 0
-
-            for c in command:
-                # for c in flat_commands:
-                # print(c)
-                t = c["type"]
-                # if 'Start' in t:
-                # timer = c['timer_value'] # TODO Turn off timer for now to test sync among tiles/type
-                # elif 'Single' in t:
-                if "Single" in t:
-                    event = c["event"]
-                    cycles = int(c["cycles"])
-
-                    # timer = timer + 1 + int(c['cycles'])   # Timer at top
-                    timer = timer + 1
-
-                    # if cycles > 0, deactivate all events
-                    # if cycles == 0, deactivate all events except this one
-
-                    # TODO NO? deactivate all active_events that is not this event
-                    multiple_list = list()
-                    # for k in c.keys():
-                    #     if "event" in k:
-                    #         multiple_list.append(c[k]) # TODO overkill since there should only be one?
-                    multiple_list.append(c["event"])
-                    # for k in active_events.keys():
-                    #     if cycles > 0 or (cycles == 0 and k != event):
-                    #         multiple_list.append(k)
-                    deactivate(
-                        multiple_list,
-                        active_events,
-                        timer,
-                        cycles,
-                        pid,
-                        tt,
-                        loc,
-                        pid_events,
+# byte_stream_dict: dict (key = row,col, value = array of COMMAND_DTYPE)
+#
+# return events: array of EVENT_DTYPE, by tile
+def convert_commands_to_events(commands, pid_events, timer_origin=None, states=None):
+    # All tiles count from the earliest timer value any of them started
+    # tracing at, which lines their timelines up
+    if timer_origin is None:
+        timer_origin = first_timer_value(commands)
+    # Commands of a tile may come in parts, states keeps where each tile
+    # left off, None for the tiles skipped
+    if states is None:
+        states = dict()
+    events = [np.zeros(0, EVENT_DTYPE)]
+    for tt in range(len(commands)):
+        for loc, command in commands[tt].items():  # row,col with array of commands
+            if (tt, loc) not in states:
+                if loc not in pid_events[tt]:
+                    print(
+                        "Warning: no trace events configured for tile " + loc + ", skipped",
+                        file=sys.stderr,
                     )
+                    states[tt, loc] = None
+                else:
+                    states[tt, loc] = new_tile_state()
+            if states[tt, loc] is not None:
+                pid = pid_events[tt][loc][NUM_EVENTS]
+                events.append(convert_tile_commands(command, pid, states[tt, loc], timer_origin))
+    return np.concatenate(events)
+
+
+# Earliest timer value any tile started tracing at, from the first Start of
+# every stream of the chunks of byte streams as the timer only counts up.
+# Only the bytes of a command cut at the end of a chunk are kept until the
+# Start of a stream is found.
+def trace_timer_origin(byte_chunks):
+    rest = dict()
+    starts = dict()
+    for byte_stream_list in byte_chunks:
+        for t in range(NumTraceTypes):
+            for key, byte_stream in byte_stream_list[t].items():
+                if (t, key) in starts:
+                    continue
+                if (t, key) in rest:
+                    byte_stream = np.concatenate([rest[t, key], byte_stream])
+                offsets, kinds, end = command_offsets(byte_stream, False, final=False)
+                start = offsets[kinds == 1]
+                if len(start):
+                    timer = byte_stream[start[0] + 1 : start[0] + 8].tobytes()
+                    starts[t, key] = int.from_bytes(timer, "big")
+                    rest.pop((t, key), None)
+                else:
+                    rest[t, key] = byte_stream[end:]
+    return min(starts.values()) if starts else 0
+
+
+# Events of every chunk of commands, see convert_commands_to_events
+def trace_event_records(command_chunks, pid_events, timer_origin):
+    states = dict()
+    for commands in command_chunks:
+        yield convert_commands_to_events(commands, pid_events, timer_origin, states)
+
+
+# Earliest timer value any tile started tracing at
+def first_timer_value(commands):
+    starts = [
+        command["cycles"][command["opcode"] == START]
+        for byte_stream_dict in commands
+        for command in byte_stream_dict.values()
+    ]
+    starts = np.concatenate([np.zeros(0, np.int64)] + starts)
+    return int(starts.min()) if len(starts) else 0
+
+
+# The timer and the mask of the active events a tile's commands left
+def new_tile_state():
+    return {"timer": 0, "active": 0}
+
+
+# Events of the commands of the tile of process pid, carrying on from state.
+#
+# Every Single and Multiple first ends the active events, all of them when
+# it counts cycles and else those it does not hold, then begins those of
+# its events not still active after cycles. Its events are the active ones
+# after it, so the events active before a command are those of the
+# Single or Multiple before it.
+def convert_tile_commands(command, pid, state, timer_origin):
+    opcode = command["opcode"].astype(np.int64)
+    cycles = command["cycles"]
+    marks = np.isin(opcode, SINGLE + MULTIPLE)
+    start = opcode == START
+
+    # Timer after every command: a Start sets it, a Single or a Multiple
+    # adds one and its cycles and a Repeat its repeats
+    step = np.where(marks, 1 + cycles, np.where(np.isin(opcode, REPEAT), command["repeats"], 0))
+    total = np.cumsum(step)
+    last_start = np.maximum.accumulate(np.where(start, np.arange(len(opcode)), -1))
+    base = np.where(
+        last_start >= 0,
+        (cycles - timer_origin - total)[np.maximum(last_start, 0)],
+        state["timer"],
+    )
+    timer = base + total
+
+    sel = np.flatnonzero(marks)
+    mask = command["events"][sel].astype(np.int64)
+    active = np.concatenate([[state["active"]], mask[:-1]]).astype(np.int64)
+    counts = cycles[sel] > 0
+    ended = np.where(counts, active, active & ~mask)
+    begun = np.where(counts, mask, mask & ~active)
+    if len(opcode):
+        state["timer"] = int(timer[-1])
+    if len(sel):
+        state["active"] = int(mask[-1])
+
+    # Ends at the timer before the cycles, then begins after them, each by
+    # event #
+    bits = np.arange(NUM_EVENTS)
+    flags = np.hstack([(ended[:, None] >> bits) & 1, (begun[:, None] >> bits) & 1])
+    cmd, col = np.nonzero(flags)
+    events = np.zeros(len(cmd), EVENT_DTYPE)
+    events["pid"] = pid
+    events["tid"] = col % NUM_EVENTS
+    events["ph"] = np.where(col < NUM_EVENTS, b"E", b"B")
+    events["ts"] = timer[sel][cmd] - np.where(col < NUM_EVENTS, cycles[sel][cmd], 0)
+    return events
 
-                    timer = timer + cycles
-
-                    # If its already started, don't start it again ...
-                    try:
-                        if active_events[event] == 0:
-                            # trace_event = {'name':events_to_name[event]}
-                            # trace_event = {'name':lookupEventNameInStr(str(event), pid, pid_events)}
-                            # trace_event = {'name':lookupEventNameInStr(str(event), pid, pid_events)} # TODO
-                            trace_event = {
-                                "name": lookup_event_name_by_type(
-                                    tt, pid_events[tt][loc][event]
-                                )
-                            }
-                            trace_event["ts"] = timer
-                            trace_event["ph"] = "B"
-                            # trace_event['pid'] = 0
-                            trace_event["pid"] = pid
-                            trace_event["tid"] = event
-                            trace_event["args"] = {}
-                            # trace_event['opcode'] = "Single"
-                            trace_events.append(trace_event)
-                            #                active_events[event] = timer  + 1
-                            active_events[event] = 1
-                    except KeyError:
-                        pass
-                    # timer = timer + 1 + int(c['cycles'])
-                elif "Multiple" in t:
-                    cycles = int(c["cycles"])
-
-                    # timer = timer + 1 + int(c['cycles'])
-                    timer = timer + 1
-
-                    # if cycles > 0, deactivate all events
-                    # if cycles == 0, deactivate all events except this one
-
-                    # TODO NO? deactivate all active_events that is not this event
-                    multiple_list = list()
-                    for k in c.keys():
-                        if "event" in k:
-                            multiple_list.append(c[k])
-                    # for k in active_events.keys():
-                    #     if cycles > 0 or (cycles == 0 and k != event):
-                    #         multiple_list.append(k)
-                    deactivate(
-                        multiple_list,
-                        active_events,
-                        timer,
-                        cycles,
-                        pid,
-                        tt,
-                        loc,
-                        pid_events,
-                    )
 
-                    timer = timer + cycles
-
-                    for k in c.keys():
-                        if not "event" in k:
-                            continue
-                        # If its already started, don't start it again ...
-                        try:
-                            event = c[k]
-                            if active_events[event] == 0:
-                                # trace_event = {'name':events_to_name[event]}
-                                # trace_event = {'name':lookupEventNameInStr(str(event), pid, pid_events)} # TODO
-                                trace_event = {
-                                    "name": lookup_event_name_by_type(
-                                        tt, pid_events[tt][loc][event]
-                                    )
-                                }
-                                trace_event["ts"] = timer
-                                trace_event["ph"] = "B"
-                                # trace_event['pid'] = 0
-                                trace_event["pid"] = pid
-                                trace_event["tid"] = event
-                                trace_event["args"] = {}
-                                # trace_event['opcode'] = "Multiple" + str(list(c.keys()))
-                                trace_events.append(trace_event)
-                                #                    active_events[event] = timer  + 1
-                                active_events[event] = 1
-                        except KeyError:
-                            pass
-                    # timer = timer + 1 + int(c['cycles'])
-
-                elif "Repeat" in t:
-                    timer = timer + int(c["repeats"])
-            #        update(timer)
-
-
-def process_name_metadata(trace_events, pid, trace_type, loc):
+# Names of the events of every process
+#
+# return names: dict (key = pid, value = list (idx = tid, value = name))
+def event_names(pid_events):
+    names = dict()
+    for t in range(NumTraceTypes):
+        for loc, labels in pid_events[t].items():
+            names[labels[NUM_EVENTS]] = [
+                lookup_event_name_by_type(t, code) for code in labels[:NUM_EVENTS]
+            ]
+    return names
+
+
+# Chrome trace json of every event, the text json.dumps makes of its dict
+def json_event_strings(events, names):
+    # Text before and after ts of every pid, tid and ph
+    heads = dict()
+    tails = dict()
+    for pid in np.unique(events["pid"]).tolist():
+        heads[pid] = list()
+        tails[pid] = list()
+        for tid in range(NUM_EVENTS):
+            for ph in "BE":
+                heads[pid].append('{"name": ' + json.dumps(names[pid][tid]) + ', "ts": ')
+                tails[pid].append(', "ph": "%s", "pid": %d, "tid": %d, "args": {}}' % (ph, pid, tid))
+    # In the order of the events, like event_dicts
+    idx = 2 * events["tid"].astype(np.int64) + (events["ph"] == b"E")
+    return [
+        heads[pid][i] + str(ts) + tails[pid][i]
+        for pid, i, ts in zip(events["pid"].tolist(), idx.tolist(), events["ts"].tolist())
+    ]
+
+
+# Chrome trace dicts of the events
+def event_dicts(events, names):
+    return [
+        {"name": names[pid][tid], "ts": ts, "ph": ph.decode(), "pid": pid, "tid": tid, "args": {}}
+        for pid, tid, ph, ts in events.tolist()
+    ]
+
+
+def process_name_metadata(trace_events, pid, trace_type, loc, pkt_ids=None):
     trace_event = {"name": "process_name"}
     trace_event["ph"] = "M"
     trace_event["pid"] = pid
@@ -546,6 +651,8 @@ def process_name_metadata(trace_events, pid, trace_type, loc):
         trace_event["args"]["name"] = "intfc_trace for tile" + str(loc)
     elif trace_type == 3:
         trace_event["args"]["name"] = "memtile_trace for tile" + str(loc)
+    if pkt_ids and (trace_type, loc) in pkt_ids:
+        trace_event["args"]["name"] += " pkt " + str(pkt_ids[trace_type, loc])
 
     trace_events.append(trace_event)
 
@@ -565,185 +672,72 @@ def thread_name_metadata(trace_events, trace_type, loc, pid, tid, pid_events):
     trace_events.append(trace_event)
 
 
+# Trace event registers of the tiles, (trace type, first label idx) of
+# every address, each holding the codes of four events a byte apart. The
+# interface tiles, row 0, have theirs at the addresses of the core ones.
+TRACE_EVENT_REGISTERS = {
+    0x340E0: (0, 0),  # core event 0
+    0x340E4: (0, 4),  # core event 1
+    0x140E0: (1, 0),  # mem event 0
+    0x140E4: (1, 4),  # mem event 1
+    0x940E0: (3, 0),  # memtile event 0
+    0x940E4: (3, 4),  # memtile event 1
+}
+INTFC_TRACE_EVENT_REGISTERS = {
+    0x340E0: (2, 0),  # intfc event 0
+    0x340E4: (2, 4),  # intfc event 1
+}
+
+# Attributes of an aiex.npu.write32, values in decimal or hex. MLIR prints
+# them in the order of WRITE32, WRITE32_ATTR reads them in any other.
+WRITE32 = re.compile(
+    r"aiex\.npu\.write32\s*\{\s*address\s*=\s*(0x[0-9a-fA-F]+|\d+)\s*:\s*\w+\s*,"
+    r"\s*column\s*=\s*(\d+)\s*:\s*\w+\s*,\s*row\s*=\s*(\d+)\s*:\s*\w+\s*,"
+    r"\s*value\s*=\s*(0x[0-9a-fA-F]+|\d+)\s*:\s*\w+\s*\}"
+)
+WRITE32_ATTR = re.compile(r"(\w+)\s*=\s*(0x[0-9a-fA-F]+|\d+)\s*:")
+
+# pid_events of the MLIR sources parsed, key = (sha256 of the source, colshift)
+mlir_trace_events_cache = dict()
+
+
+def int_attr(attrs, var):
+    val = attrs.get(var, "0")
+    return int(val, 16) if val.startswith("0x") else int(val)
+
+
 # pid_events: list(idx=pkt_type, value=labels_dict)
 # label_dict: dict(key=row,col, value=labels list)
 # labels_list: list(idx=label idx, value=label code)
-def parse_mlir_trace_events(lines):
-    # arg can be column, row, address or value
-    # 1: arg: 2: val
-    # 3: arg, 4: val
-    # 5: arg, 6: val
-    # 6: arg, 7: val
-
-    # 1: arg: 2: 0x, 3: val
-    # 4: arg, 5: 0x, 6: val
-    # 7: arg, 8: 0x, 9: val
-    # 10: arg, 11: 0x, 12: val
-
-    # TODO Need to check if this line is commented out, check for // ? (harder to check of /* */)
-    # TODO Need to support value in hex with 0x or decimal
-    # pattern = r"AIEX.npu.write32\s*\{\s*(\w+)\s*=\s*(\d+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(\d+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(\w+)\s*:\s*\w+\s*\}"
-    # pattern = r"AIEX.npu.write32\s*\{\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*\}"
-    pattern = r"aiex.npu.write32\s*\{\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*,\s*(\w+)\s*=\s*(0x)?(\w+)\s*:\s*\w+\s*\}"
-
+def parse_mlir_trace_events(lines, colshift=1):
     pid_events = list()
     for t in range(NumTraceTypes):
         pid_events.append(dict())
 
-    for i in range(len(lines)):
-        result = re.search(pattern, lines[i])
-        if result:  # match found
-            address = 0
-            row = 0
-            col = 0
-            value = 0
-            for i2 in range(4):
-                var = result.group(3 * i2 + 1)
-                if var == "address":
-                    if result.group(3 * i2 + 2) == "0x":
-                        address = int(result.group(3 * i2 + 3), 16)
-                    else:  # assume ''
-                        address = int(result.group(3 * i2 + 3))
-                elif var == "row":
-                    # TODO assume no 0x
-                    row = int(result.group(3 * i2 + 3))
-                elif var == "column":
-                    col = int(result.group(3 * i2 + 3)) + colshift
-                    col = 1 if col == 0 else col
-                elif var == "value":
-                    if result.group(3 * i2 + 2) == "0x":
-                        value = int(result.group(3 * i2 + 3), 16)
-                    else:  # assume ''
-                        value = int(result.group(3 * i2 + 3))
-
-                # var = result.group(2*i2+1)
-                # if(var == "address"):
-                #     address = int(result.group(2*i2+2))
-                # elif(var == "row"):
-                #     row = int(result.group(2*i2+2))
-                # elif(var == "column"):
-                #     col = int(result.group(2*i2+2)) + colshift
-                #     col = 1 if col == 0 else col
-                # elif(var == "value"):
-                #     value = int(result.group(2*i2+2))
-
-            # labels_dict = dict()
-            # labels_dict['row'] = row
-            # labels_dict['col'] = col
-            key = str(row) + "," + str(col)
-
-            # core event 0
-            if address == 0x340E0:  # 213216, match ignoring case
-                if pid_events[0].get(key) == None:
-                    pid_events[0][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                # print("Trace event 0 configured to be ",hex(value))
-                pid_events[0][key][0] = value & 0xFF
-                pid_events[0][key][1] = (value >> 8) & 0xFF
-                pid_events[0][key][2] = (value >> 16) & 0xFF
-                pid_events[0][key][3] = (value >> 24) & 0xFF
-            # core event 1
-            elif address == 0x340E4:  # 213220, match ignoring case
-                if pid_events[0].get(key) == None:
-                    pid_events[0][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                pid_events[0][key][4] = value & 0xFF
-                pid_events[0][key][5] = (value >> 8) & 0xFF
-                pid_events[0][key][6] = (value >> 16) & 0xFF
-                pid_events[0][key][7] = (value >> 24) & 0xFF
-            # mem event 0
-            elif address == 0x140E0:  # 82144
-                if pid_events[1].get(key) == None:
-                    pid_events[1][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                # print("Trace event 0 configured to be ",hex(value))
-                pid_events[1][key][0] = value & 0xFF
-                pid_events[1][key][1] = (value >> 8) & 0xFF
-                pid_events[1][key][2] = (value >> 16) & 0xFF
-                pid_events[1][key][3] = (value >> 24) & 0xFF
-            # mem event 1
-            elif address == 0x140E4:  # 82148
-                if pid_events[1].get(key) == None:
-                    pid_events[1][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                pid_events[1][key][4] = value & 0xFF
-                pid_events[1][key][5] = (value >> 8) & 0xFF
-                pid_events[1][key][6] = (value >> 16) & 0xFF
-                pid_events[1][key][7] = (value >> 24) & 0xFF
-            # memtile event 0
-            elif address == 0x940E0:  # 606432
-                if pid_events[3].get(key) == None:
-                    pid_events[3][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                # print("Trace event 0 configured to be ",hex(value))
-                pid_events[3][key][0] = value & 0xFF
-                pid_events[3][key][1] = (value >> 8) & 0xFF
-                pid_events[3][key][2] = (value >> 16) & 0xFF
-                pid_events[3][key][3] = (value >> 24) & 0xFF
-            # memtile event 1
-            elif address == 0x940E4:  # 606436
-                if pid_events[3].get(key) == None:
-                    pid_events[3][key] = [
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                        0,
-                    ]  # TODO no better way to init this?
-                pid_events[3][key][4] = value & 0xFF
-                pid_events[3][key][5] = (value >> 8) & 0xFF
-                pid_events[3][key][6] = (value >> 16) & 0xFF
-                pid_events[3][key][7] = (value >> 24) & 0xFF
-            # TODO intfc event 0, 1 needs to also be defined
-
-    # print("Found labels:\n")
-    # for j in pid_events:
-    #     print("row:",j['row'],", col: ",j['col'])
-    #     print("0: ", j[0], "1: ", j[1], "2: ", j[2], "3: ", j[3])
-    #     print("4: ", j[4], "5: ", j[5], "6: ", j[6], "7: ", j[7])
+    for line in lines:
+        # Only the writes not commented out
+        if "aiex.npu.write32" not in line:
+            continue
+        line = line.split("//")[0]
+        if "aiex.npu.write32" not in line:
+            continue
+        result = WRITE32.search(line)
+        if result:
+            attrs = dict(zip(("address", "column", "row", "value"), result.groups()))
+        else:
+            attrs = dict(WRITE32_ATTR.findall(line))
+        address = int_attr(attrs, "address")
+        row = int_attr(attrs, "row")
+        registers = INTFC_TRACE_EVENT_REGISTERS if row == 0 else TRACE_EVENT_REGISTERS
+        if address not in registers:
+            continue
+        t, idx = registers[address]
+        key = str(row) + "," + str(int_attr(attrs, "column") + colshift)
+        labels = pid_events[t].setdefault(key, [0] * NUM_EVENTS)
+        value = int_attr(attrs, "value")
+        for i in range(4):
+            labels[idx + i] = (value >> (8 * i)) & 0xFF
+
     return pid_events
 
 
@@ -932,175 +926,271 @@ def lookup_event_name_by_type(trace_type, code):
 # This sets up the trace metadata and also assigned the unique pid that's referred
 # eleswhere for each process (combination of tile(row,col) and trace type).
 # NOTE: This assume the pid_events has already be analyzed and populated.
-def setup_trace_metadata(trace_events, pid_events):
+def setup_trace_metadata(trace_events, pid_events, pkt_ids=None):
     pid = 0
     for t in range(NumTraceTypes):
         # for j in len(pid_events[i]):
         for loc in pid_events[t]:  # return loc
-            process_name_metadata(trace_events, pid, t, loc)
+            process_name_metadata(trace_events, pid, t, loc, pkt_ids)
             for e in range(8):
                 thread_name_metadata(trace_events, t, loc, pid, e, pid_events)
                 pid_events[t][loc].append(pid)  # assign unique pid
             pid = pid + 1
 
 
+# Cycles of the phases the cores mark, see trace_phases in src/aie2.py:
+# Event0 starts a transform and Event1 ends each of its steps. The
+# transforms run the passes of phases in turn, count of each. Only the
+# markers are kept of the events added, chunk by chunk, the cores are
+# told apart by the pids setup_trace_metadata gave pid_events.
+#
+# phases: list (idx = pass, value = dict(count, steps = list of step names))
+class PhaseTable:
+    def __init__(self, pid_events, phases):
+        self.phases = phases
+        names = event_names(pid_events)
+        # Marker of every event # of every core, 0 for Event0, 1 for Event1
+        # and -1 for the other events
+        markers = {"Event0": 0, "Event1": 1}
+        self.tiles = dict()
+        for loc, labels in pid_events[0].items():
+            marker = [markers.get(name, -1) for name in names[labels[NUM_EVENTS]]]
+            self.tiles[labels[NUM_EVENTS]] = (loc, np.array(marker))
+        self.markers = dict()
+
+    # events: array of EVENT_DTYPE
+    def add(self, events):
+        events = events[events["ph"] == b"B"]
+        for pid, (loc, marker) in self.tiles.items():
+            sel = events[events["pid"] == pid]
+            kind = marker[sel["tid"]]
+            self.markers.setdefault(pid, list()).append((sel["ts"][kind >= 0], kind[kind >= 0]))
+
+    # return rows: list of (row, col, transform, pass, step, phase name, cycles)
+    def rows(self):
+        phases = self.phases
+        order = [p for p, ph in enumerate(phases) for i in range(ph["count"])]
+        rows = list()
+        for pid, parts in self.markers.items():
+            row, col = self.tiles[pid][0].split(",")
+            ts = np.concatenate([part[0] for part in parts])
+            kind = np.concatenate([part[1] for part in parts])
+            marks = np.lexsort((kind, ts))
+            transform = -1
+            last = None  # markers before the first transform started are partial
+            step = 0
+            for ts, name in zip(ts[marks].tolist(), kind[marks].tolist()):
+                if name == 0:
+                    transform += 1
+                    step = 0
+                    last = ts
+                elif last is not None:
+                    p = order[transform % len(order)]
+                    steps = phases[p]["steps"]
+                    if step < len(steps):
+                        rows.append((int(row), int(col), transform, p, step, steps[step], ts - last))
+                    step += 1
+                    last = ts
+        return sorted(rows)
+
+
 # ------------------------------------------------------------------------------
-# Script execution start - Open trace file and convert to commands
+# Library API
 # ------------------------------------------------------------------------------
 
-opts = parse_args()
 
-# set colshift based on optional argument
-colshift = int(opts.colshift) if opts.colshift else 0
-
-with open(opts.filename, "r") as f:
-    toks = f.read().split("\n")
+# pid_events track the labels associated with pkt_type/ trace and row,col
+#
+# pid_events: list(idx=pkt_type, value=labels_dict)
+# label_dict: dict(key=row,col, value=labels list)
+# labels_list: list(idx=label idx, value=label code), idx=len is pid
+#
+# The pid_events of every MLIR source are kept by the hash of its contents,
+# a copy is returned.
+def read_mlir_trace_events(mlir, colshift=1):
+    with open(mlir, "rb") as mf:
+        source = mf.read()
+    key = (hashlib.sha256(source).hexdigest(), colshift)
+    if key not in mlir_trace_events_cache:
+        lines = source.decode().split("\n")
+        mlir_trace_events_cache[key] = parse_mlir_trace_events(lines, colshift)
+    return [{loc: list(labels) for loc, labels in d.items()} for d in mlir_trace_events_cache[key]]
+
+
+# Stage of the pipeline that prints its chunks in DEBUG
+def debug_stage(title, chunks):
+    for chunk in chunks:
+        if DEBUG:
+            print("\nDEBUG: " + title)
+            print(chunk)
+            print("\n\n")
+        yield chunk
+
+
+# Chunks of the events of the trace file f, arrays of EVENT_DTYPE. Every
+# trace gets its own copy of pid_events with the pids of its tiles, which
+# is yielded ahead of the chunks together with the metadata, the Chrome
+# trace dicts naming the processes and threads. on_commands sees every
+# chunk of commands.
+def trace_event_chunks(f, pid_events, on_commands=None):
+    pid_events = [{loc: list(labels[:NUM_EVENTS]) for loc, labels in d.items()} for d in pid_events]
+
+    # A first pass finds the packet ID of every tile for the metadata and
+    # the timer value the events count from
+    pkt_ids = dict()
+    timer_origin = trace_timer_origin(trace_bytes(trace_packets(read_words(f), pkt_ids)))
+    f.seek(0)
+
+    # pid will be a product of number of trace types and trace tiles
+    metadata = list()
+    setup_trace_metadata(metadata, pid_events, pkt_ids)
+    yield pid_events, metadata
 
     if DEBUG:
-        print("\nDEBUG: toks")
-        print(toks)
+        print("\nDEBUG: pid events\n")
+        print(pid_events)
         print("\n\n")
 
-    # De-interleave core and memory trace
-    # [core_toks, mem_toks] = core_trace_and_mem_trace_de_interleave(toks)
+    # De-interleave core and memory trace, then convert every stream to
+    # commands and the commands to events, a chunk at a time
+    packets = debug_stage("stream", trace_packets(read_words(f), pkt_ids))
+    byte_streams = debug_stage("byte stream", trace_bytes(packets))
+    commands = debug_stage("commands", trace_commands(byte_streams, False))
+    if on_commands is not None:
+        commands = tap_stage(on_commands, commands)
+    yield from trace_event_records(commands, pid_events, timer_origin)
 
-    # TODO Change this to list of toks instead of a fixed set?
-    toks_list = core_trace_and_mem_trace_de_interleave(toks)
 
-    if DEBUG:
-        print("\nDEBUG: stream")
-        print(toks_list)
-        print("\n\n")
+# Stage of the pipeline that hands its chunks to f on the way
+def tap_stage(f, chunks):
+    for chunk in chunks:
+        f(chunk)
+        yield chunk
 
-    bs_0 = convert_to_byte_stream(toks_list)
-    # core_bs_0    = convert_to_byte_stream(core_toks)
-    # mem_bs_0     = convert_to_byte_stream(mem_toks)
-    # intfc_bs_0   = convert_to_byte_stream(intfc_toks)
-    # memtile_bs_0 = convert_to_byte_stream(memtile_toks)
 
-    if DEBUG:
-        print("\nDEBUG: byte stream")
-        print(bs_0)
-        print("\n\n")
+class Trace:
+    """A trace parsed by parse.
 
-    # core_bs_1 = convert_to_byte_stream(core_toks[1])
-    # mem_bs_0 = convert_to_byte_stream(mem_toks[0])
-    # mem_bs_1 = convert_to_byte_stream(mem_toks[1])
+    pid_events holds the event codes and the pid of every tile, metadata
+    the Chrome trace dicts naming its processes and threads. events is an
+    array of EVENT_DTYPE, by tile, and commands a list (idx = trace type)
+    of dicts (key = row,col, value = array of COMMAND_DTYPE).
+    """
 
-    commands_0 = convert_to_commands(bs_0, False)
-    # core_commands_0    = convert_to_commands(core_bs_0, False)
-    # mem_commands_0     = convert_to_commands(mem_bs_0, False)
-    # intfc_commands_0   = convert_to_commands(intfc_bs_0, False)
-    # memtile_commands_0 = convert_to_commands(memtile_bs_0, False)
+    def __init__(self, pid_events, metadata, events, commands):
+        self.pid_events = pid_events
+        self.metadata = metadata
+        self.events = events
+        self.commands = commands
 
-    # core_commands_1 = convert_to_commands(core_bs_1, False)
-    # mem_commands_0 = convert_to_commands(mem_bs_0, False)
-    # mem_commands_1 = convert_to_commands(mem_bs_1, False)
+    def names(self):
+        return event_names(self.pid_events)
 
-if DEBUG:
-    print("\nDEBUG: commands_0")
-    print(commands_0)
-    print("\n\n")
+    def json_events(self):
+        """The metadata and the events as Chrome trace dicts."""
+        return self.metadata + event_dicts(self.events, self.names())
+
+
+def parse(trace, mlir, colshift=1):
+    """Parse a trace file into a Trace.
+
+    mlir is the MLIR source of the design the trace was taken from, or the
+    pid_events read_mlir_trace_events made of it.
+    """
+    if isinstance(mlir, str):
+        mlir = read_mlir_trace_events(mlir, colshift)
+    parts = list()
+    for t in range(NumTraceTypes):
+        parts.append(dict())
+
+    def collect(chunk):
+        for t in range(NumTraceTypes):
+            for key, command in chunk[t].items():
+                parts[t].setdefault(key, list()).append(command)
+
+    with open(trace, "r") as f:
+        chunks = trace_event_chunks(f, mlir, collect)
+        pid_events, metadata = next(chunks)
+        events = np.concatenate([np.zeros(0, EVENT_DTYPE)] + list(chunks))
+    commands = [{key: np.concatenate(c) for key, c in d.items()} for d in parts]
+    return Trace(pid_events, metadata, events, commands)
+
+
+# Write the events of the trace file f to out as they are made, the same
+# json as one json.dumps of their dicts, and the cycles of the phases to
+# the CSV file phase_table
+def write_trace_json(f, out, pid_events, phases=None, phase_table=None):
+    chunks = trace_event_chunks(f, pid_events)
+    pid_events, metadata = next(chunks)
+    names = event_names(pid_events)
+    table = PhaseTable(pid_events, phases) if phase_table else None
+    out.write(json.dumps(metadata)[:-1])
+    sep = ", " if metadata else ""
+    for events in chunks:
+        if table is not None:
+            table.add(events)
+        if len(events):
+            out.write(sep + ", ".join(json_event_strings(events, names)))
+            sep = ", "
+    out.write("]\n")
+
+    if table is not None:
+        with open(phase_table, "w", newline="") as tf:
+            writer = csv.writer(tf)
+            writer.writerow(["row", "col", "transform", "pass", "step", "phase", "cycles"])
+            writer.writerows(table.rows())
+
+
+# Parse the trace file trace into json, and the phase table with phases,
+# next to it in out_dir. Runs in a worker of parse_batch.
+def parse_batch_trace(trace, out_dir, pid_events, phases=None):
+    base = os.path.join(out_dir, os.path.splitext(os.path.basename(trace))[0])
+    phase_table = base + "_phases.csv" if phases is not None else None
+    with open(trace, "r") as f, open(base + ".json", "w") as out:
+        write_trace_json(f, out, pid_events, phases, phase_table)
+    return base + ".json"
+
+
+# Parse every .txt trace of trace_dir, all of the design of one MLIR,
+# with a pool of jobs processes. Returns the json files written.
+def parse_batch(trace_dir, pid_events, out_dir=None, phases=None, jobs=None):
+    traces = sorted(glob.glob(os.path.join(trace_dir, "*.txt")))
+    out_dir = trace_dir if out_dir is None else out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(parse_batch_trace, t, out_dir, pid_events, phases) for t in traces]
+        return [future.result() for future in futures]
 
-# pid_events track the labels associated with pkt_type/ trace and row,col
-#
-# pid_events: list(idx=pkt_type, value=labels_dict)
-# label_dict: dict(key=row,col, value=labels list)
-# labels_list: list(idx=label idx, value=label code), idx=len is pid
-#
-pid_events = list()
-
-if opts.mlir:
-    with open(opts.mlir, "r") as mf:
-        lines = mf.read().split("\n")
-        pid_events = parse_mlir_trace_events(lines)
-# TODO need an else if mlir is not defined, some default or make it required?
-# else:
-
-
-# flat_commands = flatten_repeat_command(commands)
-
-# events_to_name= list()
-# core_events = dict()
-# events_to_name.append(core_events)
-
-# if opts.tracelabels:
-#     for i in range(8):
-#         events_to_name[0][i] = opts.tracelabels[i]
-# else:
-#     events_to_name[0][0] = "Instr_Vector"
-#     events_to_name[0][1] = "Tile Start"
-#     events_to_name[0][2] = "Tile End"
-#     events_to_name[0][3] = "Read A"
-#     events_to_name[0][4] = "Read B"
-#     events_to_name[0][5] = "Write C"
-#     events_to_name[0][6] = "Lock Stall"
-#     events_to_name[0][7] = "Lock Acquire"
-
-# print (json.dumps(commands))
-
-trace_events = list()
-# Let's name the threads
-# active_events = dict()
-
-# for i in range(8):
-# for i in range(16):
-#     active_events[i]  = 0
-# name_dict = dict()
-# # {"name": "thread_name", "ph":"M","pid":0, "tid":0,"args":{"name":"Phil"}}
-# name_dict["name"] = "thread_name"
-# name_dict["ph"]   = "M"           # Metadate
-# name_dict["pid"]  = 0             # We only have one process, but we may want one per core
-# name_dict["tid"]  = i             # I have baked in 8 here, we need this to be informed by how many events are supported
-# name_dict["args"] = {"name":events_to_name[i]}
-# trace_events.append(name_dict)
-
-# timer = 0
-
-# {'type': 'Start', 'timer_value': 0}
-# {'type': 'Single2', 'event': 0, 'cycles': 1161}
-# {'type': 'Single0', 'event': 0, 'cycles': 0}
-# {'type': 'Repeat1', 'repeats': 34}
-# {'type': 'Single0', 'event': 0, 'cycles': 2}
-# {'type': 'Single0', 'event': 0, 'cycles': 0}
-# {'type': 'Repeat1', 'repeats': 24}
-# {'type': 'Multiple0', 'cycles': 0, 'event0': 0, 'event2': 2}
-# {'type': 'Single0', 'event': 0, 'cycles': 0}
-# {'type': 'Repeat0', 'repeats': 4}
-# {'type': 'Single1', 'event': 3, 'cycles': 117}
-# {'type': 'Single1', 'event': 0, 'cycles': 21}
-# {'type': 'Single0', 'event': 0, 'cycles': 0}
-# {'type': 'Repeat1', 'repeats': 21}
-# {'type': 'Multiple0', 'cycles': 0, 'event0': 0, 'event1': 1}
-# {'type': 'Repeat0', 'repeats': 8}
-# {'type': 'Single0', 'event': 1, 'cycles': 0}
 
 # ------------------------------------------------------------------------------
-# Convert commands to json
+# Script execution start - Open trace file and convert to commands
 # ------------------------------------------------------------------------------
 
-# for pid in range(4):
-# for pid in range(1):
-#     process_name_metadata(trace_events, pid)
-#     for tid in range(8):
-#         thread_name_metadata(trace_events, pid, tid, pid_events)
 
-# pid will be a product of number of trace types and trace tiles
+def main():
+    opts = parse_args()
 
-setup_trace_metadata(trace_events, pid_events)
+    # set colshift based on optional argument
+    colshift = int(opts.colshift) if opts.colshift else 1
+    pid_events = read_mlir_trace_events(opts.mlir, colshift)
 
-if DEBUG:
-    print("\nDEBUG: pid events\n")
-    print(pid_events)
-    print("\n\n")
+    phases = None
+    if opts.phase_table or (opts.batch and opts.phases):
+        if not opts.phases:
+            sys.exit("Error: --phase-table needs --phases")
+        with open(opts.phases, "r") as pf:
+            phases = json.load(pf)
 
-# TODO Loop over cores/mem to call convert_commands_to_json
-convert_commands_to_json(trace_events, commands_0, pid_events)
+    try:
+        if opts.batch:
+            for out in parse_batch(opts.batch, pid_events, opts.outdir, phases, opts.jobs):
+                print(out)
+        else:
+            with open(opts.filename, "r") as f:
+                write_trace_json(f, sys.stdout, pid_events, phases, opts.phase_table)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
 
-# convert_commands_to_json(trace_events, mem_commands_0, 1, pid_events)
-# convert_commands_to_json(trace_events, core_commands_1, 2, pid_events)
-# convert_commands_to_json(trace_events, mem_commands_1, 3, pid_events)
 
-# for t in trace_events:
-#     print(t)
-print(json.dumps(trace_events))
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import argparse
+import json
 import math
 import sys
 
+import numpy as np
+
 from aie.dialects.aie import *
 from aie.dialects.aiex import *
 from aie.dialects.scf import *
@@ -9,42 +13,513 @@ from aie.extras.dialects.ext import memref, arith
 
 import aie.utils.trace as trace_utils
 
-
-def ntt(trace_size):
-    logN = 11
+from ntt_model import REDUCTIONS, reduction_constants, to_montgomery, root_generator, check_prime, lazy_bounds
+from schedule import (EXCHANGES, LOCAL_KINDS, EXCHANGE_KINDS, swap_middle, cross_core_phases, held_row,
+                      design_passes, lock_pairs, core_program, lock_name, step_names)
+
+# npu1 exposes up to 4 columns with 4 compute rows each
+DEVICES = {1: AIEDevice.npu1_1col, 2: AIEDevice.npu1_2col, 4: AIEDevice.npu1_4col}
+MAX_ROWS = 4
+TILE_MEMORY_BYTES = 64 * 1024
+# DMA channels of a MemTile in each direction (MM2S, S2MM)
+MEMTILE_DMA_CHANNELS = 6
+# Designs the generator emits:
+#   ntt:     the forward transform (Gentleman-Sande butterflies)
+#   intt:    inverse negacyclic transform, scaled by N^-1
+#   polymul: product in Z_p[x]/(x^N + 1) of two polynomials, forward
+#            Cooley-Tukey transforms, pointwise product and inverse transform
+#            without leaving the array
+#   fourstep: cyclic NTT of bit-reversed input too large for the array,
+#            computed as two passes of batched transforms of sqrt(N) points
+#            with a twiddle multiply in between, see four_step_transfers
+DESIGNS = ("ntt", "intt", "polymul", "fourstep")
+# Shim DMA dimensions wrap at 10 bits
+MAX_WRAP = 1023
+# Polynomials per launch are bounded by the wrap of a shim DMA dimension,
+# polymul reads two per batch entry along it
+MAX_BATCH = MAX_WRAP
+# Radices of the local stages: 2 runs one pass over the core's data per
+# stage, 4 fuses pairs of stages into one pass (ntt_stage0_to_Nminus5_radix4,
+# ntt_ct_local_radix4)
+RADICES = (2, 4)
+# Kernel object of every reduction of ntt_model.REDUCTIONS, and of the lazy
+# butterflies, which take the montgomery reduction
+KERNEL_OBJECTS = {
+    ("barrett", False): "ntt_core.o",
+    ("montgomery", False): "ntt_core_montgomery.o",
+    ("montgomery", True): "ntt_core_montgomery_lazy.o",
+}
+# Trace units of the tiles the design can trace: packet type of their
+# trace packets, address of their Trace_Control0 and Trace_Event0 registers
+# and of their Stream_Switch_Event_Port_Selection_0
+TRACE_UNITS = {
+    "core": dict(packet_type=0, control=0x340D0, events=0x340E0, ports=0x3FF00),
+    "memtile": dict(packet_type=3, control=0x940D0, events=0x940E0, ports=0xB0F00),
+}
+# Events every trace unit records, those of the core are the defaults of
+# trace_utils.configure_simple_tracing_aie2: PortRunning0, Event1 and
+# Event0 (trace_event1 and trace_event0 of the kernels), VectorInstr,
+# LockReleaseInstr, LockAcquireInstr, LockStall, PortRunning1. The MemTile
+# records PortRunning0-7.
+TRACE_EVENTS = {
+    "core": [0x4B, 0x22, 0x21, 0x25, 0x2D, 0x2C, 0x1A, 0x4F],
+    "memtile": [0x50, 0x54, 0x58, 0x5C, 0x60, 0x64, 0x68, 0x6C],
+}
+# Stream switch ports the PortRunning events watch, (master, port): the
+# core watches the data arriving on and leaving its DMA channel 0, the
+# MemTile the data arriving on (S2MM) and leaving (MM2S) its DMA channels 0-3
+TRACE_PORTS = {
+    "core": [(1, 1), (0, 1)],
+    "memtile": [(1, 0), (1, 1), (1, 2), (1, 3), (0, 0), (0, 1), (0, 2), (0, 3)],
+}
+
+
+def trace_tiles_of(spec, n_column, n_row):
+    """Tiles to trace named by spec, in the order of their packet IDs.
+
+    Every entry of spec is "C,R" for the core of column C on compute row
+    R, "C,mem" for the MemTile of column C, "cores", "memtiles" or "all".
+    Returns (kind, column, row) tuples of TRACE_UNITS kinds, row is the
+    compute row of a core and None for a MemTile. The cores come first,
+    the trace unit of the first one is set up along with the shim DMA
+    writing the trace buffer, so at least one core must be traced.
+    """
+    tiles = []
+    for entry in spec:
+        if entry in ("cores", "all"):
+            tiles += [("core", c, r) for c in range(n_column) for r in range(n_row)]
+        if entry in ("memtiles", "all"):
+            tiles += [("memtile", c, None) for c in range(n_column)]
+        if entry in ("cores", "memtiles", "all"):
+            continue
+        try:
+            c, r = entry.split(",")
+            c = int(c)
+            tile = ("memtile", c, None) if r == "mem" else ("core", c, int(r))
+        except ValueError:
+            raise ValueError(f"trace tiles are C,R, C,mem, cores, memtiles or all, got {entry}")
+        if not 0 <= c < n_column or not (tile[2] is None or 0 <= tile[2] < n_row):
+            raise ValueError(f"trace tile {entry} is not on the {n_column}x{n_row} grid")
+        tiles.append(tile)
+    # Drop repeated tiles, every tile sends its trace under one packet ID
+    tiles = sorted(dict.fromkeys(tiles), key=lambda tile: tile[0] != "core")
+    if not tiles or tiles[0][0] != "core":
+        raise ValueError("the traced tiles must include a core")
+    return tiles
+
+
+def configure_tile_tracing(tile, kind, packet_id, start=0x1, stop=0x0):
+    # Trace unit of a tile sending packets to a shim DMA channel that is
+    # already set up, the tile side of
+    # trace_utils.configure_simple_tracing_aie2
+    unit = TRACE_UNITS[kind]
+    col, row = int(tile.col), int(tile.row)
+    events = TRACE_EVENTS[kind]
+    ports = [(master << 5) | port for master, port in TRACE_PORTS[kind]]
+    ports += [0] * (8 - len(ports))
+    npu_write32(column=col, row=row, address=unit["control"], value=(stop << 24) | (start << 16))
+    npu_write32(column=col, row=row, address=unit["control"] + 4, value=(unit["packet_type"] << 12) | packet_id)
+    for i in range(2):
+        npu_write32(column=col, row=row, address=unit["events"] + 4 * i,
+                    value=sum(e << (24 - 8 * j) for j, e in enumerate(events[4 * i:4 * i + 4])))
+        npu_write32(column=col, row=row, address=unit["ports"] + 4 * i,
+                    value=sum(p << (8 * j) for j, p in enumerate(ports[4 * i:4 * i + 4])))
+
+
+def transform_grid(logN, n_column, n_limbs, design):
+    # log2 of the points of one transform on the array and the columns it
+    # spans: the four-step design transforms the rows and columns of a
+    # 2^(logN/2) square on every column, RNS limbs split the columns
+    if design == "fourstep":
+        return logN // 2, 1
+    return logN, n_column // n_limbs
+
+
+def as_primes(p):
+    # A single modulus or a sequence of RNS primes, one per limb
+    return [p] if isinstance(p, int) else list(p)
+
+
+def make_roots(N, p, g=None):
+    # Same table as make_roots of the host: root[i] = w^i, w = g^((p-1)/N)
+    w = pow(root_generator(p) if g is None else g, (p - 1) // N, p)
+    roots = [1] * N
+    for i in range(1, N):
+        roots[i] = roots[i - 1] * w % p
+    return roots
+
+
+def root_table_len(data_percore):
+    # Local roots at [1, data_percore), then one root per cross-core stage,
+    # padded to a whole vector
+    return data_percore + 16
+
+
+def bit_reverse(i, bits):
+    return int(f"{i:0{bits}b}"[::-1], 2) if bits else 0
+
+
+def root_power_len(N, design):
+    # Length of the host table of root powers the per-core tables index
+    return N if design in ("ntt", "fourstep") else 2 * N
+
+
+def root_table_indices(logN, n_column, n_row, design="ntt", exchange="shared"):
+    """Compacted root tables of every core as indices into the host table.
+
+    ntt_stage0_to_Nminus5 is called with N_all = data_percore and
+    core_idx = 0, so local stage s reads entries [dpc >> (s+1), dpc >> s),
+    which hold the roots the core would read at N_all = N. ntt_ct_local
+    reads the same entries in the opposite order. The root of cross-core
+    stage i (ntt_1stage, ntt_1stage_ct) is stored at data_percore + i.
+    Index 0 and the padding point at root 0, i.e. 1.
+
+    For ntt the host table holds w^i, w = g^((p-1)/N), and entry j of the
+    full table is w^j. The negacyclic designs use psi^bitrev(j) instead,
+    psi = g^((p-1)/2N), and its inverse psi^(2N - bitrev(j)), so their host
+    table holds psi^i for i < 2N. The sub-transforms of fourstep are cyclic
+    NTTs of bit-reversed input, entry h + i, h = 2^floor(log2(h + i)),
+    holds w^bitrev(i) over logN - 1 bits.
+
+    Returns, per core in the order core_idx = n_row * c + r, the tables it
+    acquires: [forward] for ntt and fourstep, [inverse] for intt and
+    [forward, inverse] for polymul.
+    """
+    n_core = n_column * n_row
     N = 1 << logN
-    N_in_bytes = N * 4
-    p = 3329
-    barrett_w = math.ceil(math.log2(p))
-    barrett_u = math.floor(pow(2, 2 * barrett_w) / p)
+    data_percore = N // n_core
+    full = []
+    for c in range(n_column):
+        for r in range(n_row):
+            core_idx = n_row * c + r
+            table = [0] * root_table_len(data_percore)
+            for j in range(1, data_percore):
+                h = 1 << (j.bit_length() - 1)
+                table[j] = h * (n_core + core_idx - 1) + j
+            full.append(table)
+    for phase in cross_core_phases(n_column, n_row, exchange):
+        for op in phase:
+            if op.kind in ("ntt", "xntt"):
+                c, r = op.core
+                full[n_row * c + r][data_percore + op.stage] = (1 << op.stage) + op.block // (n_core >> op.stage)
+    if design == "ntt":
+        return [[table] for table in full]
+    if design == "fourstep":
+        return [[[bit_reverse(e - (1 << (e.bit_length() - 1)), logN - 1) if e else 0 for e in table]]
+                for table in full]
+    forward = [[bit_reverse(j, logN) for j in table] for table in full]
+    inverse = [[(2 * N - e) % (2 * N) for e in table] for table in forward]
+    if design == "intt":
+        return [[table] for table in inverse]
+    return [list(tables) for tables in zip(forward, inverse)]
+
+
+def host_root_indices(logN, n_column, n_row, design="ntt", n_limbs=1, exchange="shared"):
+    # Root tables in the order the shim DMAs send them: per column, each
+    # table kind for all its rows. With RNS limbs the host table holds the
+    # root powers of every prime back to back. fourstep keeps its roots in
+    # tile memory and takes the twiddles w^(bitrev(b) k) instead, row b of
+    # the square for block b of the input.
+    if design == "fourstep":
+        M = 1 << (logN // 2)
+        return [bit_reverse(b, logN // 2) * k for b in range(M) for k in range(M)]
+    limb_columns = n_column // n_limbs
+    tables = root_table_indices(logN, limb_columns, n_row, design, exchange)
+    limb_len = root_power_len(1 << logN, design)
+    indices = []
+    for c in range(n_column):
+        limb, lc = divmod(c, limb_columns)
+        for t in range(len(tables[0])):
+            for r in range(n_row):
+                indices += [limb * limb_len + i for i in tables[n_row * lc + r][t]]
+    return indices
+
+
+def design_schedule(logN, n_column, n_row, design="ntt", n_limbs=1, exchange="shared", batch=1):
+    # Passes of the schedule every core program and lock fifo is generated
+    # from, fourstep runs one transform per row (column) of its square
+    logN_sub, group_columns = transform_grid(logN, n_column, n_limbs, design)
+    count = (1 << logN_sub) // n_column if design == "fourstep" else batch
+    return design_passes(design, n_column, n_row, n_column // group_columns, exchange, count)
 
-    n_column = 4
-    n_row = 4
+
+def trace_phases(logN, n_column, n_row, design="ntt", n_limbs=1, exchange="shared", batch=1):
+    """Phases the traced cores mark, for scripts/parse_trace.py --phases.
+
+    Every core marks the start of each transform with trace_event0 and the
+    end of each step with trace_event1. Returns per pass the transforms it
+    runs per launch and the names of its steps, see step_names.
+    """
+    return [{"count": p.count, "steps": step_names(p.steps)}
+            for p in design_schedule(logN, n_column, n_row, design, n_limbs, exchange, batch)]
+
+
+def tile_memory_bytes(logN, n_column, n_row, buffer_depth=2, resident_roots=False, design="ntt", exchange="shared"):
+    # Input and output object fifos, the root tables (fifo or resident
+    # buffers), the two half buffers, for polymul buffx / buffy, for
+    # fourstep the twiddle fifo and for the memtile exchange the received
+    # half and the exchange fifos. logN and n_column describe one transform
+    # on the array, see transform_grid.
+    N = 1 << logN
+    data_percore = N // (n_column * n_row)
+    n_tables = 2 if design == "polymul" else 1
+    # Streamed roots are copied out of one element of the column's tables
+    roots = root_table_len(data_percore) * (n_tables if resident_roots else n_tables + n_row)
+    products = 2 * data_percore if design == "polymul" else 0
+    # Four-step twiddles arrive as the whole column's block
+    twiddles = buffer_depth * n_row * data_percore if design == "fourstep" else 0
+    half = data_percore // 2
+    exchanged = half + buffer_depth * (half + n_row * half) if exchange == "memtile" and n_row > 1 else 0
+    return 4 * (2 * buffer_depth * data_percore + roots + data_percore + products + twiddles + exchanged)
+
+
+def memtile_channels(n_row, resident_roots=False, design="ntt", exchange="shared"):
+    """MM2S and S2MM channels of the MemTile of a column.
+
+    Every object fifo linked through the MemTile takes one channel on its
+    side of the MemTile, a distribute or join one per row and a broadcast
+    one for all rows.
+    """
+    mm2s = n_row + 1  # input distribute, output
+    s2mm = 1 + n_row  # input, output join
+    if not resident_roots:
+        mm2s += 1
+        s2mm += 1
+    if design == "fourstep":
+        mm2s += 1
+        s2mm += 1
+    if exchange == "memtile" and n_row > 1:
+        mm2s += 1
+        s2mm += n_row
+    return mm2s, s2mm
+
+
+def check_params(logN, n_column, n_row, p=3329, resident_roots=False, design="ntt", exchange="shared", buffer_depth=2, reduction="barrett", lazy=False, radix=2, batch=1):
+    primes = as_primes(p)
+    if design not in DESIGNS:
+        raise ValueError(f"design must be one of {', '.join(DESIGNS)}, got {design}")
+    n_inputs = 2 if design == "polymul" else 1
+    if not 1 <= batch <= MAX_BATCH // n_inputs:
+        raise ValueError(f"batch must be between 1 and {MAX_BATCH // n_inputs} for {design}, got {batch}")
+    if exchange not in EXCHANGES:
+        raise ValueError(f"exchange must be one of {', '.join(EXCHANGES)}, got {exchange}")
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"reduction must be one of {', '.join(REDUCTIONS)}, got {reduction}")
+    if radix not in RADICES:
+        raise ValueError(f"radix must be one of {', '.join(map(str, RADICES))}, got {radix}")
+    if exchange == "memtile":
+        # A compute tile has two input DMA channels, taken by the input and
+        # the exchange, so the roots stay resident
+        if design == "fourstep":
+            raise ValueError("the four-step design streams its twiddles, it cannot use the memtile exchange")
+        if n_row == MAX_ROWS:
+            # The exchange joins one fifo per row next to the output join
+            in_channels = memtile_channels(n_row, True, design, exchange)[1]
+            raise ValueError(f"the memtile exchange on {n_row} rows needs {in_channels} S2MM channels of a MemTile, it has {MEMTILE_DMA_CHANNELS}")
+        resident_roots = True
+    if n_column not in DEVICES:
+        raise ValueError(f"columns must be one of {sorted(DEVICES)}, got {n_column}")
+    if n_row not in (1, 2, MAX_ROWS):
+        raise ValueError(f"rows must be 1, 2 or {MAX_ROWS}, got {n_row}")
+    if buffer_depth < 1:
+        raise ValueError(f"buffer depth must be at least 1, got {buffer_depth}")
+    if not primes or n_column % len(primes) != 0:
+        raise ValueError(f"{len(primes)} primes do not split {n_column} columns evenly")
+    if design == "fourstep":
+        if len(primes) != 1:
+            raise ValueError("the four-step design takes a single prime")
+        if logN % 2 != 0:
+            raise ValueError(f"the four-step design splits 2^{logN} points into a square, logN must be even")
+        if 1 << (logN // 2) > MAX_WRAP:
+            raise ValueError(f"the four-step design transposes 2^{logN // 2}-point columns, at most {MAX_WRAP} fit a shim DMA dimension")
+        resident_roots = True
+    mm2s, s2mm = memtile_channels(n_row, resident_roots, design, exchange)
+    if max(mm2s, s2mm) > MEMTILE_DMA_CHANNELS:
+        raise ValueError(f"{design} on {n_row} rows needs {mm2s} MM2S and {s2mm} S2MM channels of a MemTile, it has {MEMTILE_DMA_CHANNELS}")
+    sub_logN, group_columns = transform_grid(logN, n_column, len(primes), design)
+    data_percore = (1 << sub_logN) // (group_columns * n_row)
+    if data_percore < 32:
+        raise ValueError(f"2^{sub_logN} points on {group_columns * n_row} cores leave {data_percore} per core, at least 32 needed")
+    if tile_memory_bytes(sub_logN, group_columns, n_row, buffer_depth, resident_roots, design, exchange) > TILE_MEMORY_BYTES:
+        raise ValueError(f"2^{sub_logN} points on {group_columns}x{n_row} cores do not fit in {TILE_MEMORY_BYTES} bytes of tile memory")
+    for q in primes:
+        # The lane model of the kernels proves their arithmetic mod q, and
+        # the bounds of the lazy kernels through the design
+        check_prime(q, reduction, lazy)
+        if lazy:
+            lazy_bounds(q, logN, design, reduction)
+        if design in ("intt", "polymul") and (q - 1) % (2 << logN) != 0:
+            raise ValueError(f"the negacyclic {design} needs p = 1 mod 2^{logN + 1}, got p = {q}")
+        if design == "fourstep" and (q - 1) % (1 << logN) != 0:
+            raise ValueError(f"the four-step design needs p = 1 mod 2^{logN}, got p = {q}")
+
+
+def batch_transfer(N, n_column, batch, c, offset=0):
+    """Shim DMA access pattern of column c's share of `batch` polynomials.
+
+    The polynomials start `offset` elements into the host buffer.
+    Contiguous transfers stay one-dimensional. Otherwise the batch is the
+    outer dimension striding over whole polynomials and the column share is
+    cut into chunks that fit the 10-bit wrap of the inner dimensions.
+    """
+    size = N // n_column
+    if n_column == 1 or batch == 1:
+        return dict(sizes=[1, 1, 1, batch * size], offsets=[0, 0, 0, offset + c * size])
+    chunk = min(size, 512)
+    return dict(sizes=[1, batch, size // chunk, chunk], offsets=[0, 0, 0, offset + c * size], strides=[0, N, chunk, 1])
+
+
+def four_step_transfers(logN, n_column, c):
+    """Shim DMA access patterns of column c in the two four-step passes.
+
+    The bit-reversed input of N = M^2 points is an M x M matrix whose row
+    b holds column n2 = bitrev(b) of x[M n1 + n2], in bit-reversed order
+    of n1. Pass 1 transforms the rows, multiplies them by the twiddles and
+    writes them to the output. Pass 2 transforms the columns of the output
+    in place, reading and writing them with stride M, which leaves the
+    result in natural order. Every column takes M / n_column rows, then as
+    many columns.
+
+    Returns the patterns of (pass 1, pass 2).
+    """
+    M = 1 << (logN // 2)
+    share = M // n_column
+    rows = batch_transfer(M, 1, share, 0, c * share * M)
+    columns = dict(sizes=[1, share, M, 1], offsets=[0, 0, 0, c * share], strides=[0, 1, M, 1])
+    return rows, columns
+
+
+def ntt(logN=11, n_column=4, n_row=4, p=3329, trace_size=0, batch=1, resident_roots=False, design="ntt", exchange="shared", buffer_depth=2, reduction="barrett", lazy=False, radix=2, trace_tiles=("0,0",)):
+    """Generate the NTT design in the current MLIR context.
+
+    design is one of DESIGNS. polymul takes two polynomials per batch
+    entry, stored one after the other, and returns their product.
+
+    p is one prime or a sequence of RNS primes. With k primes every limb
+    runs on n_column / k columns with its own modulus, Barrett constants
+    and roots, and the output holds the k limbs of the batch one after the
+    other. ntt and polymul transform the same input, whose coefficients
+    must be below every prime, under all of them. intt takes one input
+    limb per prime.
+
+    Every core only holds the roots it uses, see root_table_indices. The
+    host passes these tables back to back as the root argument. With
+    resident_roots they are placed in every compute tile as the initial
+    value of a buffer, loaded with the design instead of being streamed
+    from the host on every launch, and the root argument is left unused.
+
+    fourstep always keeps its roots resident and takes the twiddles of
+    host_root_indices as the root argument. Every column transforms its
+    share of the rows, then of the columns of the 2^(logN/2) square, see
+    four_step_transfers.
+
+    exchange is one of EXCHANGES, see cross_core_phases. The memtile
+    exchange also keeps the roots resident.
+
+    buffer_depth is the depth of the data object fifos, 2 for double
+    buffering.
+
+    reduction is one of REDUCTIONS. With montgomery the cores run the
+    kernels of KERNEL_OBJECTS["montgomery", False], and the resident roots
+    and the scale factors are passed in Montgomery form, see to_montgomery.
+    The host converts the roots and twiddles it streams the same way.
+
+    lazy runs the kernels built with NTT_LAZY, whose butterflies keep their
+    outputs in [0, 2p) and leave the full reduction to the write back, see
+    lazy_bounds. They take the montgomery reduction and primes below 2^29.
+
+    radix is one of RADICES, the radix of the stages each core runs on its
+    own data before the cross-core stages. The cross-core stages pair two
+    cores each and stay radix 2.
+
+    With trace_size > 0 the cores and MemTiles of trace_tiles, see
+    trace_tiles_of, send their trace packets with packet IDs 0, 1, ... to
+    a shared buffer of trace_size bytes per tile behind the output.
+    """
+    check_params(logN, n_column, n_row, p, resident_roots, design, exchange, buffer_depth, reduction, lazy, radix, batch)
+    if design == "fourstep" and batch != 1:
+        raise ValueError("the four-step design transforms one polynomial per launch")
+    resident_roots = resident_roots or design == "fourstep" or exchange == "memtile"
+    N = 1 << logN
+    primes = as_primes(p)
+    n_limbs = len(primes)
+    limb_columns = n_column // n_limbs
+    # Points and columns of one transform on the array
+    logN_sub, group_columns = transform_grid(logN, n_column, n_limbs, design)
+    N_sub = 1 << logN_sub
+    N_out_bytes = n_limbs * batch * N * 4
+    # Modulus, reduction constants and output scale N^-1 of every limb. The
+    # pointwise product of polymul takes one more factor 2^-32 in Montgomery
+    # form, which the scale makes up for
+    moduli = []
+    for q in primes:
+        n_inv = to_montgomery(pow(N_sub, -1, q), q, reduction)
+        if design == "polymul":
+            n_inv = to_montgomery(n_inv, q, reduction)
+        moduli.append((q, *reduction_constants(q, reduction, lazy), n_inv))
+
+    traced = trace_tiles_of(trace_tiles, n_column, n_row) if trace_size > 0 else []
     n_core = n_column * n_row
-    data_percolumn = N // n_column
-    data_percore = N // n_core
+    data_percolumn = N_sub // group_columns
+    data_percore = data_percolumn // n_row
     data_percore_log2 = int(math.log2(data_percore))
-    
-    buffer_depth = 2
+    n_inputs = 2 if design == "polymul" else 1
+    in_limbs = n_limbs if design == "intt" else 1
 
-    @device(AIEDevice.npu1_4col)
+    # Every core program and lock fifo below is generated from this schedule
+    passes = design_schedule(logN, n_column, n_row, design, n_limbs, exchange, batch)
+    root_tables = root_table_indices(logN_sub, group_columns, n_row, design, exchange)
+    n_tables = len(root_tables[0])
+
+    @device(DEVICES[n_column])
     def device_body():
-        memRef_ty_vec = T.memref(N, T.i32())
+        memRef_ty_roots = T.memref(root_table_len(data_percore), T.i32())
+        memRef_ty_roots_column = T.memref(n_row * root_table_len(data_percore), T.i32())
+        memRef_ty_roots_all = T.memref(N if design == "fourstep" else n_tables * n_core * root_table_len(data_percore), T.i32())
+        memRef_ty_batch_in = T.memref(in_limbs * n_inputs * batch * N, T.i32())
+        memRef_ty_batch = T.memref(n_limbs * batch * N, T.i32())
         memRef_ty_column = T.memref(data_percolumn, T.i32())
         memRef_ty_core = T.memref(data_percore, T.i32())
         memRef_ty_core_half = T.memref(data_percore // 2, T.i32())
         memRef_ty_scalar = T.memref(1, T.i32())
+        memRef_ty_exchange = T.memref(n_row * data_percore // 2, T.i32())
 
         # AIE Core Function declarations
         # void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0, int32_t *c_out1, int32_t N, int32_t logN, int32_t N_all, int32_t core_idx, int32_t p, int32_t w, int32_t u) {
+        # ntt_stage0_to_Nminus5_radix4 takes the same arguments
         ntt_stage0_to_Nminus5 = external_func(
-            "ntt_stage0_to_Nminus5",
-            inputs=[memRef_ty_core, memRef_ty_vec, memRef_ty_core_half, memRef_ty_core_half, T.i32(), T.i32(), T.i32(), T.i32(), T.i32(), T.i32(), T.i32()],
+            "ntt_stage0_to_Nminus5" + ("_radix4" if radix == 4 else ""),
+            inputs=[memRef_ty_core, memRef_ty_roots, memRef_ty_core_half, memRef_ty_core_half, T.i32(), T.i32(), T.i32(), T.i32(), T.i32(), T.i32(), T.i32()],
         )
-        # void ntt_1stage(int32_t idx_stage, int32_t N, int32_t core_idx, int32_t n_core, int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p, int32_t w, int32_t u) {
+        # void ntt_1stage(int32_t root_idx, int32_t N, int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p, int32_t w, int32_t u) {
         ntt_1stage = external_func(
             "ntt_1stage",
-            inputs=[T.i32(), T.i32(), T.i32(), T.i32(), memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_vec, T.i32(), T.i32(), T.i32()],
+            inputs=[T.i32(), T.i32(), memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_roots, T.i32(), T.i32(), T.i32()],
+        )
+
+        # void ntt_1stage_ct(int32_t root_idx, int32_t N, int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p, int32_t w, int32_t u) {
+        ntt_1stage_ct = external_func(
+            "ntt_1stage_ct",
+            inputs=[T.i32(), T.i32(), memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_roots, T.i32(), T.i32(), T.i32()],
+        )
+
+        # void ntt_ct_local(int32_t *a0, int32_t *a1, int32_t *root_in, int32_t *c_out, int32_t N, int32_t p, int32_t w, int32_t u) {
+        # ntt_ct_local_radix4 takes the same arguments
+        ntt_ct_local = external_func(
+            "ntt_ct_local" + ("_radix4" if radix == 4 else ""),
+            inputs=[memRef_ty_core_half, memRef_ty_core_half, memRef_ty_roots, memRef_ty_core, T.i32(), T.i32(), T.i32(), T.i32()],
+        )
+
+        # void load_halves(int32_t *from, int32_t *a, int32_t *b, int32_t N_ab) {
+        load_halves = external_func(
+            "load_halves",
+            inputs=[memRef_ty_core, memRef_ty_core_half, memRef_ty_core_half, T.i32()],
+        )
+
+        # void pointwise_mul(int32_t *out, int32_t *a, int32_t *b, int32_t N, int32_t p, int32_t w, int32_t u) {
+        pointwise_mul = external_func(
+            "pointwise_mul",
+            inputs=[memRef_ty_core, memRef_ty_core, memRef_ty_core, T.i32(), T.i32(), T.i32(), T.i32()],
         )
 
         # void swap(int32_t *a, int32_t *b, int32_t N) {
@@ -59,6 +534,42 @@ def ntt(trace_size):
             inputs=[memRef_ty_core, memRef_ty_core_half, memRef_ty_core_half, T.i32()],
         )
 
+        # void write_back_reduced(int32_t *to, int32_t *a, int32_t *b, int32_t N_ab, int32_t p) {
+        write_back_reduced = external_func(
+            "write_back_reduced",
+            inputs=[memRef_ty_core, memRef_ty_core_half, memRef_ty_core_half, T.i32(), T.i32()],
+        )
+
+        # void load_roots(int32_t *to, int32_t *from, int32_t offset, int32_t N) {
+        load_roots = external_func(
+            "load_roots",
+            inputs=[memRef_ty_roots, memRef_ty_roots_column, T.i32(), T.i32()],
+        )
+
+        # void write_back_scaled(int32_t *to, int32_t *a, int32_t *b, int32_t N_ab, int32_t scale, int32_t p, int32_t w, int32_t u) {
+        write_back_scaled = external_func(
+            "write_back_scaled",
+            inputs=[memRef_ty_core, memRef_ty_core_half, memRef_ty_core_half, T.i32(), T.i32(), T.i32(), T.i32(), T.i32()],
+        )
+
+        # void write_back_mul(int32_t *to, int32_t *a, int32_t *b, int32_t *tw, int32_t offset, int32_t N_ab, int32_t p, int32_t w, int32_t u) {
+        write_back_mul = external_func(
+            "write_back_mul",
+            inputs=[memRef_ty_core, memRef_ty_core_half, memRef_ty_core_half, memRef_ty_column, T.i32(), T.i32(), T.i32(), T.i32(), T.i32()],
+        )
+
+        # void exchange_put(int32_t *to, int32_t *from, int32_t N) {
+        exchange_put = external_func(
+            "exchange_put",
+            inputs=[memRef_ty_core_half, memRef_ty_core_half, T.i32()],
+        )
+
+        # void exchange_get(int32_t *to, int32_t *from, int32_t offset, int32_t N) {
+        exchange_get = external_func(
+            "exchange_get",
+            inputs=[memRef_ty_core_half, memRef_ty_exchange, T.i32(), T.i32()],
+        )
+
         trace_event0 = external_func(
             "trace_event0",
             inputs=[],
@@ -91,17 +602,53 @@ def ntt(trace_size):
             for r in range(n_row):
                 # Create link MemTile -> ComputeTile
                 of_ins_core[c].append(object_fifo(of_ins_core_names[c][r], MemTiles[c], ComputeTiles[c][r], buffer_depth, memRef_ty_core))
-            object_fifo_link(of_ins[c], of_ins_core[c])
+            if design == "polymul":
+                # Row r of the column goes to the core it starts on
+                object_fifo_link(of_ins[c], [of_ins_core[c][held_row(r, n_row, exchange)] for r in range(n_row)])
+            else:
+                object_fifo_link(of_ins[c], of_ins_core[c])
 
         # Input Root
         of_inroots = []
         of_inroots_core = []
         of_inroots_name = [f"inroots{c}" for c in range(n_column)]
         of_inroots_core_names = [f"inroots_core{c}" for c in range(n_column)]
-        for c in range(n_column):
-            of_inroots.append(object_fifo(of_inroots_name[c], ShimTiles[c], MemTiles[c], buffer_depth, memRef_ty_vec))
-            of_inroots_core.append(object_fifo(of_inroots_core_names[c], MemTiles[c], ComputeTiles[c][0:n_row], buffer_depth, memRef_ty_vec))
-            object_fifo_link(of_inroots[c], of_inroots_core[c])
+        buffs_root = [[] for c in range(n_column)]
+        if resident_roots:
+            roots = [np.array([to_montgomery(x, q, reduction) for x in make_roots(root_power_len(N_sub, design), q)], dtype=np.int32)
+                     for q in primes]
+            names = {"ntt": ["roots"], "intt": ["iroots"], "polymul": ["roots", "iroots"], "fourstep": ["roots"]}[design]
+            for c in range(n_column):
+                limb = c // limb_columns
+                for r in range(n_row):
+                    tables = root_tables[n_row * (c % group_columns) + r]
+                    buffs_root[c].append([Buffer(ComputeTiles[c][r], [root_table_len(data_percore)], T.i32(), f"{name}_{c}_{r}", initial_value=roots[limb][table])
+                                          for name, table in zip(names, tables)])
+        else:
+            # An element holds one table of every row of the column, which
+            # the MemTile broadcasts on a single channel. Every core copies
+            # its own table out of it and releases it at once, so the MemTile
+            # holds the tables of the next launch while the cores compute
+            for c in range(n_column):
+                # Create link ShimTile -> MemTile
+                of_inroots.append(object_fifo(of_inroots_name[c], ShimTiles[c], MemTiles[c], n_tables, memRef_ty_roots_column))
+                # Create link MemTile -> ComputeTiles
+                of_inroots_core.append(object_fifo(of_inroots_core_names[c], MemTiles[c], ComputeTiles[c][0:n_row], 1, memRef_ty_roots_column))
+                object_fifo_link(of_inroots[c], of_inroots_core[c])
+                for r in range(n_row):
+                    buffs_root[c].append([Buffer(ComputeTiles[c][r], [root_table_len(data_percore)], T.i32(), f"roots{t}_{c}_{r}")
+                                          for t in range(n_tables)])
+
+        # Four-step twiddles, broadcast to all rows on one MemTile channel;
+        # every core multiplies by the block it holds after the row swap
+        of_tws = []
+        of_tws_core = []
+        of_tws_names = [f"tw{c}" for c in range(n_column)]
+        if design == "fourstep":
+            for c in range(n_column):
+                of_tws.append(object_fifo(of_tws_names[c], ShimTiles[c], MemTiles[c], buffer_depth, memRef_ty_column))
+                of_tws_core.append(object_fifo(f"tw_core{c}", MemTiles[c], ComputeTiles[c][0:n_row], buffer_depth, memRef_ty_column))
+                object_fifo_link(of_tws[c], of_tws_core[c])
 
         # Output Array
         of_outs = []
@@ -112,7 +659,9 @@ def ntt(trace_size):
             of_outs.append(object_fifo(of_outs_names[c], MemTiles[c], ShimTiles[c], buffer_depth, memRef_ty_column))
             for r in range(n_row):
                 of_outs_core[c].append(object_fifo(of_outs_core_names[c][r], ComputeTiles[c][r], MemTiles[c], buffer_depth, memRef_ty_core))
-            object_fifo_link(of_outs_core[c], of_outs[c])
+            # Block r of the column comes from the core holding it after the
+            # row swap
+            object_fifo_link([of_outs_core[c][held_row(r, n_row, exchange)] for r in range(n_row)], of_outs[c])
 
         # Buffer
         buffs_a0 = [[] for c in range(n_column)]
@@ -123,220 +672,260 @@ def ntt(trace_size):
             for r in range(n_row):
                 buffs_a0[c].append(Buffer(ComputeTiles[c][r], [data_percore // 2], T.i32(), buffs_a0_names[c][r]))
                 buffs_a1[c].append(Buffer(ComputeTiles[c][r], [data_percore // 2], T.i32(), buffs_a1_names[c][r]))
-        
-        # Lock
-        of_lock_up = [[] for c in range(n_column)]
-        of_lock_up_names = [[f"lock_up{c}{r}_{c}{r+1}" for r in range(0, n_row - 1)] for c in range(n_column)]
-        for c in range(n_column):
-            for r in range(n_row - 1):
-                of_lock_up[c].append(object_fifo(of_lock_up_names[c][r], ComputeTiles[c][r], ComputeTiles[c][r + 1], 1, memRef_ty_scalar))
-
-        of_lock_down = [[] for c in range(n_column)]
-        of_lock_down_names = [[f"lock_down{c}{r+1}_{c}{r}" for r in range(0, n_row - 1)] for c in range(n_column)]
-        for c in range(n_column):
-            for r in range(n_row - 1):
-                of_lock_down[c].append(object_fifo(of_lock_down_names[c][r], ComputeTiles[c][r + 1], ComputeTiles[c][r], 1, memRef_ty_scalar))
-
-        of_lock_left = [[] for r in range(n_row)]
-        of_lock_left_names = [[f"lock_left{c+1}{r}_{c}{r}" for c in range(0, n_column - 1)] for r in range(n_row)]
-        for r in range(n_row):
-            for c in range(n_column - 1):
-                of_lock_left[r].append(object_fifo(of_lock_left_names[r][c], ComputeTiles[c+1][r], ComputeTiles[c][r], 1, memRef_ty_scalar))
-
-        of_lock_left_additional = []
-        of_lock_left_additional_names = [f"lock_left_addirional{3}{r}_{2}{r}" for r in range(n_row)]
-        for r in range(n_row):
-            of_lock_left_additional.append(object_fifo(of_lock_left_additional_names[r], ComputeTiles[2][r], ComputeTiles[3][r], 1, memRef_ty_scalar))
-
-        of_lock_left_additional2 = []
-        of_lock_left_additional2_names = [f"lock_left_addirional2_{3}{r}_{2}{r}" for r in range(n_row)]
-        for r in range(n_row):
-            of_lock_left_additional2.append(object_fifo(of_lock_left_additional2_names[r], ComputeTiles[3][r], ComputeTiles[2][r], 1, memRef_ty_scalar))
+        buffs = (buffs_a0, buffs_a1)
+        # Forward transforms of the two polymul inputs
+        buffs_x = [[] for c in range(n_column)]
+        buffs_y = [[] for c in range(n_column)]
+        if design == "polymul":
+            for c in range(n_column):
+                for r in range(n_row):
+                    buffs_x[c].append(Buffer(ComputeTiles[c][r], [data_percore], T.i32(), f"buffx_{c}_{r}"))
+                    buffs_y[c].append(Buffer(ComputeTiles[c][r], [data_percore], T.i32(), f"buffy_{c}_{r}"))
+
+        # MemTile exchange: every core of a column hands in one half, the
+        # MemTile joins them and broadcasts the result back to the column
+        of_xo = [[] for c in range(n_column)]
+        of_xi = []
+        buffs_recv = [[] for c in range(n_column)]
+        if exchange == "memtile" and n_row > 1:
+            for c in range(n_column):
+                for r in range(n_row):
+                    of_xo[c].append(object_fifo(f"xo{c}_{r}", ComputeTiles[c][r], MemTiles[c], buffer_depth, memRef_ty_core_half))
+                    buffs_recv[c].append(Buffer(ComputeTiles[c][r], [data_percore // 2], T.i32(), f"buffr_{c}_{r}"))
+                of_xi.append(object_fifo(f"xi{c}", MemTiles[c], ComputeTiles[c], buffer_depth, memRef_ty_exchange))
+                object_fifo_link(of_xo[c], of_xi[c])
 
-        # Set up a circuit-switched flow from core to shim for tracing information
-        if trace_size > 0:
-            packetflow(0, ComputeTiles[0][0], WireBundle.Trace, 0, ShimTiles[0], WireBundle.DMA, 1, keep_pkt_header=True) # core trace
+        # Lock
+        of_locks = {}
+        for src, dst in lock_pairs(passes):
+            of_locks[(src, dst)] = object_fifo(lock_name(src, dst), ComputeTiles[src[0]][src[1]], ComputeTiles[dst[0]][dst[1]], 1, memRef_ty_scalar)
+
+        def handshake(actions):
+            for action, src, dst in actions:
+                port = ObjectFifoPort.Consume if action == "wait" else ObjectFifoPort.Produce
+                of_locks[(src, dst)].acquire(port, 1)
+                of_locks[(src, dst)].release(port, 1)
+
+        def exchange_stage(op, elem_roots):
+            # The core keeps the half of its block it computes on and trades
+            # the other one for the same half of the partner's block, then
+            # returns the partner's results
+            c, r = op.core
+            half = op.bufs[0][0]
+            partner = op.bufs[1][2] if half == 0 else op.bufs[0][2]
+            keep, send = (buffs_a0[c][r], buffs_a1[c][r]) if half == 0 else (buffs_a1[c][r], buffs_a0[c][r])
+            recv = buffs_recv[c][r]
+            q, mod_w, mod_u, _ = moduli[c // limb_columns]
+            stage_func, table = (ntt_1stage, elem_roots[-1]) if op.kind == "xntt" else (ntt_1stage_ct, elem_roots[0])
+            offset = partner * (data_percore // 2)
+
+            elem_out = of_xo[c][r].acquire(ObjectFifoPort.Produce, 1)
+            call(exchange_put, [elem_out, send, data_percore // 2])
+            of_xo[c][r].release(ObjectFifoPort.Produce, 1)
+            elem_in = of_xi[c].acquire(ObjectFifoPort.Consume, 1)
+            call(exchange_get, [recv, elem_in, offset, data_percore // 2])
+            of_xi[c].release(ObjectFifoPort.Consume, 1)
+
+            # The partner's results go straight into the exchange
+            root_idx = data_percore + op.stage
+            elem_out = of_xo[c][r].acquire(ObjectFifoPort.Produce, 1)
+            if half == 0:
+                call(stage_func, [root_idx, data_percore, keep, elem_out, keep, recv, table, q, mod_w, mod_u])
+            else:
+                call(stage_func, [root_idx, data_percore, elem_out, keep, recv, keep, table, q, mod_w, mod_u])
+            of_xo[c][r].release(ObjectFifoPort.Produce, 1)
+            elem_in = of_xi[c].acquire(ObjectFifoPort.Consume, 1)
+            call(exchange_get, [send, elem_in, offset, data_percore // 2])
+            of_xi[c].release(ObjectFifoPort.Consume, 1)
+
+        def cross_core(op, elem_roots):
+            if op.kind in EXCHANGE_KINDS:
+                exchange_stage(op, elem_roots)
+                return
+            x = buffs[op.bufs[0][0]][op.bufs[0][1]][op.bufs[0][2]]
+            y = buffs[op.bufs[1][0]][op.bufs[1][1]][op.bufs[1][2]]
+            q, mod_w, mod_u, _ = moduli[op.core[0] // limb_columns]
+            if op.kind == "ntt":
+                root_idx = data_percore + op.stage
+                call(ntt_1stage, [root_idx, data_percore, x, y, x, y, elem_roots[-1], q, mod_w, mod_u])
+            elif op.kind == "ct":
+                root_idx = data_percore + op.stage
+                call(ntt_1stage_ct, [root_idx, data_percore, x, y, x, y, elem_roots[0], q, mod_w, mod_u])
+            else:
+                call(swap_buff, [x, y, data_percore // 2])
+
+        def local(op, elem_roots):
+            # The steps taking the input and producing the output hold their
+            # object fifo elements only while they run, so the input of the
+            # next polynomial lands and the output of the previous one
+            # drains while the core computes the current one
+            c, r = op.core
+            a0, a1 = buffs_a0[c][r], buffs_a1[c][r]
+            q, mod_w, mod_u, n_inv = moduli[c // limb_columns]
+            if op.kind == "load":
+                elem_in = of_ins_core[c][r].acquire(ObjectFifoPort.Consume, 1)
+                call(load_halves, [elem_in, a0, a1, data_percore // 2])
+                of_ins_core[c][r].release(ObjectFifoPort.Consume, 1)
+            elif op.kind == "local_gs" and design == "polymul":
+                call(ntt_stage0_to_Nminus5, [buffs_x[c][r], elem_roots[-1], a0, a1, data_percore, data_percore_log2, data_percore, 0, q, mod_w, mod_u])
+            elif op.kind == "local_gs":
+                elem_in = of_ins_core[c][r].acquire(ObjectFifoPort.Consume, 1)
+                call(ntt_stage0_to_Nminus5, [elem_in, elem_roots[-1], a0, a1, data_percore, data_percore_log2, data_percore, 0, q, mod_w, mod_u])
+                of_ins_core[c][r].release(ObjectFifoPort.Consume, 1)
+            elif op.kind == "local_ct":
+                call(ntt_ct_local, [a0, a1, elem_roots[0], buffs_x[c][r], data_percore, q, mod_w, mod_u])
+            elif op.kind == "local_ct_mul":
+                call(ntt_ct_local, [a0, a1, elem_roots[0], buffs_y[c][r], data_percore, q, mod_w, mod_u])
+                call(pointwise_mul, [buffs_x[c][r], buffs_x[c][r], buffs_y[c][r], data_percore, q, mod_w, mod_u])
+            else:
+                elem_out = of_outs_core[c][r].acquire(ObjectFifoPort.Produce, 1)
+                if op.kind == "write_back" and lazy:
+                    call(write_back_reduced, [elem_out, a0, a1, data_percore // 2, q])
+                elif op.kind == "write_back":
+                    call(write_back, [elem_out, a0, a1, data_percore // 2])
+                elif op.kind == "write_back_twiddle":
+                    elem_tw = of_tws_core[c].acquire(ObjectFifoPort.Consume, 1)
+                    call(write_back_mul, [elem_out, a0, a1, elem_tw, held_row(r, n_row, exchange) * data_percore,
+                                          data_percore // 2, q, mod_w, mod_u])
+                    of_tws_core[c].release(ObjectFifoPort.Consume, 1)
+                else:
+                    call(write_back_scaled, [elem_out, a0, a1, data_percore // 2, n_inv, q, mod_w, mod_u])
+                of_outs_core[c][r].release(ObjectFifoPort.Produce, 1)
+
+        # Set up packet-switched flows from the traced tiles to shim 0 for
+        # tracing information, told apart by their packet IDs
+        def traced_tile(kind, c, r):
+            return MemTiles[c] if kind == "memtile" else ComputeTiles[c][r]
+
+        for packet_id, (kind, c, r) in enumerate(traced):
+            packetflow(packet_id, traced_tile(kind, c, r), WireBundle.Trace, 0, ShimTiles[0], WireBundle.DMA, 1, keep_pkt_header=True)
 
         # Set up compute tiles
         for c in range(n_column):
             for r in range(n_row):
-                @core(ComputeTiles[c][r], "ntt_core.o")
+                @core(ComputeTiles[c][r], KERNEL_OBJECTS[reduction, lazy])
                 def core_body():
                     # Effective while(1)
-                    core_idx = n_row * c + r
                     for _ in for_(sys.maxsize):
-                        call(trace_event0, [])
-
-                        # Number of sub-vector "tile" iterations
-                        elem_out = of_outs_core[c][r].acquire(ObjectFifoPort.Produce, 1)
-                        elem_in = of_ins_core[c][r].acquire(ObjectFifoPort.Consume, 1)
-                        elem_root = of_inroots_core[c].acquire(ObjectFifoPort.Consume, 1)
-
-                        # ============================
-                        #    NTT Stage 0 to n-5
-                        # ============================
-                        call(ntt_stage0_to_Nminus5, [elem_in, elem_root, buffs_a0[c][r], buffs_a1[c][r], data_percore, data_percore_log2, N, core_idx, p, barrett_w, barrett_u])
-
-                        # ============================
-                        #    NTT Stage n-4
-                        # ============================
-                        # void ntt_1stage(int32_t idx_stage, int32_t N, int32_t core_idx, int32_t n_core, int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p, int32_t w, int32_t u) {
-                        if r % 2 == 0:                        
-                            call(ntt_1stage, [3, data_percore, core_idx, n_core, buffs_a0[c][r], buffs_a0[c][r+1], buffs_a0[c][r], buffs_a0[c][r+1], elem_root, p, barrett_w, barrett_u])
-                        else:
-                            call(ntt_1stage, [3, data_percore, core_idx, n_core, buffs_a1[c][r-1], buffs_a1[c][r], buffs_a1[c][r-1], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-
-                        # ============================
-                        #    Swap
-                        # ============================
-                        if r == 1:                 
-                            of_lock_down[c][0].acquire(ObjectFifoPort.Produce, 1)
-                            for i in for_(data_percore // 2):
-                                v0 = memref.load(buffs_a0[c][1], [i])
-                                v1 = memref.load(buffs_a0[c][2], [i])
-                                memref.store(v1, buffs_a0[c][1], [i])
-                                memref.store(v0, buffs_a0[c][2], [i])
-                                yield_([]) 
-                            of_lock_down[c][0].release(ObjectFifoPort.Produce, 1)
-                        elif r == 2:
-                            of_lock_up[c][2].acquire(ObjectFifoPort.Produce, 1)
-                            for i in for_(data_percore // 2):
-                                v0 = memref.load(buffs_a1[c][1], [i])
-                                v1 = memref.load(buffs_a1[c][2], [i])
-                                memref.store(v1, buffs_a1[c][1], [i])
-                                memref.store(v0, buffs_a1[c][2], [i])
-                                yield_([]) 
-                            of_lock_up[c][2].release(ObjectFifoPort.Produce, 1)
-                        else:
-                            # Dummy
-                            for i in for_(16):
-                                v0 = memref.load(buffs_a0[c][r], [i])
-                                memref.store(v0, buffs_a0[c][r], [i])
-                                yield_([]) 
-                        
-                        # ============================
-                        #    NTT Stage n-3
-                        # ============================
-                        # void ntt_1stage(int32_t idx_stage, int32_t N, int32_t core_idx, int32_t n_core, int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p, int32_t w, int32_t u) {
-                        if r == 0:
-                            of_lock_down[c][0].acquire(ObjectFifoPort.Consume, 1) 
-                        if r == 3:
-                            of_lock_up[c][2].acquire(ObjectFifoPort.Consume, 1) 
-                        
-                        if r % 2 == 0:                        
-                            call(ntt_1stage, [2, data_percore, core_idx, n_core, buffs_a0[c][r], buffs_a0[c][r+1], buffs_a0[c][r], buffs_a0[c][r+1], elem_root, p, barrett_w, barrett_u])
-                        else:
-                            call(ntt_1stage, [2, data_percore, core_idx, n_core, buffs_a1[c][r-1], buffs_a1[c][r], buffs_a1[c][r-1], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-
-                        if r == 0:
-                            of_lock_down[c][0].release(ObjectFifoPort.Consume, 1) 
-                        if r == 3:
-                            of_lock_up[c][2].release(ObjectFifoPort.Consume, 1) 
-
-                        # ============================
-                        #    NTT Stage n-2
-                        # ============================
-                        if c == 1:      
-                            call(ntt_1stage, [1, data_percore, core_idx - n_row, n_core // 2, buffs_a0[c-1][r], buffs_a0[c][r], buffs_a0[c-1][r], buffs_a0[c][r], elem_root, p, barrett_w, barrett_u])
-                            call(ntt_1stage, [1, data_percore, core_idx - n_row, n_core // 2, buffs_a1[c-1][r], buffs_a1[c][r], buffs_a1[c-1][r], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-                        if c == 3:      
-                            of_lock_left[r][2].acquire(ObjectFifoPort.Produce, 1)                  
-                            call(ntt_1stage, [1, data_percore, core_idx - n_row * 2, n_core // 2, buffs_a0[c-1][r], buffs_a0[c][r], buffs_a0[c-1][r], buffs_a0[c][r], elem_root, p, barrett_w, barrett_u])
-                            call(ntt_1stage, [1, data_percore, core_idx - n_row * 2, n_core // 2, buffs_a1[c-1][r], buffs_a1[c][r], buffs_a1[c-1][r], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-                            of_lock_left[r][2].release(ObjectFifoPort.Produce, 1)                  
-                        else:
-                            # dummy
-                            for i in for_(16):
-                                v0 = memref.load(buffs_a0[c][r], [i])
-                                memref.store(v0, buffs_a0[c][r], [i])
-                                yield_([])   
-
-                        # ============================
-                        #    Swap
-                        # ============================
-                        if c == 2:                 
-                            of_lock_left[r][1].acquire(ObjectFifoPort.Produce, 1)
-                            of_lock_left[r][2].acquire(ObjectFifoPort.Consume, 1)                  
-                            of_lock_left_additional[r].acquire(ObjectFifoPort.Produce, 1)                  
-                            call(swap_buff, [buffs_a0[1][r], buffs_a0[2][r], data_percore // 2])
-                            call(swap_buff, [buffs_a1[1][r], buffs_a1[2][r], data_percore // 2])
-                            of_lock_left[r][2].release(ObjectFifoPort.Consume, 1)                  
-                            of_lock_left[r][1].release(ObjectFifoPort.Produce, 1)
-                            of_lock_left_additional[r].release(ObjectFifoPort.Produce, 1)                  
-                        else:
-                            # Dummy
-                            for i in for_(16):
-                                v0 = memref.load(buffs_a0[c][r], [i])
-                                memref.store(v0, buffs_a0[c][r], [i])
+                        # The roots are shared by every polynomial of the batch
+                        if not resident_roots:
+                            table_len = root_table_len(data_percore)
+                            for t in range(n_tables):
+                                elem_tables = of_inroots_core[c].acquire(ObjectFifoPort.Consume, 1)
+                                call(load_roots, [buffs_root[c][r][t], elem_tables, r * table_len, table_len])
+                                of_inroots_core[c].release(ObjectFifoPort.Consume, 1)
+                        elem_roots = buffs_root[c][r]
+                        for pass_, program in zip(passes, core_program(passes, (c, r))):
+                            for _ in for_(pass_.count):
+                                call(trace_event0, [])
+
+                                # ============================
+                                #    Local stages and cross-core phases
+                                # ============================
+                                for s, (pre, ops, post) in enumerate(program):
+                                    handshake(pre)
+                                    for op in ops:
+                                        if op.kind in LOCAL_KINDS:
+                                            local(op, elem_roots)
+                                        else:
+                                            cross_core(op, elem_roots)
+                                    handshake(post)
+                                    # Traced designs mark the end of every
+                                    # step, see trace_phases, the others
+                                    # only the end of the transform
+                                    if trace_size > 0 or s == len(program) - 1:
+                                        call(trace_event1, [])
                                 yield_([])
-
-                        # ============================
-                        #    NTT Stage n-1
-                        # ============================
-                        if c == 1:                
-                            of_lock_left[r][1].acquire(ObjectFifoPort.Consume, 1)
-                            of_lock_left[r][0].acquire(ObjectFifoPort.Produce, 1)
-                            call(ntt_1stage, [0, data_percore, core_idx - n_row, n_core // 2, buffs_a0[c-1][r], buffs_a0[c][r], buffs_a0[c-1][r], buffs_a0[c][r], elem_root, p, barrett_w, barrett_u])
-                            call(ntt_1stage, [0, data_percore, core_idx - n_row, n_core // 2, buffs_a1[c-1][r], buffs_a1[c][r], buffs_a1[c-1][r], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-                            of_lock_left[r][1].release(ObjectFifoPort.Consume, 1)
-                            of_lock_left[r][0].release(ObjectFifoPort.Produce, 1)
-                        elif c == 3:
-                            of_lock_left_additional[r].acquire(ObjectFifoPort.Consume, 1) 
-                            of_lock_left_additional2[r].acquire(ObjectFifoPort.Produce, 1) 
-                            call(ntt_1stage, [0, data_percore, core_idx - n_row * 2, n_core // 2, buffs_a0[c-1][r], buffs_a0[c][r], buffs_a0[c-1][r], buffs_a0[c][r], elem_root, p, barrett_w, barrett_u])
-                            call(ntt_1stage, [0, data_percore, core_idx - n_row * 2, n_core // 2, buffs_a1[c-1][r], buffs_a1[c][r], buffs_a1[c-1][r], buffs_a1[c][r], elem_root, p, barrett_w, barrett_u])
-                            of_lock_left_additional[r].release(ObjectFifoPort.Consume, 1) 
-                            of_lock_left_additional2[r].release(ObjectFifoPort.Produce, 1)                  
-                        else:
-                            # dummy
-                            for i in for_(16):
-                                v0 = memref.load(buffs_a0[c][r], [i])
-                                memref.store(v0, buffs_a0[c][r], [i])
-                                yield_([])   
-
-                        # ============================
-                        #    Write Back
-                        # ============================
-                        
-                        if c == 0:
-                            of_lock_left[r][0].acquire(ObjectFifoPort.Consume, 1)  
-                        elif c == 2:
-                            of_lock_left_additional2[r].acquire(ObjectFifoPort.Consume, 1) 
-                        
-                        call(write_back, [elem_out, buffs_a0[c][r], buffs_a1[c][r], data_percore // 2])
-                        
-                        if c  == 0:
-                            of_lock_left[r][0].release(ObjectFifoPort.Consume, 1)                  
-                        elif c == 2:
-                            of_lock_left_additional2[r].release(ObjectFifoPort.Consume, 1) 
-
-                        of_ins_core[c][r].release(ObjectFifoPort.Consume, 1)
-                        of_inroots_core[c].release(ObjectFifoPort.Consume, 1)
-                        of_outs_core[c][r].release(ObjectFifoPort.Produce, 1)
-                        call(trace_event1, [])
                         yield_([])
 
         # To/from AIE-array data movement
-        @FuncOp.from_py_func(memRef_ty_vec, memRef_ty_vec, memRef_ty_vec)
+        @FuncOp.from_py_func(memRef_ty_batch_in, memRef_ty_roots_all, memRef_ty_batch)
         def sequence(input, root, output):
-            if trace_size > 0:
+            if traced:
+                # The first core, packet ID 0, also sets up the shim DMA
+                # writing the buffer, the other tiles only their trace units
+                kind, c, r = traced[0]
                 trace_utils.configure_simple_tracing_aie2(
-                    ComputeTiles[0][0],
+                    traced_tile(kind, c, r),
                     ShimTiles[0],
                     ddr_id=2,
-                    size=trace_size,
-                    offset=N_in_bytes,
+                    size=trace_size * len(traced),
+                    offset=N_out_bytes,
+                    events=TRACE_EVENTS[kind],
                 )
+                for packet_id, (kind, c, r) in enumerate(traced[1:], 1):
+                    configure_tile_tracing(traced_tile(kind, c, r), kind, packet_id)
             
-            for c in range(n_column):
-                size = N // n_column
-                offset = c * size
-                npu_dma_memcpy_nd(metadata=of_outs_names[c], bd_id=c, mem=output, sizes=[1, 1, 1, size], offsets=[0, 0, 0, offset])
-                npu_dma_memcpy_nd(metadata=of_ins_names[c], bd_id=n_column+c, mem=input, sizes=[1, 1, 1, size], offsets=[0, 0, 0, offset])
-                npu_dma_memcpy_nd(metadata=of_inroots_name[c], bd_id=2*n_column+c, mem=root, sizes=[1, 1, 1, N])
-            npu_sync(column=0, row=0, direction=0, channel=0)
-
-trace_size = 0 if (len(sys.argv) < 2) else int(sys.argv[1])
-with mlir_mod_ctx() as ctx:
-    ntt(trace_size)
-    print(ctx.module)
+            if design == "fourstep":
+                # Pass 1 reads the input and the twiddles, pass 2 transforms
+                # the output of pass 1 in place, so it waits for all its writes
+                transfers = [four_step_transfers(logN, n_column, c) for c in range(n_column)]
+                for c, (rows, _) in enumerate(transfers):
+                    npu_dma_memcpy_nd(metadata=of_outs_names[c], bd_id=c, mem=output, **rows)
+                    npu_dma_memcpy_nd(metadata=of_ins_names[c], bd_id=n_column+c, mem=input, **rows)
+                    npu_dma_memcpy_nd(metadata=of_tws_names[c], bd_id=2*n_column+c, mem=root, **rows)
+                for c in range(n_column):
+                    npu_sync(column=c, row=0, direction=0, channel=0)
+                for c, (_, columns) in enumerate(transfers):
+                    npu_dma_memcpy_nd(metadata=of_outs_names[c], bd_id=c, mem=output, **columns)
+                    npu_dma_memcpy_nd(metadata=of_ins_names[c], bd_id=n_column+c, mem=output, **columns)
+                for c in range(n_column):
+                    npu_sync(column=c, row=0, direction=0, channel=0)
+            else:
+                for c in range(n_column):
+                    # Column lc of limb `limb`, which writes the share of the
+                    # column it holds after the column swap, in natural order
+                    limb, lc = divmod(c, limb_columns)
+                    transfer = batch_transfer(N, limb_columns, batch, swap_middle(lc, limb_columns), limb * batch * N)
+                    npu_dma_memcpy_nd(metadata=of_outs_names[c], bd_id=c, mem=output, **transfer)
+                    if design == "polymul":
+                        # Both inputs, each column reads the one it starts on
+                        transfer = batch_transfer(N, limb_columns, 2 * batch, swap_middle(lc, limb_columns))
+                    elif design == "ntt":
+                        # Every limb transforms the same input
+                        transfer = batch_transfer(N, limb_columns, batch, lc)
+                    else:
+                        transfer = batch_transfer(N, limb_columns, batch, lc, limb * batch * N)
+                    npu_dma_memcpy_nd(metadata=of_ins_names[c], bd_id=n_column+c, mem=input, **transfer)
+                    if not resident_roots:
+                        size = n_tables * n_row * root_table_len(data_percore)
+                        npu_dma_memcpy_nd(metadata=of_inroots_name[c], bd_id=2*n_column+c, mem=root, sizes=[1, 1, 1, size], offsets=[0, 0, 0, c * size])
+                for c in range(n_column):
+                    npu_sync(column=c, row=0, direction=0, channel=0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the MLIR of the NTT design")
+    parser.add_argument("trace_size", nargs="?", type=int, default=0, help="trace buffer size in bytes per traced tile, 0 disables tracing")
+    parser.add_argument("--logn", type=int, default=11, help="log2 of the number of points")
+    parser.add_argument("--columns", type=int, default=4, help="number of AIE columns (1, 2 or 4)")
+    parser.add_argument("--rows", type=int, default=4, help="number of compute rows per column (1, 2 or 4)")
+    parser.add_argument("-p", "--prime", type=int, nargs="+", default=[3329], help="prime modulus, several RNS primes split the columns between them")
+    parser.add_argument("--design", choices=DESIGNS, default="ntt", help="forward transform, inverse transform or fused polynomial multiplication")
+    parser.add_argument("--batch", type=int, default=1, help="polynomials transformed per launch")
+    parser.add_argument("--root-index", metavar="FILE", help="write the indices of the per-core root tables into the host root table, one per line")
+    parser.add_argument("--resident-roots", action="store_true", help="keep the roots in tile memory instead of streaming them on every launch")
+    parser.add_argument("--exchange", choices=EXCHANGES, default="shared", help="exchange the data of partners in a column through shared memory or the MemTile")
+    parser.add_argument("--reduction", choices=REDUCTIONS, default="barrett", help="modular reduction of the kernels, the Makefile builds the matching kernel object")
+    parser.add_argument("--buffer-depth", type=int, default=2, help="depth of the data object fifos, 2 for double buffering")
+    parser.add_argument("--radix", type=int, choices=RADICES, default=2, help="radix of the local stages of every core")
+    parser.add_argument("--trace-tiles", nargs="+", default=["0,0"], metavar="TILE", help="tiles traced with a trace size: C,R for the core of column C on compute row R, C,mem for the MemTile of column C, cores, memtiles or all")
+    parser.add_argument("--trace-phases", metavar="FILE", help="write the names of the steps the traced cores mark as JSON, for scripts/parse_trace.py --phases")
+    parser.add_argument("--lazy", action="store_true", help="keep the butterfly outputs in [0, 2p) and reduce them on write back, takes the montgomery reduction")
+    return parser.parse_args(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    opts = parse_args()
+    with mlir_mod_ctx() as ctx:
+        try:
+            ntt(opts.logn, opts.columns, opts.rows, opts.prime, opts.trace_size, opts.batch, opts.resident_roots, opts.design, opts.exchange, opts.buffer_depth, opts.reduction, opts.lazy, opts.radix, opts.trace_tiles)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+        print(ctx.module)
+    if opts.root_index:
+        with open(opts.root_index, "w") as f:
+            f.write("".join(f"{i}\n" for i in host_root_indices(opts.logn, opts.columns, opts.rows, opts.design, len(opts.prime), opts.exchange)))
+    if opts.trace_phases:
+        with open(opts.trace_phases, "w") as f:
+            json.dump(trace_phases(opts.logn, opts.columns, opts.rows, opts.design, len(opts.prime), opts.exchange, opts.batch), f, indent=2)
@@ -8,18 +8,37 @@
 const int32_t vec_prime = 16;
 const int32_t vec_prime_half = vec_prime / 2;
 
+// Sums and differences of residues below q < 2^31 stay in (-q, q), so the
+// lanes never overflow
 int32_t modadd(int32_t a, int32_t b, int32_t q) {
-    int ret = a + b;
-    if (ret >= q) {
-        return ret - q;
+    int32_t ret = a - (q - b);
+    if (ret < 0) {
+        return ret + q;
     }
     return ret;
 }
 
 int32_t modsub(int32_t a, int32_t b, int32_t q) {
-    int ret = a + q - b;
-    if (ret >= q) {
-        return ret - q;
+    int32_t ret = a - b;
+    if (ret < 0) {
+        return ret + q;
+    }
+    return ret;
+}
+
+// Lazy counterparts for NTT_LAZY, residues in [0, q2) with q2 = 2q
+int32_t lazy_add(int32_t a, int32_t b, int32_t q2) {
+    int32_t ret = a + b;
+    if (ret >= q2) {
+        return ret - q2;
+    }
+    return ret;
+}
+
+int32_t lazy_sub(int32_t a, int32_t b, int32_t q2) {
+    int32_t ret = a + q2 - b;
+    if (ret >= q2) {
+        return ret - q2;
     }
     return ret;
 }
@@ -38,29 +57,96 @@ int32_t barrett_2k(int32_t a, int32_t b, int32_t q, int32_t w, int32_t u) {
     }
 }
 
+// a * b * 2^-32 mod q in (-q, q) for a b < 2^31 q, qinv = q^-1 mod 2^32
+int32_t montgomery_signed(int32_t a, int32_t b, int32_t q, int32_t qinv) {
+    int64_t t = (int64_t) a * (int64_t) b;
+    int32_t m = (uint32_t) t * (uint32_t) qinv;
+    return (t - (int64_t) m * q) >> 32;
+}
+
+int32_t montgomery(int32_t a, int32_t b, int32_t q, int32_t qinv) {
+    int32_t c = montgomery_signed(a, b, q, qinv);
+    if (c < 0) {
+        return c + q;
+    }
+    return c;
+}
+
+// In [0, 2q)
+int32_t montgomery_lazy(int32_t a, int32_t b, int32_t q, int32_t qinv) {
+    return montgomery_signed(a, b, q, qinv) + q;
+}
+
 aie::vector<int32_t, vec_prime> vector_modadd(
     aie::vector<int32_t, vec_prime> &v0, aie::vector<int32_t, vec_prime> &v1,
     aie::vector<int32_t, vec_prime> &p_vector) {
-    aie::vector<int32_t, vec_prime> v2 = aie::add(v0, v1);
-    aie::mask<vec_prime> mask_v2_lt_p = aie::lt(v2, p_vector);
-    aie::vector<int32_t, vec_prime> over_v2 =
-        aie::select(p_vector, 0, mask_v2_lt_p);
-    aie::vector<int32_t, vec_prime> modadd = aie::sub(v2, over_v2);
+    aie::vector<int32_t, vec_prime> p_minus_v1 = aie::sub(p_vector, v1);
+    aie::vector<int32_t, vec_prime> v2 = aie::sub(v0, p_minus_v1);
+    aie::mask<vec_prime> mask_v2_ge_0 =
+        aie::ge(v2, aie::zeros<int32_t, vec_prime>());
+    aie::vector<int32_t, vec_prime> under_v2 =
+        aie::select(p_vector, 0, mask_v2_ge_0);
+    aie::vector<int32_t, vec_prime> modadd = aie::add(v2, under_v2);
     return modadd;
 }
 
 aie::vector<int32_t, vec_prime> vector_modsub(
     aie::vector<int32_t, vec_prime> &v0, aie::vector<int32_t, vec_prime> &v1,
     aie::vector<int32_t, vec_prime> &p_vector) {
-    aie::vector<int32_t, vec_prime> v0_plus_p = aie::add(v0, p_vector);
-    aie::vector<int32_t, vec_prime> v3 = aie::sub(v0_plus_p, v1);
-    aie::mask<vec_prime> mask_v3_lt_p = aie::lt(v3, p_vector);
-    aie::vector<int32_t, vec_prime> over_v3 =
-        aie::select(p_vector, 0, mask_v3_lt_p);
-    aie::vector<int32_t, vec_prime> modsub = aie::sub(v3, over_v3);
+    aie::vector<int32_t, vec_prime> v3 = aie::sub(v0, v1);
+    aie::mask<vec_prime> mask_v3_ge_0 =
+        aie::ge(v3, aie::zeros<int32_t, vec_prime>());
+    aie::vector<int32_t, vec_prime> under_v3 =
+        aie::select(p_vector, 0, mask_v3_ge_0);
+    aie::vector<int32_t, vec_prime> modsub = aie::add(v3, under_v3);
     return modsub;
 }
 
+aie::vector<int32_t, vec_prime> vector_lazy_add(
+    aie::vector<int32_t, vec_prime> &v0, aie::vector<int32_t, vec_prime> &v1,
+    aie::vector<int32_t, vec_prime> &p2_vector) {
+    aie::vector<int32_t, vec_prime> v2 = aie::add(v0, v1);
+    aie::mask<vec_prime> mask_v2_lt_p2 = aie::lt(v2, p2_vector);
+    aie::vector<int32_t, vec_prime> over_v2 =
+        aie::select(p2_vector, 0, mask_v2_lt_p2);
+    aie::vector<int32_t, vec_prime> lazy_add = aie::sub(v2, over_v2);
+    return lazy_add;
+}
+
+// v0 - v1 + 2p in (0, 4p), left for a product to reduce
+aie::vector<int32_t, vec_prime> vector_lazy_diff(
+    aie::vector<int32_t, vec_prime> &v0, aie::vector<int32_t, vec_prime> &v1,
+    aie::vector<int32_t, vec_prime> &p2_vector) {
+    aie::vector<int32_t, vec_prime> v0_plus_p2 = aie::add(v0, p2_vector);
+    aie::vector<int32_t, vec_prime> lazy_diff = aie::sub(v0_plus_p2, v1);
+    return lazy_diff;
+}
+
+aie::vector<int32_t, vec_prime> vector_lazy_sub(
+    aie::vector<int32_t, vec_prime> &v0, aie::vector<int32_t, vec_prime> &v1,
+    aie::vector<int32_t, vec_prime> &p2_vector) {
+    aie::vector<int32_t, vec_prime> v3 = vector_lazy_diff(v0, v1, p2_vector);
+    aie::mask<vec_prime> mask_v3_lt_p2 = aie::lt(v3, p2_vector);
+    aie::vector<int32_t, vec_prime> over_v3 =
+        aie::select(p2_vector, 0, mask_v3_lt_p2);
+    aie::vector<int32_t, vec_prime> lazy_sub = aie::sub(v3, over_v3);
+    return lazy_sub;
+}
+
+// [0, 2p) to [0, p)
+aie::vector<int32_t, vec_prime> vector_reduce(
+    aie::vector<int32_t, vec_prime> &v,
+    aie::vector<int32_t, vec_prime> &p_vector) {
+    aie::mask<vec_prime> mask_v_lt_p = aie::lt(v, p_vector);
+    aie::vector<int32_t, vec_prime> over_v =
+        aie::select(p_vector, 0, mask_v_lt_p);
+    aie::vector<int32_t, vec_prime> reduced = aie::sub(v, over_v);
+    return reduced;
+}
+
+// Vector barrett. w and u come from reduction_constants in ntt_model.py,
+// which picks w such that x_1 and u fit 32-bit lanes and s is at most one
+// below t / q, so that c < 2q
 aie::vector<int32_t, vec_prime> vector_barrett(
     aie::vector<int32_t, vec_prime> &v, aie::vector<int32_t, vec_prime> &p_vec,
     aie::vector<int32_t, vec_prime> &root_vec,
@@ -101,9 +187,135 @@ aie::vector<int32_t, vec_prime_half> vector_barrett(
     return barrett;
 }
 
+// Vector montgomery. As t - m q is divisible by 2^32, the subtraction stays
+// in the accumulator (msc) and the shift out of it needs no rounding, one
+// accumulator read and one vector op fewer than vector_barrett. The signed
+// product c is in (-q, q) for t < 2^31 q, the lazy one c + q in [0, 2q).
+aie::vector<int32_t, vec_prime> vector_montgomery_signed(
+    aie::vector<int32_t, vec_prime> &v, aie::vector<int32_t, vec_prime> &p_vec,
+    aie::vector<int32_t, vec_prime> &root_vec,
+    aie::vector<int32_t, vec_prime> &qinv_vec) {
+    aie::accum<acc64, vec_prime> t = aie::mul(v, root_vec);
+    aie::vector<int32_t, vec_prime> t_lo = t.template to_vector<int32_t>(0);
+    aie::accum<acc64, vec_prime> m = aie::mul(t_lo, qinv_vec);
+    aie::vector<int32_t, vec_prime> m_lo = m.template to_vector<int32_t>(0);
+    aie::accum<acc64, vec_prime> r = aie::msc(t, m_lo, p_vec);
+    aie::vector<int32_t, vec_prime> c = r.template to_vector<int32_t>(32);
+    return c;
+}
+
+aie::vector<int32_t, vec_prime> vector_montgomery(
+    aie::vector<int32_t, vec_prime> &v, aie::vector<int32_t, vec_prime> &p_vec,
+    aie::vector<int32_t, vec_prime> &root_vec,
+    aie::vector<int32_t, vec_prime> &qinv_vec) {
+    aie::vector<int32_t, vec_prime> c =
+        vector_montgomery_signed(v, p_vec, root_vec, qinv_vec);
+    aie::mask<vec_prime> mask_c_ge_0 =
+        aie::ge(c, aie::zeros<int32_t, vec_prime>());
+    aie::vector<int32_t, vec_prime> under_c =
+        aie::select(p_vec, 0, mask_c_ge_0);
+    aie::vector<int32_t, vec_prime> montgomery = aie::add(c, under_c);
+    return montgomery;
+}
+
+aie::vector<int32_t, vec_prime> vector_montgomery_lazy(
+    aie::vector<int32_t, vec_prime> &v, aie::vector<int32_t, vec_prime> &p_vec,
+    aie::vector<int32_t, vec_prime> &root_vec,
+    aie::vector<int32_t, vec_prime> &qinv_vec) {
+    aie::vector<int32_t, vec_prime> c =
+        vector_montgomery_signed(v, p_vec, root_vec, qinv_vec);
+    return aie::add(c, p_vec);
+}
+
+aie::vector<int32_t, vec_prime_half> vector_montgomery_signed(
+    aie::vector<int32_t, vec_prime_half> &v,
+    aie::vector<int32_t, vec_prime_half> &p_vec,
+    aie::vector<int32_t, vec_prime_half> &root_vec,
+    aie::vector<int32_t, vec_prime_half> &qinv_vec) {
+    aie::accum<acc64, vec_prime_half> t = aie::mul(v, root_vec);
+    aie::vector<int32_t, vec_prime_half> t_lo =
+        t.template to_vector<int32_t>(0);
+    aie::accum<acc64, vec_prime_half> m = aie::mul(t_lo, qinv_vec);
+    aie::vector<int32_t, vec_prime_half> m_lo =
+        m.template to_vector<int32_t>(0);
+    aie::accum<acc64, vec_prime_half> r = aie::msc(t, m_lo, p_vec);
+    aie::vector<int32_t, vec_prime_half> c = r.template to_vector<int32_t>(32);
+    return c;
+}
+
+aie::vector<int32_t, vec_prime_half> vector_montgomery(
+    aie::vector<int32_t, vec_prime_half> &v,
+    aie::vector<int32_t, vec_prime_half> &p_vec,
+    aie::vector<int32_t, vec_prime_half> &root_vec,
+    aie::vector<int32_t, vec_prime_half> &qinv_vec) {
+    aie::vector<int32_t, vec_prime_half> c =
+        vector_montgomery_signed(v, p_vec, root_vec, qinv_vec);
+    aie::mask<vec_prime_half> mask_c_ge_0 =
+        aie::ge(c, aie::zeros<int32_t, vec_prime_half>());
+    aie::vector<int32_t, vec_prime_half> under_c =
+        aie::select(p_vec, 0, mask_c_ge_0);
+    aie::vector<int32_t, vec_prime_half> montgomery = aie::add(c, under_c);
+    return montgomery;
+}
+
+aie::vector<int32_t, vec_prime_half> vector_montgomery_lazy(
+    aie::vector<int32_t, vec_prime_half> &v,
+    aie::vector<int32_t, vec_prime_half> &p_vec,
+    aie::vector<int32_t, vec_prime_half> &root_vec,
+    aie::vector<int32_t, vec_prime_half> &qinv_vec) {
+    aie::vector<int32_t, vec_prime_half> c =
+        vector_montgomery_signed(v, p_vec, root_vec, qinv_vec);
+    return aie::add(c, p_vec);
+}
+
+// Modular multiplication of the kernels, w and u are those of
+// reduction_constants in ntt_model.py. Built with NTT_MONTGOMERY, the
+// kernels take u = p^-1 mod 2^32 instead, ignore w and multiply by 2^-32 on
+// the way, so the generator and host pass every root, twiddle and scale
+// times 2^32 mod p. The lazy products are in [0, 2p).
+#ifdef NTT_MONTGOMERY
+#define vector_modmul(v, p_vec, root_vec, u_vec, w)                            \
+    vector_montgomery(v, p_vec, root_vec, u_vec)
+#define vector_modmul_lazy(v, p_vec, root_vec, u_vec, w)                       \
+    vector_montgomery_lazy(v, p_vec, root_vec, u_vec)
+#define modmul(a, b, q, w, u) montgomery(a, b, q, u)
+#define modmul_lazy(a, b, q, w, u) montgomery_lazy(a, b, q, u)
+#else
+#define vector_modmul vector_barrett
+#define modmul barrett_2k
+#endif
+
+// Butterfly arithmetic. Built with NTT_LAZY, the butterflies leave their
+// outputs in [0, 2p) instead of [0, p) and the Gentleman-Sande difference
+// enters the product unreduced, in (0, 4p). Whatever leaves the array goes
+// through a full product or write_back_reduced. lazy_bounds in ntt_model.py
+// checks the bounds for the prime. Products of lazy residues reach 4p^2,
+// beyond what the Barrett estimate of 32-bit lanes is within 2p of.
+#ifdef NTT_LAZY
+#ifndef NTT_MONTGOMERY
+#error "NTT_LAZY needs NTT_MONTGOMERY"
+#endif
+#define vector_bf_add(v0, v1, p_vec, p2_vec) vector_lazy_add(v0, v1, p2_vec)
+#define vector_bf_sub(v0, v1, p_vec, p2_vec) vector_lazy_sub(v0, v1, p2_vec)
+#define vector_bf_diff(v0, v1, p_vec, p2_vec) vector_lazy_diff(v0, v1, p2_vec)
+#define vector_bf_mul vector_modmul_lazy
+#define bf_add(a, b, q) lazy_add(a, b, 2 * (q))
+#define bf_sub(a, b, q) lazy_sub(a, b, 2 * (q))
+#define bf_mul modmul_lazy
+#else
+#define vector_bf_add(v0, v1, p_vec, p2_vec) vector_modadd(v0, v1, p_vec)
+#define vector_bf_sub(v0, v1, p_vec, p2_vec) vector_modsub(v0, v1, p_vec)
+#define vector_bf_diff(v0, v1, p_vec, p2_vec) vector_modsub(v0, v1, p_vec)
+#define vector_bf_mul vector_modmul
+#define bf_add modadd
+#define bf_sub modsub
+#define bf_mul modmul
+#endif
+
 void ntt_stage_parallel8(int32_t *pOut_i0, int32_t *pOut_i1, int32_t *pIn_i0,
                          int32_t *pIn_i1,
                          aie::vector<int32_t, vec_prime> &p_vector,
+                         aie::vector<int32_t, vec_prime> &p2_vector,
                          aie::vector<int32_t, vec_prime> &root_vector,
                          aie::vector<int32_t, vec_prime> &u_vector, int32_t p,
                          int32_t w) {
@@ -111,17 +323,131 @@ void ntt_stage_parallel8(int32_t *pOut_i0, int32_t *pOut_i1, int32_t *pIn_i0,
     aie::vector<int32_t, vec_prime> v1 = aie::load_v(pIn_i1);
 
     // modadd(v0, v1, p)
-    aie::vector<int32_t, vec_prime> modadd = vector_modadd(v0, v1, p_vector);
+    aie::vector<int32_t, vec_prime> modadd =
+        vector_bf_add(v0, v1, p_vector, p2_vector);
 
     // modsub(v0, v1, p)
-    aie::vector<int32_t, vec_prime> modsub = vector_modsub(v0, v1, p_vector);
+    aie::vector<int32_t, vec_prime> modsub =
+        vector_bf_diff(v0, v1, p_vector, p2_vector);
+
+    // modmul(modsub(v0, v1, p), root, p, w, u);
+    aie::vector<int32_t, vec_prime> modmul =
+        vector_bf_mul(modsub, p_vector, root_vector, u_vector, w);
 
-    // barrett_2k(modsub(v0, v1, p), root, p, w, u);
-    aie::vector<int32_t, vec_prime> barrett =
-        vector_barrett(modsub, p_vector, root_vector, u_vector, w);
+    aie::store_v(pOut_i0, modadd);
+    aie::store_v(pOut_i1, modmul);
+}
+
+void ntt_stage_ct_parallel8(int32_t *pOut_i0, int32_t *pOut_i1,
+                            int32_t *pIn_i0, int32_t *pIn_i1,
+                            aie::vector<int32_t, vec_prime> &p_vector,
+                            aie::vector<int32_t, vec_prime> &p2_vector,
+                            aie::vector<int32_t, vec_prime> &root_vector,
+                            aie::vector<int32_t, vec_prime> &u_vector,
+                            int32_t p, int32_t w) {
+    aie::vector<int32_t, vec_prime> v0 = aie::load_v(pIn_i0);
+    aie::vector<int32_t, vec_prime> v1 = aie::load_v(pIn_i1);
+
+    // modmul(v1, root, p, w, u);
+    aie::vector<int32_t, vec_prime> modmul =
+        vector_bf_mul(v1, p_vector, root_vector, u_vector, w);
+
+    // modadd(v0, modmul, p), modsub(v0, modmul, p)
+    aie::vector<int32_t, vec_prime> modadd =
+        vector_bf_add(v0, modmul, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> modsub =
+        vector_bf_sub(v0, modmul, p_vector, p2_vector);
 
     aie::store_v(pOut_i0, modadd);
-    aie::store_v(pOut_i1, barrett);
+    aie::store_v(pOut_i1, modsub);
+}
+
+// Two Gentleman-Sande stages in one pass over the block of 4 * bf_width at
+// pA: bf_width with root0 (first half) and root1 (second half), then
+// 2 * bf_width with root2. Each vector is loaded and stored once.
+void ntt_stage_radix4(int32_t *pA, int32_t bf_width,
+                      aie::vector<int32_t, vec_prime> &p_vector,
+                      aie::vector<int32_t, vec_prime> &p2_vector,
+                      aie::vector<int32_t, vec_prime> &root0_vector,
+                      aie::vector<int32_t, vec_prime> &root1_vector,
+                      aie::vector<int32_t, vec_prime> &root2_vector,
+                      aie::vector<int32_t, vec_prime> &u_vector, int32_t p,
+                      int32_t w) {
+    aie::vector<int32_t, vec_prime> v0 = aie::load_v(pA);
+    aie::vector<int32_t, vec_prime> v1 = aie::load_v(pA + bf_width);
+    aie::vector<int32_t, vec_prime> v2 = aie::load_v(pA + 2 * bf_width);
+    aie::vector<int32_t, vec_prime> v3 = aie::load_v(pA + 3 * bf_width);
+
+    // Stage bf_width
+    aie::vector<int32_t, vec_prime> s0 =
+        vector_bf_add(v0, v1, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> d0 =
+        vector_bf_diff(v0, v1, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> m0 =
+        vector_bf_mul(d0, p_vector, root0_vector, u_vector, w);
+    aie::vector<int32_t, vec_prime> s1 =
+        vector_bf_add(v2, v3, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> d1 =
+        vector_bf_diff(v2, v3, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> m1 =
+        vector_bf_mul(d1, p_vector, root1_vector, u_vector, w);
+
+    // Stage 2 * bf_width
+    aie::vector<int32_t, vec_prime> ss =
+        vector_bf_add(s0, s1, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> ds =
+        vector_bf_diff(s0, s1, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> sm =
+        vector_bf_add(m0, m1, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> dm =
+        vector_bf_diff(m0, m1, p_vector, p2_vector);
+    ds = vector_bf_mul(ds, p_vector, root2_vector, u_vector, w);
+    dm = vector_bf_mul(dm, p_vector, root2_vector, u_vector, w);
+
+    aie::store_v(pA, ss);
+    aie::store_v(pA + bf_width, sm);
+    aie::store_v(pA + 2 * bf_width, ds);
+    aie::store_v(pA + 3 * bf_width, dm);
+}
+
+// Cooley-Tukey counterpart of ntt_stage_radix4: 2 * bf_width with root0,
+// then bf_width with root1 (first half) and root2 (second half)
+void ntt_stage_ct_radix4(int32_t *pA, int32_t bf_width,
+                         aie::vector<int32_t, vec_prime> &p_vector,
+                         aie::vector<int32_t, vec_prime> &p2_vector,
+                         aie::vector<int32_t, vec_prime> &root0_vector,
+                         aie::vector<int32_t, vec_prime> &root1_vector,
+                         aie::vector<int32_t, vec_prime> &root2_vector,
+                         aie::vector<int32_t, vec_prime> &u_vector, int32_t p,
+                         int32_t w) {
+    aie::vector<int32_t, vec_prime> v0 = aie::load_v(pA);
+    aie::vector<int32_t, vec_prime> v1 = aie::load_v(pA + bf_width);
+    aie::vector<int32_t, vec_prime> v2 = aie::load_v(pA + 2 * bf_width);
+    aie::vector<int32_t, vec_prime> v3 = aie::load_v(pA + 3 * bf_width);
+
+    // Stage 2 * bf_width
+    aie::vector<int32_t, vec_prime> m2 =
+        vector_bf_mul(v2, p_vector, root0_vector, u_vector, w);
+    aie::vector<int32_t, vec_prime> m3 =
+        vector_bf_mul(v3, p_vector, root0_vector, u_vector, w);
+    aie::vector<int32_t, vec_prime> y0 =
+        vector_bf_add(v0, m2, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> y2 =
+        vector_bf_sub(v0, m2, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> y1 =
+        vector_bf_add(v1, m3, p_vector, p2_vector);
+    aie::vector<int32_t, vec_prime> y3 =
+        vector_bf_sub(v1, m3, p_vector, p2_vector);
+
+    // Stage bf_width
+    aie::vector<int32_t, vec_prime> m1 =
+        vector_bf_mul(y1, p_vector, root1_vector, u_vector, w);
+    m3 = vector_bf_mul(y3, p_vector, root2_vector, u_vector, w);
+
+    aie::store_v(pA, vector_bf_add(y0, m1, p_vector, p2_vector));
+    aie::store_v(pA + bf_width, vector_bf_sub(y0, m1, p_vector, p2_vector));
+    aie::store_v(pA + 2 * bf_width, vector_bf_add(y2, m3, p_vector, p2_vector));
+    aie::store_v(pA + 3 * bf_width, vector_bf_sub(y2, m3, p_vector, p2_vector));
 }
 
 extern "C" {
@@ -158,21 +484,19 @@ void write_back(int32_t *to, int32_t *a, int32_t *b, int32_t N_ab) {
     }
 }
 
-void ntt_1stage(int32_t idx_stage, int32_t N, int32_t core_idx, int32_t n_core,
-                int32_t *out0, int32_t *out1, int32_t *in0, int32_t *in1,
-                int32_t *in_root, int32_t p, int32_t w, int32_t u) {
-    // Stage N - 1 - idx_stage
-    // idx_stage : 0, 1, 2, ...
+void ntt_1stage(int32_t root_idx, int32_t N, int32_t *out0, int32_t *out1,
+                int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p,
+                int32_t w, int32_t u) {
+    // One cross-core stage, all butterflies share in_root[root_idx]
     const int N_half = N / 2;
     const int F = N_half / vec_prime;
-    const int root_base = 1 << idx_stage;
-    const int root_num = 1 << idx_stage;
-    const int root_idx = root_base + core_idx / (n_core / root_num);
     int32_t root = in_root[root_idx];
     aie::vector<int32_t, vec_prime> root_vector =
         aie::broadcast<int32_t, vec_prime>(root);
     aie::vector<int32_t, vec_prime> p_vector =
         aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> p2_vector =
+        aie::broadcast<int32_t, vec_prime>(2 * p);
     aie::vector<int32_t, vec_prime> u_vector =
         aie::broadcast<int32_t, vec_prime>(u);
     for (int i = 0; i < F; i++) {
@@ -182,20 +506,50 @@ void ntt_1stage(int32_t idx_stage, int32_t N, int32_t core_idx, int32_t n_core,
         int32_t *__restrict pOut0_i = out0 + idx_base;
         int32_t *__restrict pOut1_i = out1 + idx_base;
         ntt_stage_parallel8(pOut0_i, pOut1_i, pIn0_i, pIn1_i, p_vector,
-                            root_vector, u_vector, p, w);
+                            p2_vector, root_vector, u_vector, p, w);
     }
 }
 
-void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
-                           int32_t *c_out1, int32_t N, int32_t logN,
-                           int32_t N_all, int32_t core_idx, int32_t p,
-                           int32_t w, int32_t u) {
+void ntt_1stage_ct(int32_t root_idx, int32_t N, int32_t *out0, int32_t *out1,
+                   int32_t *in0, int32_t *in1, int32_t *in_root, int32_t p,
+                   int32_t w, int32_t u) {
+    // Cooley-Tukey counterpart of ntt_1stage
+    const int N_half = N / 2;
+    const int F = N_half / vec_prime;
+    int32_t root = in_root[root_idx];
+    aie::vector<int32_t, vec_prime> root_vector =
+        aie::broadcast<int32_t, vec_prime>(root);
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> p2_vector =
+        aie::broadcast<int32_t, vec_prime>(2 * p);
+    aie::vector<int32_t, vec_prime> u_vector =
+        aie::broadcast<int32_t, vec_prime>(u);
+    for (int i = 0; i < F; i++) {
+        int32_t idx_base = i * vec_prime;
+        int32_t *__restrict pIn0_i = in0 + idx_base;
+        int32_t *__restrict pIn1_i = in1 + idx_base;
+        int32_t *__restrict pOut0_i = out0 + idx_base;
+        int32_t *__restrict pOut1_i = out1 + idx_base;
+        ntt_stage_ct_parallel8(pOut0_i, pOut1_i, pIn0_i, pIn1_i, p_vector,
+                               p2_vector, root_vector, u_vector, p, w);
+    }
+}
+
+// Local Gentleman-Sande stages, radix 2 or 4 from stage 4 on, see
+// ntt_stage0_to_Nminus5 and ntt_stage0_to_Nminus5_radix4
+static void ntt_local_gs(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
+                         int32_t *c_out1, int32_t N, int32_t logN,
+                         int32_t N_all, int32_t core_idx, int32_t p,
+                         int32_t w, int32_t u, int32_t radix) {
     const int N_half = N / 2;
     const int32_t F = N_half / vec_prime;
     int32_t root_idx = N_all / 2;
     int32_t bf_width = 1;
     aie::vector<int32_t, vec_prime> p_vector =
         aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> p2_vector =
+        aie::broadcast<int32_t, vec_prime>(2 * p);
     aie::vector<int32_t, vec_prime> u_vector =
         aie::broadcast<int32_t, vec_prime>(u);
     aie::vector<int32_t, vec_prime_half> p_vector_half =
@@ -213,20 +567,20 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
         int32_t *__restrict pA_i = a_in + i * vec_prime;
         aie::vector<int32_t, vec_prime> v0 = aie::load_v<vec_prime>(pA_i);
         aie::vector<int32_t, vec_prime> v0_l = aie::shuffle_down(v0, 1);
-        v0_l = vector_modadd(v0, v0_l, p_vector);
+        v0_l = vector_bf_add(v0, v0_l, p_vector, p2_vector);
         aie::vector<int32_t, vec_prime_half> v0_l_half = aie::filter_even(v0_l);
         v0_l = aie::concat(v0_l_half, zero_vector_half);
 
         aie::vector<int32_t, vec_prime> v0_r = aie::shuffle_up(v0, 1);
-        v0_r = vector_modsub(v0_r, v0, p_vector);
+        v0_r = vector_bf_diff(v0_r, v0, p_vector, p2_vector);
         aie::vector<int32_t, vec_prime_half> v0_r_half = aie::filter_odd(v0_r);
         int32_t *__restrict pRoot_i = root_in + root_idx +
                                       core_idx * N_half / bf_width +
                                       i * vec_prime / 2;
         aie::vector<int32_t, vec_prime_half> root_vector_half =
             aie::load_v<vec_prime_half>(pRoot_i);
-        v0_r_half = vector_barrett(v0_r_half, p_vector_half, root_vector_half,
-                                   u_vector_half, w);
+        v0_r_half = vector_bf_mul(v0_r_half, p_vector_half, root_vector_half,
+                                  u_vector_half, w);
         v0_r = aie::concat(v0_r_half, zero_vector_half);
 
         auto [res, res2] = aie::interleave_zip(v0_l, v0_r, 1);
@@ -240,11 +594,11 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
         int32_t *__restrict pA_i = a_in + i * vec_prime;
         aie::vector<int32_t, vec_prime> v0 = aie::load_v<vec_prime>(pA_i);
         aie::vector<int32_t, vec_prime> v0_l = aie::shuffle_down(v0, 2);
-        v0_l = vector_modadd(v0, v0_l, p_vector);
+        v0_l = vector_bf_add(v0, v0_l, p_vector, p2_vector);
         auto [v0_l0, v0_l1] = aie::interleave_unzip(v0_l, zero_vector, 2);
 
         aie::vector<int32_t, vec_prime> v0_r = aie::shuffle_up(v0, 2);
-        v0_r = vector_modsub(v0_r, v0, p_vector);
+        v0_r = vector_bf_diff(v0_r, v0, p_vector, p2_vector);
         int32_t *__restrict pRoot_i = root_in + root_idx +
                                       core_idx * N_half / bf_width +
                                       i * vec_prime / 4;
@@ -271,7 +625,7 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
             aie::concat(root2_vector_half, root3_vector_half);
         aie::vector<int32_t, 16> root_vector =
             aie::concat(root_vector01, root_vector23);
-        v0_r = vector_barrett(v0_r, p_vector, root_vector, u_vector, w);
+        v0_r = vector_bf_mul(v0_r, p_vector, root_vector, u_vector, w);
         auto [v0_r0, v0_r1] = aie::interleave_unzip(v0_r, zero_vector, 2);
 
         auto [res, res2] = aie::interleave_zip(v0_l0, v0_r1, 2);
@@ -285,11 +639,11 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
         int32_t *__restrict pA_i = a_in + i * vec_prime;
         aie::vector<int32_t, vec_prime> v0 = aie::load_v<vec_prime>(pA_i);
         aie::vector<int32_t, vec_prime> v0_l = aie::shuffle_down(v0, 4);
-        v0_l = vector_modadd(v0, v0_l, p_vector);
+        v0_l = vector_bf_add(v0, v0_l, p_vector, p2_vector);
         auto [v0_l0, v0_l1] = aie::interleave_unzip(v0_l, zero_vector, 4);
 
         aie::vector<int32_t, vec_prime> v0_r = aie::shuffle_up(v0, 4);
-        v0_r = vector_modsub(v0_r, v0, p_vector);
+        v0_r = vector_bf_diff(v0_r, v0, p_vector, p2_vector);
         int32_t *__restrict pRoot_i = root_in + root_idx +
                                       core_idx * N_half / bf_width +
                                       i * vec_prime / 8;
@@ -304,7 +658,7 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
             aie::shuffle_up_fill(root1_vector_half, zero_vector_half, 4);
         aie::vector<int32_t, vec_prime> root_vector =
             aie::concat(root0_vector_half, root1_vector_half);
-        v0_r = vector_barrett(v0_r, p_vector, root_vector, u_vector, w);
+        v0_r = vector_bf_mul(v0_r, p_vector, root_vector, u_vector, w);
         auto [v0_r0, v0_r1] = aie::interleave_unzip(v0_r, zero_vector, 4);
 
         auto [res, res2] = aie::interleave_zip(v0_l0, v0_r1, 4);
@@ -318,25 +672,28 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
         int32_t *__restrict pA_i = a_in + i * vec_prime;
         aie::vector<int32_t, vec_prime> v0 = aie::load_v<vec_prime>(pA_i);
         aie::vector<int32_t, vec_prime> v0_l = aie::shuffle_down(v0, 8);
-        v0_l = vector_modadd(v0, v0_l, p_vector);
+        v0_l = vector_bf_add(v0, v0_l, p_vector, p2_vector);
 
         aie::vector<int32_t, vec_prime> v0_r = aie::shuffle_up(v0, 8);
-        v0_r = vector_modsub(v0_r, v0, p_vector);
+        v0_r = vector_bf_diff(v0_r, v0, p_vector, p2_vector);
         int32_t *__restrict pRoot_i = root_in + root_idx +
                                       core_idx * N_half / bf_width +
                                       i * vec_prime / 16;
         // Case vec_prime = 16
         aie::vector<int32_t, vec_prime> root_vector =
             aie::broadcast<int32_t, vec_prime>(pRoot_i[0]);
-        v0_r = vector_barrett(v0_r, p_vector, root_vector, u_vector, w);
+        v0_r = vector_bf_mul(v0_r, p_vector, root_vector, u_vector, w);
         v0_r = aie::shuffle_down(v0_r, 8);
 
         auto [res, res2] = aie::interleave_zip(v0_l, v0_r, 8);
         aie::store_v(pA_i, res);
     }
 
-    // Stage 4 to Stage N-1
-    for (int stage = 4; stage < logN; stage++) {
+    // Stage 4 to Stage N-1. Radix 4 fuses pairs of stages, after a single
+    // one when their number is odd
+    int32_t stage = 4;
+    int32_t radix2_end = radix == 4 ? 4 + (logN - 4) % 2 : logN;
+    for (; stage < radix2_end; stage++) {
         bf_width *= 2;
         root_idx /= 2;
         for (int i = 0; i < F; i++)
@@ -350,16 +707,285 @@ void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
                 aie::vector<int32_t, vec_prime> root_vector =
                     aie::broadcast<int32_t, vec_prime>(root);
                 ntt_stage_parallel8(pA_i, pA_i + bf_width, pA_i,
-                                    pA_i + bf_width, p_vector, root_vector,
-                                    u_vector, p, w);
+                                    pA_i + bf_width, p_vector, p2_vector,
+                                    root_vector, u_vector, p, w);
             }
     }
+    for (; stage < logN; stage += 2) {
+        bf_width *= 2;
+        root_idx /= 2;
+        int32_t *__restrict pRoot = root_in + root_idx +
+                                    core_idx * N_half / bf_width;
+        int32_t *__restrict pRoot2 = root_in + root_idx / 2 +
+                                     core_idx * N_half / (2 * bf_width);
+        for (int i = 0; i < F / 2; i++)
+            chess_prepare_for_pipelining chess_loop_range(32, ) {
+                int32_t cycle = bf_width / vec_prime;
+                int32_t blk = i / cycle;
+                int32_t *__restrict pA_i =
+                    a_in + blk * bf_width * 4 + (i % cycle) * vec_prime;
+                aie::vector<int32_t, vec_prime> root0_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot[2 * blk]);
+                aie::vector<int32_t, vec_prime> root1_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot[2 * blk + 1]);
+                aie::vector<int32_t, vec_prime> root2_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot2[blk]);
+                ntt_stage_radix4(pA_i, bf_width, p_vector, p2_vector,
+                                 root0_vector, root1_vector, root2_vector,
+                                 u_vector, p, w);
+            }
+        bf_width *= 2;
+        root_idx /= 2;
+    }
     for (int i = 0; i < N / 2; i++) {
         c_out0[i] = a_in[i];
         c_out1[i] = a_in[i + N / 2];
     }
 }
 
+void ntt_stage0_to_Nminus5(int32_t *a_in, int32_t *root_in, int32_t *c_out0,
+                           int32_t *c_out1, int32_t N, int32_t logN,
+                           int32_t N_all, int32_t core_idx, int32_t p,
+                           int32_t w, int32_t u) {
+    ntt_local_gs(a_in, root_in, c_out0, c_out1, N, logN, N_all, core_idx, p,
+                 w, u, 2);
+}
+
+// Same with the stages from 4 on fused in pairs, half the passes over a_in
+void ntt_stage0_to_Nminus5_radix4(int32_t *a_in, int32_t *root_in,
+                                  int32_t *c_out0, int32_t *c_out1, int32_t N,
+                                  int32_t logN, int32_t N_all,
+                                  int32_t core_idx, int32_t p, int32_t w,
+                                  int32_t u) {
+    ntt_local_gs(a_in, root_in, c_out0, c_out1, N, logN, N_all, core_idx, p,
+                 w, u, 4);
+}
+
+// Local Cooley-Tukey stages, butterfly width N/2 down to 1. The first stage
+// pairs the halves a0 and a1, the result is written to c_out. Roots are
+// read from the compacted table, in_root[N / (2 * bf_width) + block]. Radix
+// 4 fuses pairs of the vector stages, after a single one when their number
+// is odd.
+static void ntt_local_ct(int32_t *a0, int32_t *a1, int32_t *root_in,
+                         int32_t *c_out, int32_t N, int32_t p, int32_t w,
+                         int32_t u, int32_t radix) {
+    const int N_half = N / 2;
+    const int32_t F = N_half / vec_prime;
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> p2_vector =
+        aie::broadcast<int32_t, vec_prime>(2 * p);
+    aie::vector<int32_t, vec_prime> u_vector =
+        aie::broadcast<int32_t, vec_prime>(u);
+
+    // Stage bf_width = N/2
+    aie::vector<int32_t, vec_prime> root_vector =
+        aie::broadcast<int32_t, vec_prime>(root_in[1]);
+    for (int i = 0; i < F; i++) {
+        ntt_stage_ct_parallel8(c_out + i * vec_prime,
+                               c_out + N_half + i * vec_prime,
+                               a0 + i * vec_prime, a1 + i * vec_prime,
+                               p_vector, p2_vector, root_vector, u_vector, p,
+                               w);
+    }
+
+    // Stage bf_width = N/4 to vec_prime
+    int32_t bf_width = N_half;
+    int32_t radix2_stages = 0;
+    for (int32_t b = N_half; b > vec_prime; b /= 2) {
+        radix2_stages++;
+    }
+    if (radix == 4) {
+        radix2_stages %= 2;
+    }
+    for (; radix2_stages > 0; radix2_stages--) {
+        bf_width /= 2;
+        int32_t root_idx = N / (2 * bf_width);
+        for (int i = 0; i < F; i++)
+            chess_prepare_for_pipelining {
+                int32_t cycle = bf_width / vec_prime;
+                int32_t idx_base =
+                    (i / cycle) * bf_width * 2 + (i % cycle) * vec_prime;
+                int32_t *__restrict pA_i = c_out + idx_base;
+                int32_t root = root_in[root_idx + i / cycle];
+                aie::vector<int32_t, vec_prime> root_vector =
+                    aie::broadcast<int32_t, vec_prime>(root);
+                ntt_stage_ct_parallel8(pA_i, pA_i + bf_width, pA_i,
+                                       pA_i + bf_width, p_vector, p2_vector,
+                                       root_vector, u_vector, p, w);
+            }
+    }
+    while (bf_width > vec_prime) {
+        bf_width /= 4;
+        int32_t *__restrict pRoot0 = root_in + N / (4 * bf_width);
+        int32_t *__restrict pRoot1 = root_in + N / (2 * bf_width);
+        for (int i = 0; i < F / 2; i++)
+            chess_prepare_for_pipelining {
+                int32_t cycle = bf_width / vec_prime;
+                int32_t blk = i / cycle;
+                int32_t *__restrict pA_i =
+                    c_out + blk * bf_width * 4 + (i % cycle) * vec_prime;
+                aie::vector<int32_t, vec_prime> root0_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot0[blk]);
+                aie::vector<int32_t, vec_prime> root1_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot1[2 * blk]);
+                aie::vector<int32_t, vec_prime> root2_vector =
+                    aie::broadcast<int32_t, vec_prime>(pRoot1[2 * blk + 1]);
+                ntt_stage_ct_radix4(pA_i, bf_width, p_vector, p2_vector,
+                                    root0_vector, root1_vector, root2_vector,
+                                    u_vector, p, w);
+            }
+    }
+
+    // Stage bf_width = vec_prime/2 to 1, narrower than a vector
+    while (bf_width > 1) {
+        bf_width /= 2;
+        int32_t root_idx = N / (2 * bf_width);
+        for (int blk = 0; blk < N / (2 * bf_width); blk++) {
+            int32_t root = root_in[root_idx + blk];
+            int32_t *pA = c_out + blk * 2 * bf_width;
+            for (int j = 0; j < bf_width; j++) {
+                int32_t v0 = pA[j];
+                int32_t v1 = bf_mul(pA[j + bf_width], root, p, w, u);
+                pA[j] = bf_add(v0, v1, p);
+                pA[j + bf_width] = bf_sub(v0, v1, p);
+            }
+        }
+    }
+}
+
+void ntt_ct_local(int32_t *a0, int32_t *a1, int32_t *root_in, int32_t *c_out,
+                  int32_t N, int32_t p, int32_t w, int32_t u) {
+    ntt_local_ct(a0, a1, root_in, c_out, N, p, w, u, 2);
+}
+
+void ntt_ct_local_radix4(int32_t *a0, int32_t *a1, int32_t *root_in,
+                         int32_t *c_out, int32_t N, int32_t p, int32_t w,
+                         int32_t u) {
+    ntt_local_ct(a0, a1, root_in, c_out, N, p, w, u, 4);
+}
+
+void load_halves(int32_t *from, int32_t *a, int32_t *b, int32_t N_ab) {
+    const int F = N_ab / vec_prime;
+    for (int i = 0; i < F; i++) {
+        aie::vector<int32_t, vec_prime> va_i =
+            aie::load_v<vec_prime>(from + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vb_i =
+            aie::load_v<vec_prime>(from + N_ab + i * vec_prime);
+        aie::store_v(a + i * vec_prime, va_i);
+        aie::store_v(b + i * vec_prime, vb_i);
+    }
+}
+
+void pointwise_mul(int32_t *out, int32_t *a, int32_t *b, int32_t N,
+                   int32_t p, int32_t w, int32_t u) {
+    const int F = N / vec_prime;
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> u_vector =
+        aie::broadcast<int32_t, vec_prime>(u);
+    for (int i = 0; i < F; i++) {
+        aie::vector<int32_t, vec_prime> va_i =
+            aie::load_v<vec_prime>(a + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vb_i =
+            aie::load_v<vec_prime>(b + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vc_i =
+            vector_modmul(va_i, p_vector, vb_i, u_vector, w);
+        aie::store_v(out + i * vec_prime, vc_i);
+    }
+}
+
+// write_back of the lazy butterflies, reducing to [0, p)
+void write_back_reduced(int32_t *to, int32_t *a, int32_t *b, int32_t N_ab,
+                        int32_t p) {
+    const int F = N_ab / vec_prime;
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    for (int i = 0; i < F; i++) {
+        aie::vector<int32_t, vec_prime> va_i =
+            aie::load_v<vec_prime>(a + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vb_i =
+            aie::load_v<vec_prime>(b + i * vec_prime);
+        aie::store_v(to + i * vec_prime, vector_reduce(va_i, p_vector));
+        aie::store_v(to + N_ab + i * vec_prime, vector_reduce(vb_i, p_vector));
+    }
+}
+
+// write_back multiplying every coefficient by scale, e.g. N^-1 mod p
+void write_back_scaled(int32_t *to, int32_t *a, int32_t *b, int32_t N_ab,
+                       int32_t scale, int32_t p, int32_t w, int32_t u) {
+    const int F = N_ab / vec_prime;
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> u_vector =
+        aie::broadcast<int32_t, vec_prime>(u);
+    aie::vector<int32_t, vec_prime> scale_vector =
+        aie::broadcast<int32_t, vec_prime>(scale);
+    for (int i = 0; i < F; i++) {
+        aie::vector<int32_t, vec_prime> va_i =
+            aie::load_v<vec_prime>(a + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vb_i =
+            aie::load_v<vec_prime>(b + i * vec_prime);
+        aie::store_v(to + i * vec_prime,
+                     vector_modmul(va_i, p_vector, scale_vector, u_vector, w));
+        aie::store_v(to + N_ab + i * vec_prime,
+                     vector_modmul(vb_i, p_vector, scale_vector, u_vector, w));
+    }
+}
+
+// write_back multiplying coefficient i by tw[i], the four-step twiddles
+void write_back_mul(int32_t *to, int32_t *a, int32_t *b, int32_t *tw,
+                    int32_t offset, int32_t N_ab, int32_t p, int32_t w,
+                    int32_t u) {
+    const int F = N_ab / vec_prime;
+    tw += offset;
+    aie::vector<int32_t, vec_prime> p_vector =
+        aie::broadcast<int32_t, vec_prime>(p);
+    aie::vector<int32_t, vec_prime> u_vector =
+        aie::broadcast<int32_t, vec_prime>(u);
+    for (int i = 0; i < F; i++) {
+        aie::vector<int32_t, vec_prime> va_i =
+            aie::load_v<vec_prime>(a + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vb_i =
+            aie::load_v<vec_prime>(b + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vta_i =
+            aie::load_v<vec_prime>(tw + i * vec_prime);
+        aie::vector<int32_t, vec_prime> vtb_i =
+            aie::load_v<vec_prime>(tw + N_ab + i * vec_prime);
+        aie::store_v(to + i * vec_prime,
+                     vector_modmul(va_i, p_vector, vta_i, u_vector, w));
+        aie::store_v(to + N_ab + i * vec_prime,
+                     vector_modmul(vb_i, p_vector, vtb_i, u_vector, w));
+    }
+}
+
+// Hand a half buffer to the MemTile exchange
+void exchange_put(int32_t *to, int32_t *from, int32_t N) {
+    const int F = N / vec_prime;
+    for (int i = 0; i < F; i++) {
+        aie::store_v(to + i * vec_prime,
+                     aie::load_v<vec_prime>(from + i * vec_prime));
+    }
+}
+
+// Take the half at offset out of the halves the MemTile joined
+void exchange_get(int32_t *to, int32_t *from, int32_t offset, int32_t N) {
+    const int F = N / vec_prime;
+    for (int i = 0; i < F; i++) {
+        aie::store_v(to + i * vec_prime,
+                     aie::load_v<vec_prime>(from + offset + i * vec_prime));
+    }
+}
+
+// Copy the root table at offset out of the tables of a column
+void load_roots(int32_t *to, int32_t *from, int32_t offset, int32_t N) {
+    const int F = N / vec_prime;
+    for (int i = 0; i < F; i++) {
+        aie::store_v(to + i * vec_prime,
+                     aie::load_v<vec_prime>(from + offset + i * vec_prime));
+    }
+}
+
 void ntt_stage0_to_Nminus5_1core(int32_t N, int32_t logN, int32_t *c_out0,
                                  int32_t *a_in, int32_t p, int32_t w,
                                  int32_t u) {
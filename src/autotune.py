@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+from collections import namedtuple
+
+from aie.extras.context import mlir_mod_ctx
+
+import aie2
+from build_cache import BuildCache, make_build
+from ntt_model import ACC_OPS, REDUCTIONS, VEC, butterfly_ops
+from schedule import EXCHANGES, design_passes
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One point of the design space, the arguments of aie2.ntt except the trace.
+# p is a tuple of primes.
+Config = namedtuple("Config", ["design", "logN", "n_column", "n_row", "p", "batch", "buffer_depth", "resident_roots", "exchange", "reduction", "lazy", "radix"])
+# Knobs swept by default, the rest of Config is fixed per sweep
+SPACE = {
+    "n_column": (1, 2, 4),
+    "n_row": (1, 2, 4),
+    "buffer_depth": (1, 2, 3),
+    "resident_roots": (False, True),
+    "exchange": EXCHANGES,
+    "reduction": REDUCTIONS,
+    "lazy": (False, True),
+    "radix": aie2.RADICES,
+}
+RESULT_FIELDS = list(Config._fields) + ["runner", "status", "time_us"]
+
+
+def configs(design, logNs, p, batch=1, space=SPACE):
+    """Valid points of the space for every logN.
+
+    Points rejected by aie2.check_params are dropped, as are the streamed
+    roots variants of designs that always keep their roots resident and the
+    memtile exchange on single rows, which have no partners in a column.
+    """
+    for logN in logNs:
+        for values in itertools.product(*space.values()):
+            config = Config(design=design, logN=logN, p=tuple(p), batch=batch, **dict(zip(space, values)))
+            if not config.resident_roots and (design == "fourstep" or config.exchange == "memtile"):
+                continue
+            if config.exchange == "memtile" and config.n_row == 1:
+                continue
+            if design == "fourstep" and batch != 1:
+                continue
+            try:
+                aie2.check_params(logN, config.n_column, config.n_row, config.p, config.resident_roots,
+                                  design, config.exchange, config.buffer_depth, config.reduction, config.lazy, config.radix, batch)
+            except ValueError:
+                continue
+            yield config
+
+
+def config_name(config):
+    # Build directory name of a point
+    name = f"{config.design}_logn{config.logN}_{config.n_column}x{config.n_row}_p{'-'.join(map(str, config.p))}"
+    name += f"_b{config.batch}_d{config.buffer_depth}_{config.exchange}_{config.reduction}"
+    name += "_lazy" if config.lazy else ""
+    name += f"_r{config.radix}"
+    return name + ("_resident" if config.resident_roots else "")
+
+
+def make_variables(config):
+    # Makefile variables building a point
+    return {
+        "LOGN": config.logN,
+        "COLUMNS": config.n_column,
+        "ROWS": config.n_row,
+        "PRIME": " ".join(map(str, config.p)),
+        "DESIGN": config.design,
+        "BATCH": config.batch,
+        "BUFFER_DEPTH": config.buffer_depth,
+        "RESIDENT_ROOTS": int(config.resident_roots),
+        "EXCHANGE": config.exchange,
+        "REDUCTION": config.reduction,
+        "LAZY": int(config.lazy),
+        "RADIX": config.radix,
+    }
+
+
+def generate(config, build_dir):
+    # Write the MLIR and root indices of a point as the Makefile does
+    os.makedirs(build_dir, exist_ok=True)
+    with mlir_mod_ctx() as ctx:
+        aie2.ntt(config.logN, config.n_column, config.n_row, config.p, 0, config.batch, config.resident_roots,
+                 config.design, config.exchange, config.buffer_depth, config.reduction, config.lazy, config.radix)
+        with open(os.path.join(build_dir, "aie.mlir"), "w") as f:
+            f.write(str(ctx.module))
+    indices = aie2.host_root_indices(config.logN, config.n_column, config.n_row, config.design, len(config.p), config.exchange)
+    with open(os.path.join(build_dir, "root_index.txt"), "w") as f:
+        f.write("".join(f"{i}\n" for i in indices))
+
+
+class ModelRunner:
+    """Analytical estimate of the time per polynomial, needs no NPU.
+
+    Every step of the schedule lasts as long as its slowest core, whose ops
+    and lock handshakes are priced by the cycle counts below. Butterflies
+    are bound by the accumulator ops or the vector ALU ops ntt_model counts
+    for the reduction and butterflies, whichever take longer, issued once
+    per ACC_OP_CYCLES and ALU_OP_CYCLES for VEC lanes, and every pass of
+    the local stages over a core's data costs a vector copy of it. The shim
+    DMAs move a column's share of the data at DMA_BYTES_PER_CYCLE and overlap
+    the compute, as the cores only hold the input and output elements of
+    the object fifos in the steps reading and writing them. Single buffered,
+    the input of the next polynomial waits for the step reading the current
+    one to release the only element. The figures are
+    rough, calibrate them against NpuRunner results before trusting a
+    ranking between close points.
+    """
+    name = "model"
+    CLOCK_MHZ = 1000
+    LAUNCH_US = 250  # kernel launch and sync as measured in profile/exectime
+    ACC_OP_CYCLES = 1
+    ALU_OP_CYCLES = 1
+    COPY_CYCLES = 0.125  # per word of a vector copy
+    LOCK_CYCLES = 40  # per lock handshake
+    EXCHANGE_CYCLES = 200  # MemTile round trip of a half buffer
+    DMA_BYTES_PER_CYCLE = 4
+
+    def build(self, config, build_dir):
+        generate(config, build_dir)
+        return build_dir
+
+    def local_passes(self, data_percore, radix):
+        # Passes of the local stages over a core's data, radix 4 fuses the
+        # stages past the first four in pairs
+        paired = int(math.log2(data_percore)) - 4
+        return 4 + (paired if radix == 2 else (paired + 1) // 2)
+
+    def op_cycles(self, kind, data_percore, reduction, lazy=False, radix=2):
+        half = data_percore // 2
+        ops = butterfly_ops(reduction, lazy=lazy)
+        acc = sum(ops[k] for k in ACC_OPS)
+        butterflies = max(self.ACC_OP_CYCLES * acc, self.ALU_OP_CYCLES * (sum(ops.values()) - acc)) / VEC * half
+        local = (butterflies * int(math.log2(data_percore)) +
+                 self.COPY_CYCLES * data_percore * self.local_passes(data_percore, radix))
+        # write_back_reduced compares, selects and subtracts every word
+        reduce = 3 * self.ALU_OP_CYCLES / VEC * data_percore if lazy else self.COPY_CYCLES * data_percore
+        return {
+            "load": self.COPY_CYCLES * data_percore,
+            "local_gs": local,
+            "local_ct": local,
+            "local_ct_mul": local + 2 * butterflies,
+            "write_back": reduce,
+            "write_back_scaled": 2 * butterflies,
+            "write_back_twiddle": 2 * butterflies,
+            "ntt": butterflies,
+            "ct": butterflies,
+            "xntt": butterflies + 3 * self.COPY_CYCLES * half + 2 * self.EXCHANGE_CYCLES,
+            "xct": butterflies + 3 * self.COPY_CYCLES * half + 2 * self.EXCHANGE_CYCLES,
+            "swap_buff": 2 * self.COPY_CYCLES * half,
+        }[kind]
+
+    def run(self, config, build_dir):
+        logN_sub, group_columns = aie2.transform_grid(config.logN, config.n_column, len(config.p), config.design)
+        data_percore = (1 << logN_sub) // (group_columns * config.n_row)
+        n_groups = config.n_column // group_columns
+        count = (1 << logN_sub) // config.n_column if config.design == "fourstep" else config.batch
+        passes = design_passes(config.design, config.n_column, config.n_row, n_groups, config.exchange, count)
+
+        # Steps holding the input element
+        input_kinds = ("load",) if config.design == "polymul" else ("local_gs",)
+        compute = 0
+        holding_input = 0
+        for p in passes:
+            transform = 0
+            for s, ops in enumerate(p.steps):
+                cores = {}
+                for op in ops:
+                    cores[op.core] = cores.get(op.core, 0) + self.op_cycles(op.kind, data_percore, config.reduction, config.lazy, config.radix)
+                for core in cores:
+                    handshakes = len(p.pre.get((s, core), [])) + len(p.post.get((s, core), []))
+                    cores[core] += self.LOCK_CYCLES * handshakes
+                transform += max(cores.values())
+                if any(op.kind in input_kinds for op in ops):
+                    holding_input += p.count * max(cores.values())
+            compute += p.count * transform
+        if not config.resident_roots:
+            # Every launch, each core copies its root tables out of the
+            # tables of its column
+            n_tables = 2 if config.design == "polymul" else 1
+            compute += self.COPY_CYCLES * aie2.root_table_len(data_percore) * n_tables
+
+        # Words a column's shim DMAs move in and out per launch
+        n_inputs = 2 if config.design == "polymul" else 1
+        in_limbs = len(config.p) if config.design == "intt" else 1
+        N = 1 << config.logN
+        words = ((in_limbs * n_inputs + len(config.p)) * config.batch * N) // config.n_column
+        if config.design == "fourstep":
+            words = 5 * N // config.n_column
+        elif not config.resident_roots:
+            words += aie2.root_table_len(data_percore) * config.n_row * (2 if config.design == "polymul" else 1)
+        dma = 4 * words / self.DMA_BYTES_PER_CYCLE
+        cycles = max(compute, dma if config.buffer_depth > 1 else holding_input + dma)
+        return [(self.LAUNCH_US + cycles / self.CLOCK_MHZ) / config.batch]
+
+
+class NpuRunner:
+    """Build a point with the Makefile and time test.exe on the NPU.
+
+    With a BuildCache, points already built are taken from it and new
+    builds are added to it. run returns the time per polynomial of every
+    timed launch of test.exe, which must also verify the output.
+    """
+    name = "npu"
+
+    def __init__(self, exe, cache=None):
+        self.exe = exe
+        self.cache = cache
+
+    def build(self, config, build_dir):
+        if self.cache is not None:
+            return self.cache.get(make_variables(config))
+        make_build(make_variables(config), build_dir)
+        return build_dir
+
+    def run(self, config, build_dir):
+        cmd = [self.exe, "-x", os.path.join(build_dir, "final.xclbin"), "-k", "MLIR_AIE",
+               "-i", os.path.join(build_dir, "insts.txt"), "--root-index", os.path.join(build_dir, "root_index.txt"),
+               "--logn", str(config.logN), "--columns", str(config.n_column), "--rows", str(config.n_row),
+               "--prime"] + [str(q) for q in config.p] + ["--design", config.design, "--batch", str(config.batch)]
+        cmd += ["--reduction", config.reduction]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        return [float(t) for t in re.findall(r"^[\d.]+ us, ([\d.]+) us/poly$", result.stdout, re.MULTILINE)]
+
+
+def summarize(samples):
+    # Mean without the fastest and slowest launch, as plot_exectime.py does
+    if len(samples) > 2:
+        samples = sorted(samples)[1:-1]
+    return sum(samples) / len(samples)
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def result_key(row):
+    return tuple(str(row[k]) for k in Config._fields + ("runner",))
+
+
+def config_row(config, runner):
+    row = config._asdict()
+    row["p"] = " ".join(map(str, config.p))
+    row["runner"] = runner.name
+    return row
+
+
+def sweep(points, runner, results_path, build_root):
+    """Build and time every point not yet in the results table.
+
+    Each result is appended to the table as soon as it is known, so an
+    interrupted sweep resumes where it stopped. Points that fail to build
+    or run are recorded as such and not retried. runner.build(config,
+    build_dir) returns the directory its build ends up in, which
+    runner.run(config, build_dir) then times.
+    """
+    done = {result_key(row) for row in load_results(results_path)}
+    new_file = not os.path.exists(results_path)
+    with open(results_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        for config in points:
+            row = config_row(config, runner)
+            if result_key(row) in done:
+                continue
+            build_dir = os.path.join(build_root, config_name(config))
+            try:
+                build_dir = runner.build(config, build_dir)
+            except (subprocess.CalledProcessError, ValueError) as e:
+                print(f"{config_name(config)}: build failed: {e}", file=sys.stderr)
+                row.update(status="build failed", time_us="")
+            else:
+                try:
+                    samples = runner.run(config, build_dir)
+                except subprocess.CalledProcessError as e:
+                    print(f"{config_name(config)}: run failed: {e}", file=sys.stderr)
+                    samples = []
+                if samples:
+                    row.update(status="ok", time_us=f"{summarize(samples):.3f}")
+                else:
+                    row.update(status="run failed", time_us="")
+            print(f"{config_name(config)}: {row['status']} {row['time_us']}")
+            writer.writerow(row)
+            f.flush()
+
+
+def dispatch_table(rows, runner_name):
+    """Fastest configuration of every design and logN, keyed by both.
+
+    Entries hold the remaining Config fields, typed, and time_us.
+    """
+    table = {}
+    for row in rows:
+        if row["runner"] != runner_name or row["status"] != "ok":
+            continue
+        entry = {
+            "n_column": int(row["n_column"]),
+            "n_row": int(row["n_row"]),
+            "p": [int(q) for q in row["p"].split()],
+            "batch": int(row["batch"]),
+            "buffer_depth": int(row["buffer_depth"]),
+            "resident_roots": row["resident_roots"] == "True",
+            "exchange": row["exchange"],
+            "reduction": row["reduction"],
+            "lazy": row["lazy"] == "True",
+            "radix": int(row["radix"]),
+            "time_us": float(row["time_us"]),
+        }
+        best = table.setdefault(row["design"], {}).get(row["logN"])
+        if best is None or entry["time_us"] < best["time_us"]:
+            table[row["design"]][row["logN"]] = entry
+    return table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sweep the generator parameters and pick the fastest design for every N")
+    parser.add_argument("--design", choices=aie2.DESIGNS, default="ntt", help="design to tune")
+    parser.add_argument("--logn", type=int, nargs="+", default=[9, 10, 11, 12], help="log2 of the numbers of points to tune for")
+    parser.add_argument("-p", "--prime", type=int, nargs="+", default=[3329], help="prime modulus, several for RNS limbs")
+    parser.add_argument("--batch", type=int, default=1, help="polynomials transformed per launch")
+    parser.add_argument("--columns", type=int, nargs="+", default=SPACE["n_column"], help="column counts to sweep")
+    parser.add_argument("--rows", type=int, nargs="+", default=SPACE["n_row"], help="row counts to sweep")
+    parser.add_argument("--buffer-depth", type=int, nargs="+", default=SPACE["buffer_depth"], help="object fifo depths to sweep")
+    parser.add_argument("--resident-roots", type=int, choices=(0, 1), nargs="+", default=[0, 1], help="root placements to sweep, 1 for resident")
+    parser.add_argument("--exchange", choices=EXCHANGES, nargs="+", default=EXCHANGES, help="exchanges to sweep")
+    parser.add_argument("--reduction", choices=REDUCTIONS, nargs="+", default=REDUCTIONS, help="reductions to sweep")
+    parser.add_argument("--lazy", type=int, choices=(0, 1), nargs="+", default=[0, 1], help="butterflies to sweep, 1 for lazy reduction")
+    parser.add_argument("--radix", type=int, choices=aie2.RADICES, nargs="+", default=aie2.RADICES, help="radices of the local stages to sweep")
+    parser.add_argument("--runner", choices=("model", "npu"), default="model", help="estimate with the analytical model or time on the NPU")
+    parser.add_argument("--exe", default="test.exe", help="host program timing the designs with the npu runner")
+    parser.add_argument("--results", default=os.path.join(REPO_DIR, "profile", "autotune.csv"), help="results table, resumed when it exists")
+    parser.add_argument("--dispatch", default=os.path.join(REPO_DIR, "profile", "dispatch.json"), help="output dispatch table")
+    parser.add_argument("--cache", help="build cache directory of the npu runner, see build_cache.py")
+    parser.add_argument("--build-dir", default=os.path.join(REPO_DIR, "build", "autotune"), help="directory of the per-point builds")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opts = parse_args()
+    space = {
+        "n_column": opts.columns,
+        "n_row": opts.rows,
+        "buffer_depth": opts.buffer_depth,
+        "resident_roots": [bool(v) for v in opts.resident_roots],
+        "exchange": opts.exchange,
+        "reduction": opts.reduction,
+        "lazy": [bool(v) for v in opts.lazy],
+        "radix": opts.radix,
+    }
+    runner = ModelRunner() if opts.runner == "model" else NpuRunner(opts.exe, opts.cache and BuildCache(opts.cache))
+    sweep(configs(opts.design, opts.logn, opts.prime, opts.batch, space), runner, opts.results, opts.build_dir)
+    table = dispatch_table(load_results(opts.results), runner.name)
+    with open(opts.dispatch, "w") as f:
+        json.dump(table, f, indent=2)
+    for logN, best in sorted(table.get(opts.design, {}).items(), key=lambda kv: int(kv[0])):
+        print(f"logN {logN}: {best['n_column']}x{best['n_row']}, depth {best['buffer_depth']}, "
+              f"{best['exchange']}, {best['reduction']}{', lazy' if best['lazy'] else ''}, radix {best['radix']}{', resident roots' if best['resident_roots'] else ''}: {best['time_us']} us/poly")
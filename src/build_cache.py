@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+import argparse
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Sources the MLIR is generated from and the kernel object is compiled from,
+# relative to REPO_DIR; the Makefile holds the compile flags and recipes
+GENERATOR_SOURCES = ("src/aie2.py", "src/schedule.py", "src/ntt_model.py")
+KERNEL_SOURCES = ("src/aie_core.cc", "Makefile")
+# Files of a build kept for every variant
+ARTIFACTS = ("aie.mlir", "root_index.txt", "insts.txt", "final.xclbin")
+# Kernel objects of the reductions, shared by all variants
+KERNEL_OBJECTS = ("ntt_core.o", "ntt_core_montgomery.o", "ntt_core_montgomery_lazy.o")
+DEFAULT_BUDGET = 4 << 30
+
+
+def toolchain_version():
+    # mlir-aie wheel and the Vitis install the kernels are compiled with,
+    # whose path names its release
+    try:
+        aie = importlib.metadata.version("mlir_aie")
+    except importlib.metadata.PackageNotFoundError:
+        aie = "unknown"
+    vitis = shutil.which("vitis")
+    return f"mlir_aie {aie}, vitis {os.path.realpath(vitis) if vitis else 'unknown'}"
+
+
+def digest(parts, sources):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\0")
+    for name in sources:
+        with open(os.path.join(REPO_DIR, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def make_build(params, build_dir):
+    # Build a variant with the Makefile, params are its variables
+    subprocess.run(["make", "-C", REPO_DIR, f"BUILD_DIR={os.path.abspath(build_dir)}"] +
+                   [f"{k}={v}" for k, v in params.items()], check=True)
+
+
+class BuildCache:
+    """Builds of the design keyed by what they are made from.
+
+    A variant's key hashes its Makefile variables (params), the generator
+    and kernel sources and the toolchain version, so any change to them
+    misses the cache. Every variant keeps ARTIFACTS in its own directory,
+    the kernel objects are shared by all variants of the same kernel source
+    and toolchain. Lookups refresh an entry, and storing evicts the least
+    recently used entries once the cache exceeds budget bytes.
+    """
+
+    def __init__(self, root, budget=DEFAULT_BUDGET, toolchain=None):
+        self.root = root
+        self.budget = budget
+        self.toolchain = toolchain_version() if toolchain is None else toolchain
+        os.makedirs(os.path.join(root, "variants"), exist_ok=True)
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+    def key(self, params):
+        parts = [self.toolchain] + [f"{k}={params[k]}" for k in sorted(params)]
+        return digest(parts, GENERATOR_SOURCES + KERNEL_SOURCES)
+
+    def kernel_key(self):
+        return digest([self.toolchain], KERNEL_SOURCES)
+
+    def path(self, params):
+        return os.path.join(self.root, "variants", self.key(params))
+
+    def lookup(self, params):
+        """Directory holding the variant's ARTIFACTS, None on a miss."""
+        path = self.path(params)
+        if not all(os.path.exists(os.path.join(path, name)) for name in ARTIFACTS):
+            return None
+        os.utime(path)
+        return path
+
+    def kernel_objects(self):
+        # Cached kernel objects of the current kernel source
+        obj_dir = os.path.join(self.root, "objects", self.kernel_key())
+        if not os.path.isdir(obj_dir):
+            return []
+        os.utime(obj_dir)
+        return [os.path.join(obj_dir, name) for name in os.listdir(obj_dir)]
+
+    def store(self, params, build_dir):
+        """Copy a finished build of the variant into the cache."""
+        path = self.path(params)
+        tmp = tempfile.mkdtemp(dir=os.path.join(self.root, "variants"))
+        for name in ARTIFACTS:
+            shutil.copy2(os.path.join(build_dir, name), tmp)
+        with open(os.path.join(tmp, "params.json"), "w") as f:
+            json.dump(params, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+
+        obj_dir = os.path.join(self.root, "objects", self.kernel_key())
+        for name in KERNEL_OBJECTS:
+            obj = os.path.join(build_dir, name)
+            if os.path.exists(obj) and not os.path.exists(os.path.join(obj_dir, name)):
+                os.makedirs(obj_dir, exist_ok=True)
+                shutil.copy2(obj, obj_dir)
+        self.evict(keep={path})
+        return path
+
+    def get(self, params, build=make_build):
+        """Directory of the variant's ARTIFACTS, built on a miss.
+
+        build(params, build_dir) builds the variant into an empty scratch
+        directory, which is seeded with the cached kernel objects so that
+        only the MLIR and the xclbin are regenerated.
+        """
+        path = self.lookup(params)
+        if path is not None:
+            return path
+        with tempfile.TemporaryDirectory() as build_dir:
+            for obj in self.kernel_objects():
+                # A fresh copy is newer than the kernel source, make keeps it
+                shutil.copy(obj, build_dir)
+            build(params, build_dir)
+            return self.store(params, build_dir)
+
+    def entries(self):
+        # (last use, bytes, path) of every variant and kernel object
+        entries = []
+        for kind in ("variants", "objects"):
+            base = os.path.join(self.root, kind)
+            for name in os.listdir(base):
+                path = os.path.join(base, name)
+                entries.append((os.path.getmtime(path), dir_bytes(path), path))
+        return entries
+
+    def evict(self, keep=()):
+        """Drop the least recently used entries until the cache fits budget."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.budget:
+                break
+            if path in keep:
+                continue
+            shutil.rmtree(path)
+            total -= size
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print the cached build of a variant, building it on a miss")
+    parser.add_argument("params", nargs="*", metavar="VAR=VALUE", help="Makefile variables of the variant, e.g. LOGN=10 COLUMNS=2")
+    parser.add_argument("--cache", default=os.path.join(REPO_DIR, "build", "cache"), help="cache directory")
+    parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET >> 20, help="disk budget of the cache in MiB")
+    parser.add_argument("--lookup", action="store_true", help="only look the variant up, exit with 1 on a miss")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opts = parse_args()
+    params = dict(p.split("=", 1) for p in opts.params)
+    cache = BuildCache(opts.cache, opts.budget << 20)
+    if opts.lookup:
+        path = cache.lookup(params)
+        if path is None:
+            sys.exit(1)
+    else:
+        try:
+            path = cache.get(params)
+        except subprocess.CalledProcessError as e:
+            sys.exit(f"Error: {e}")
+    print(path)
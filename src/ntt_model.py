@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+import argparse
+import functools
+import math
+import time
+from collections import Counter
+
+import numpy as np
+
+# Modular reductions of the kernels, see vector_modmul in aie_core.cc
+REDUCTIONS = ("barrett", "montgomery")
+MONTGOMERY_BITS = 32
+# Lanes are int32, so are the primes and the residues below them
+LANE_BITS = 31
+VEC = 16
+
+# Vector ops the model counts, by unit: mul / msc write an accumulator, srs
+# reads one back (to_vector), the rest run on the vector ALU
+ACC_OPS = ("mul", "msc", "srs")
+counts = Counter()
+
+
+def product_bound(q, lazy=False):
+    # Largest product the kernels reduce: of two residues, or with NTT_LAZY
+    # of two lazy residues below 2q, which also covers the Gentleman-Sande
+    # difference below 4q times a root
+    return ((2 if lazy else 1) * q - 1) ** 2
+
+
+def barrett_constants(q):
+    """(w, u) of vector_barrett for q, None if no w suits it.
+
+    vector_barrett estimates s = ((t >> (w - 2)) u) >> (w + 2) of t // q
+    with u = 2^2w // q. Dropping the low bits of t and of 2^2w / q loses
+    less than t / 2^2w + 2^(w - 2) / q + 1 of the quotient, so s is at most
+    one short whenever that is below 2 for t <= (q - 1)^2, and c = t - s q
+    stays below 2q. Past ceil(log2 q) a larger w shrinks the first term
+    faster than it grows the second, until u or x_1 outgrow the lanes.
+    Products of lazy residues, up to 4q^2, keep the first two terms above
+    1 for every w, so the lazy kernels take the montgomery reduction.
+    """
+    w = (q - 1).bit_length()
+    while True:
+        u = (1 << 2 * w) // q
+        if u >> LANE_BITS or ((q - 1) ** 2 >> (w - 2)) >> LANE_BITS:
+            return None
+        if (q - 1) ** 2 * q + (1 << 3 * w - 2) <= q << 2 * w and 2 * q >> LANE_BITS == 0:
+            return w, u
+        w += 1
+
+
+def reduction_constants(q, reduction="barrett", lazy=False):
+    # (w, u) the kernels reduce products mod q with, see vector_modmul
+    if reduction == "montgomery":
+        qinv = pow(q, -1, 1 << MONTGOMERY_BITS)
+        return MONTGOMERY_BITS, qinv - (1 << MONTGOMERY_BITS) if qinv >> (MONTGOMERY_BITS - 1) else qinv
+    if lazy:
+        raise ValueError("the lazy kernels multiply lazy residues, which takes the montgomery reduction")
+    constants = barrett_constants(q)
+    if constants is None:
+        raise ValueError(f"barrett reduction of 32-bit lanes cannot reduce mod {q}, use the montgomery reduction")
+    return constants
+
+
+def root_generator(p):
+    # Smallest non-square mod p, as root_generator of the host. Its powers
+    # w = g^((p-1)/N) are primitive N-th roots of unity for every power of
+    # two N dividing p - 1
+    g = 2
+    while pow(g, (p - 1) >> 1, p) != p - 1:
+        g += 1
+    return g
+
+
+def to_montgomery(x, q, reduction="barrett"):
+    # Constant operand of a kernel product: Montgomery kernels multiply by
+    # 2^-32 on the way, so their constants carry a factor 2^32
+    return (x << MONTGOMERY_BITS) % q if reduction == "montgomery" else x
+
+
+# Lane-wise models of the AIE API calls the kernels use. Vectors are int32
+# arrays, accumulators int64 arrays holding the exact 64-bit lanes.
+
+def as_int32(x):
+    # Wrap to int32 as a 32-bit lane does
+    return np.asarray(x, dtype=np.int64).astype(np.int32)
+
+
+def mul(a, b):
+    counts["mul"] += 1
+    return np.asarray(a, dtype=np.int64) * np.asarray(b, dtype=np.int64)
+
+
+def msc(acc, a, b):
+    counts["msc"] += 1
+    return acc - np.asarray(a, dtype=np.int64) * np.asarray(b, dtype=np.int64)
+
+
+def srs(acc, shift):
+    # to_vector<int32_t>(shift): arithmetic shift, low 32 bits kept
+    counts["srs"] += 1
+    return as_int32(acc >> shift)
+
+
+def add(a, b):
+    counts["add"] += 1
+    return as_int32(np.asarray(a, dtype=np.int64) + b)
+
+
+def sub(a, b):
+    counts["sub"] += 1
+    return as_int32(np.asarray(a, dtype=np.int64) - b)
+
+
+def lt(a, b):
+    counts["cmp"] += 1
+    return a < b
+
+
+def ge(a, b):
+    counts["cmp"] += 1
+    return a >= b
+
+
+def select(a, b, mask):
+    # aie::select(a, b, mask): b where mask is set, a elsewhere
+    counts["select"] += 1
+    return as_int32(np.where(mask, b, a))
+
+
+def vector_modadd(v0, v1, p):
+    v2 = sub(v0, sub(p, v1))
+    return add(v2, select(p, 0, ge(v2, 0)))
+
+
+def vector_modsub(v0, v1, p):
+    v3 = sub(v0, v1)
+    return add(v3, select(p, 0, ge(v3, 0)))
+
+
+# NTT_LAZY counterparts, lazy residues are in [0, p2) with p2 = 2p
+
+def vector_lazy_add(v0, v1, p2):
+    v2 = add(v0, v1)
+    return sub(v2, select(p2, 0, lt(v2, p2)))
+
+
+def vector_lazy_diff(v0, v1, p2):
+    return sub(add(v0, p2), v1)
+
+
+def vector_lazy_sub(v0, v1, p2):
+    v3 = vector_lazy_diff(v0, v1, p2)
+    return sub(v3, select(p2, 0, lt(v3, p2)))
+
+
+def vector_reduce(v, p):
+    return sub(v, select(p, 0, lt(v, p)))
+
+
+def vector_barrett(v, p, root, u, w):
+    t = mul(v, root)
+    x_1 = srs(t, w - 2)
+    s = srs(mul(x_1, u), w + 2)
+    r = mul(s, p)
+    c = sub(srs(t, 0), srs(r, 0))
+    return sub(c, select(p, 0, lt(c, p)))
+
+
+def vector_montgomery_signed(v, p, root, qinv):
+    t = mul(v, root)
+    m_lo = srs(mul(srs(t, 0), qinv), 0)
+    return srs(msc(t, m_lo, p), MONTGOMERY_BITS)
+
+
+def vector_montgomery(v, p, root, qinv):
+    c = vector_montgomery_signed(v, p, root, qinv)
+    return add(c, select(p, 0, ge(c, 0)))
+
+
+def vector_montgomery_lazy(v, p, root, qinv):
+    return add(vector_montgomery_signed(v, p, root, qinv), p)
+
+
+def vector_modmul(v, p, root, u, w, reduction="barrett", lazy=False):
+    # v * root mod p, times 2^-32 for montgomery, as the kernels compute it,
+    # in [0, 2p) if lazy
+    if reduction == "montgomery":
+        return (vector_montgomery_lazy if lazy else vector_montgomery)(v, p, root, u)
+    return vector_barrett(v, p, root, u, w)
+
+
+def gs_butterfly(v0, v1, root, p, reduction="barrett", lazy=False):
+    # ntt_stage_parallel8: (v0 + v1, (v0 - v1) root)
+    w, u = reduction_constants(p, reduction, lazy)
+    if lazy:
+        return vector_lazy_add(v0, v1, 2 * p), vector_modmul(vector_lazy_diff(v0, v1, 2 * p), p, root, u, w, reduction, lazy)
+    return vector_modadd(v0, v1, p), vector_modmul(vector_modsub(v0, v1, p), p, root, u, w, reduction)
+
+
+def ct_butterfly(v0, v1, root, p, reduction="barrett", lazy=False):
+    # ntt_stage_ct_parallel8: (v0 + v1 root, v0 - v1 root)
+    w, u = reduction_constants(p, reduction, lazy)
+    m = vector_modmul(v1, p, root, u, w, reduction, lazy)
+    if lazy:
+        return vector_lazy_add(v0, m, 2 * p), vector_lazy_sub(v0, m, 2 * p)
+    return vector_modadd(v0, m, p), vector_modsub(v0, m, p)
+
+
+def ntt_gs(a, p, g=None, reduction="barrett", lazy=False):
+    """Cyclic NTT of a through the butterfly model, output in bit-reversed
+    order as the local stages of the kernels leave it, reduced as
+    write_back_reduced does when lazy."""
+    a = as_int32(a)
+    N = len(a)
+    root = pow(g or root_generator(p), (p - 1) // N, p)
+    half = N // 2
+    while half >= 1:
+        # Root of butterfly j of every block is root^(j N / (2 half))
+        step = N // (2 * half)
+        tw = as_int32([to_montgomery(pow(root, j * step, p), p, reduction) for j in range(half)])
+        blocks = a.reshape(-1, 2, half)
+        v0, v1 = gs_butterfly(blocks[:, 0], blocks[:, 1], np.broadcast_to(tw, blocks[:, 1].shape), p, reduction, lazy)
+        a = np.stack([v0, v1], axis=1).reshape(N)
+        half //= 2
+    return vector_reduce(a, p) if lazy else a
+
+
+def dft_bitrev(a, p, g=None):
+    # Exact reference of ntt_gs, O(N^2)
+    N = len(a)
+    root = pow(g or root_generator(p), (p - 1) // N, p)
+    powers = np.array([pow(root, i, p) for i in range(N)], dtype=object)
+    k = np.array([int(f"{i:0{N.bit_length() - 1}b}"[::-1], 2) for i in range(N)])
+    exponents = np.outer(np.arange(N), k) % N
+    return as_int32((np.asarray(a, dtype=object)[:, None] * powers[exponents]).sum(axis=0) % p)
+
+
+def butterfly_ops(reduction, kind="gs", lazy=False):
+    # Vector ops of one butterfly on VEC lanes
+    v = np.zeros(VEC, dtype=np.int32)
+    counts.clear()
+    (gs_butterfly if kind == "gs" else ct_butterfly)(v, v, v, 3329, reduction, lazy)
+    ops = Counter(counts)
+    counts.clear()
+    return ops
+
+
+@functools.lru_cache(maxsize=None)
+def check_prime(q, reduction="barrett", lazy=False, samples=1 << 16):
+    """Run the lane model of the kernel arithmetic mod q against exact
+    integers, raise ValueError where it goes wrong.
+
+    The operands cover every pair of the extreme residues, where sums and
+    products come closest to overflowing the lanes, and random residues.
+    The lazy ops take lazy residues and must return them congruent to the
+    exact result and below 2q, the others fully reduced.
+    """
+    if not 2 < q < 1 << LANE_BITS or any(q % d == 0 for d in range(2, math.isqrt(q) + 1)):
+        raise ValueError(f"the kernels take odd primes below 2^{LANE_BITS}, got {q}")
+    if lazy and 4 * q >> LANE_BITS:
+        raise ValueError(f"the lazy kernels take primes below 2^{LANE_BITS - 2}, got {q}")
+    w, u = reduction_constants(q, reduction, lazy)
+    rng = np.random.default_rng(q)
+    top = 2 * q if lazy else q
+    edges = np.array(sorted({0, 1, 2, q >> 1, (q >> 1) + 1, q - 2, q - 1, top - 2, top - 1}), dtype=np.int64)
+    a = np.concatenate([np.repeat(edges, len(edges)), rng.integers(0, top, samples)])
+    b = np.concatenate([np.tile(edges, len(edges)), rng.integers(0, top, samples)])
+    root = b % q
+    r_inv = pow(1 << MONTGOMERY_BITS, -1, q) if reduction == "montgomery" else 1
+    # Python ints, products times r_inv overflow int64
+    a_obj, b_obj, root_obj = a.astype(object), b.astype(object), root.astype(object)
+    a, b, root = as_int32(a), as_int32(b), as_int32(root)
+    # op: (model, exact, bound of the model)
+    if lazy:
+        p2 = 2 * q
+        ops = {
+            "lazy add": (vector_lazy_add(a, b, p2), a_obj + b_obj, p2),
+            "lazy sub": (vector_lazy_sub(a, b, p2), a_obj - b_obj, p2),
+            "lazy product": (vector_modmul(vector_lazy_diff(a, b, p2), q, root, u, w, reduction, lazy),
+                             (a_obj - b_obj) * root_obj * r_inv, p2),
+            "modmul": (vector_modmul(a, q, b, u, w, reduction), a_obj * b_obj * r_inv, q),
+            "reduce": (vector_reduce(a, q), a_obj, q),
+        }
+    else:
+        ops = {
+            "modadd": (vector_modadd(a, b, q), a_obj + b_obj, q),
+            "modsub": (vector_modsub(a, b, q), a_obj - b_obj, q),
+            "modmul": (vector_modmul(a, q, root, u, w, reduction), a_obj * root_obj * r_inv, q),
+        }
+    for op, (out, exact, bound) in ops.items():
+        wrong = np.count_nonzero((out < 0) | (out >= bound) | ((out - exact) % q != 0))
+        if wrong:
+            raise ValueError(f"{op} with {reduction} reduction is wrong mod {q} for {wrong} of {len(out)} operands")
+
+
+def lazy_bounds(q, logN, design="ntt", reduction="barrett"):
+    """Bounds of the values of the NTT_LAZY kernels through a design of 2^logN
+    points mod q, as a list of (step, lo, hi).
+
+    The input is in [0, q). Every stage of butterflies maps the interval of
+    its inputs to the hull of its outputs, following the lanes through each
+    op of the butterfly. Raise ValueError where a lane leaves int32, a
+    product exceeds product_bound(q, lazy=True) that the reduction
+    constants are exact for, or the output is not reduced.
+    """
+    reduction_constants(q, reduction, lazy=True)
+    p2 = 2 * q
+    t_max = product_bound(q, lazy=True)
+    if reduction == "montgomery" and t_max >= q << LANE_BITS:
+        raise ValueError(f"montgomery products of lazy residues mod {q} leave (-q, q)")
+    steps = []
+
+    def lane(step, lo, hi):
+        if lo < -(1 << LANE_BITS) or hi >> LANE_BITS:
+            raise ValueError(f"{step} overflows the int32 lanes mod {q}: [{lo}, {hi}]")
+        return lo, hi
+
+    def fold(step, x, m):
+        # x >= m ? x - m : x, the select of the lazy ops
+        lo, hi = lane(step, *x)
+        if hi < m:
+            return lo, hi
+        return min(lo, max(lo, m) - m), max(min(hi, m - 1), hi - m)
+
+    def product(step, x, y, lazy):
+        if x[0] < 0 or y[0] < 0 or x[1] * y[1] > t_max:
+            raise ValueError(f"{step} multiplies up to {x[1] * y[1]}, beyond the {t_max} the {reduction} reduction is exact for mod {q}")
+        return 0, (p2 if lazy else q) - 1
+
+    def hull(x, y):
+        return min(x[0], y[0]), max(x[1], y[1])
+
+    root = (0, q - 1)
+
+    def gs(x):
+        s = fold("gs add", (2 * x[0], 2 * x[1]), p2)
+        d = lane("gs diff", x[0] + p2 - x[1], x[1] + p2 - x[0])
+        return hull(s, product("gs product", d, root, True))
+
+    def ct(x):
+        m = product("ct product", x, root, True)
+        s = fold("ct add", (x[0] + m[0], x[1] + m[1]), p2)
+        d = fold("ct sub", (x[0] + p2 - m[1], x[1] + p2 - m[0]), p2)
+        return hull(s, d)
+
+    def transform(x, butterfly, stages, name):
+        for stage in range(stages):
+            x = butterfly(x)
+            steps.append((f"{name} stage {stage}", *x))
+        return x
+
+    def write_back(x):
+        x = fold("write_back_reduced", x, q)
+        if x[0] < 0 or x[1] >= q:
+            raise ValueError(f"write_back_reduced leaves [{x[0]}, {x[1]}] mod {q} unreduced")
+        steps.append(("write_back_reduced", *x))
+        return x
+
+    x = (0, q - 1)
+    steps.append(("input", *x))
+    if design == "polymul":
+        x = transform(x, ct, logN, "forward")
+        x = product("pointwise_mul", x, x, False)
+        steps.append(("pointwise_mul", *x))
+        x = transform(x, gs, logN, "inverse")
+    elif design == "fourstep":
+        x = transform(x, gs, logN // 2, "rows")
+        x = product("write_back_mul", x, root, False)
+        steps.append(("write_back_mul", *x))
+        x = transform(x, gs, logN // 2, "columns")
+    else:
+        x = transform(x, gs, logN, design)
+    if design in ("intt", "polymul"):
+        steps.append(("write_back_scaled", *product("write_back_scaled", x, root, False)))
+    else:
+        write_back(x)
+    return steps
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the kernel reductions against each other and count their ops")
+    parser.add_argument("-p", "--prime", type=int, nargs="+", default=[3329, 7340033, 8380417, 2013265921], help="primes to check")
+    parser.add_argument("--logn", type=int, default=10, help="log2 of the points of the checked transform")
+    parser.add_argument("--samples", type=int, default=1 << 20, help="products of the micro-benchmark")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opts = parse_args()
+    rng = np.random.default_rng(0)
+    for reduction, lazy in [(r, False) for r in REDUCTIONS] + [("montgomery", True)]:
+        for kind in ("gs", "ct"):
+            ops = butterfly_ops(reduction, kind, lazy)
+            acc = sum(ops[k] for k in ACC_OPS)
+            print(f"{reduction}{' lazy' if lazy else ''} {kind} butterfly: {acc} accumulator ops, {sum(ops.values()) - acc} vector ops, {dict(ops)}")
+    for q in opts.prime:
+        a = rng.integers(0, q, 1 << opts.logn)
+        b = rng.integers(0, q, opts.samples)
+        root = rng.integers(0, q, opts.samples)
+        exact = b * root % q
+        outputs = {}
+        for reduction in REDUCTIONS:
+            try:
+                check_prime(q, reduction)
+            except ValueError as e:
+                print(f"p = {q} {reduction}: {e}")
+                continue
+            w, u = reduction_constants(q, reduction)
+            mont_root = as_int32([to_montgomery(int(x), q, reduction) for x in root])
+            start = time.perf_counter()
+            prod = vector_modmul(as_int32(b), q, mont_root, u, w, reduction)
+            elapsed = time.perf_counter() - start
+            outputs[reduction] = ntt_gs(a, q, reduction=reduction)
+            status = "exact" if (prod == exact).all() else f"{np.count_nonzero(prod != exact)} wrong"
+            print(f"p = {q} {reduction}: w = {w}, u = {u}, products {status}, {elapsed * 1e9 / opts.samples:.2f} ns each in NumPy")
+        try:
+            check_prime(q, "montgomery", lazy=True)
+            top = max(hi for design in ("ntt", "intt", "polymul", "fourstep")
+                      for _, _, hi in lazy_bounds(q, opts.logn, design, "montgomery"))
+        except ValueError as e:
+            print(f"p = {q} montgomery lazy: {e}")
+        else:
+            outputs["montgomery lazy"] = ntt_gs(a, q, reduction="montgomery", lazy=True)
+            print(f"p = {q} montgomery lazy: values stay below {top + 1} = {(top + 1) / q:.2f} q")
+        if (q - 1) % (1 << opts.logn) != 0:
+            print(f"p = {q}: no 2^{opts.logn}-th root of unity, transforms not compared to the exact DFT")
+            continue
+        exact = dft_bitrev(a, q)
+        agree = all((out == exact).all() for out in outputs.values())
+        print(f"p = {q}: 2^{opts.logn}-point transforms {'match' if agree else 'do not match'} the exact DFT under {', '.join(outputs)}")
@@ -0,0 +1,346 @@
+import argparse
+import math
+from collections import Counter, namedtuple
+
+# Local steps:
+#   load:              split the next input block into buffa0 / buffa1
+#   local_gs:          ntt_stage0_to_Nminus5(_radix4), from the input (ntt,
+#                      intt) or buffx (polymul) into buffa0 / buffa1
+#   local_ct:          ntt_ct_local(_radix4) of buffa0 / buffa1 into buffx
+#   local_ct_mul:      ntt_ct_local into buffy, then buffx *= buffy
+#   write_back(_scaled): buffa0 / buffa1 to the output, scaled by N^-1
+#   write_back_twiddle: buffa0 / buffa1 times the next four-step twiddles
+LOCAL_KINDS = ("load", "local_gs", "local_ct", "local_ct_mul", "write_back", "write_back_scaled", "write_back_twiddle")
+# How partners of cross-core stages in the same column exchange data:
+#   shared:  through the memory of the neighbour, ordered by lock fifos
+#   memtile: through a MemTile buffer joining the halves of the column
+EXCHANGES = ("shared", "memtile")
+
+# One kernel call of a cross-core stage
+#   kind:  "ntt" (ntt_1stage), "ct" (ntt_1stage_ct), "xntt" / "xct" (the
+#          same with the partner's half exchanged through the MemTile) or
+#          "swap_buff" (exchange of two half buffers). Cores idle in a
+#          stage run no op in its step. Steps where every core works on
+#          its own buffers use the kinds listed in LOCAL_KINDS.
+#   core:  (column, row) of the compute tile running it
+#   bufs:  the two half buffers it touches as (half, column, row),
+#          half 0 is buffa0 and half 1 is buffa1
+#   stage: index of the cross-core stage, stage n-1-stage of the transform
+#   block: logical core index whose butterflies these are (selects the root)
+CrossCoreOp = namedtuple("CrossCoreOp", ["kind", "core", "bufs", "stage", "block"])
+EXCHANGE_KINDS = ("xntt", "xct")
+
+
+def swap_middle(i, n):
+    # On a 4-wide axis the middle two rows (columns) exchange their data
+    return 3 - i if n == 4 and i in (1, 2) else i
+
+
+def cross_core_phases(n_column, n_row, exchange="shared"):
+    """Map the last log2(n_core) stages onto the core grid.
+
+    Stage n-log2(n_core)+b pairs core k with core k + 2^b. Partners in the
+    same column share memory through north/south access, so each runs one
+    half of the butterflies. Partners in the same row only share the memory
+    of the left one, so the right core runs all of them. On a 4-wide axis
+    the partners at distance 2 are not neighbours, hence the middle rows
+    (columns) swap their data beforehand and keep it swapped. The output
+    link and shim DMA put the blocks back in natural order.
+
+    With the memtile exchange, partners in the same column trade the halves
+    they compute on through the MemTile instead, so they may be any two
+    rows and no row swap is needed. Partners in different columns keep
+    sharing memory, as a MemTile only joins the cores of its column.
+    """
+    n_core = n_column * n_row
+    log_core = int(math.log2(n_core))
+    col_of = list(range(n_column))  # physical -> logical column
+    row_of = list(range(n_row))  # physical -> logical row
+    phases = []
+    b = 0
+
+    def logical(c, r):
+        return n_row * col_of[c] + row_of[r]
+
+    for dist in [1, 2][: int(math.log2(n_row))]:
+        if dist == 2 and exchange == "shared":
+            phase = []
+            for c in range(n_column):
+                phase.append(CrossCoreOp("swap_buff", (c, 1), ((0, c, 1), (0, c, 2)), None, None))
+                phase.append(CrossCoreOp("swap_buff", (c, 2), ((1, c, 1), (1, c, 2)), None, None))
+            phases.append(phase)
+            row_of[1], row_of[2] = row_of[2], row_of[1]
+        stage = log_core - 1 - b
+        phase = []
+        for c in range(n_column):
+            if exchange == "memtile":
+                pairs, kind = [(r, r + dist) for r in range(n_row) if not r & dist], "xntt"
+            else:
+                pairs, kind = [(r, r + 1) for r in range(0, n_row, 2)], "ntt"
+            for r0, r1 in pairs:
+                block = logical(c, r0)
+                phase.append(CrossCoreOp(kind, (c, r0), ((0, c, r0), (0, c, r1)), stage, block))
+                phase.append(CrossCoreOp(kind, (c, r1), ((1, c, r0), (1, c, r1)), stage, block))
+        phases.append(phase)
+        b += 1
+
+    for dist in [1, 2][: int(math.log2(n_column))]:
+        if dist == 2:
+            phase = []
+            for r in range(n_row):
+                for h in range(2):
+                    phase.append(CrossCoreOp("swap_buff", (2, r), ((h, 1, r), (h, 2, r)), None, None))
+            phases.append(phase)
+            col_of[1], col_of[2] = col_of[2], col_of[1]
+        stage = log_core - 1 - b
+        phase = []
+        for c in range(0, n_column, 2):
+            for r in range(n_row):
+                block = logical(c, r)
+                for h in range(2):
+                    phase.append(CrossCoreOp("ntt", (c + 1, r), ((h, c, r), (h, c + 1, r)), stage, block))
+        phases.append(phase)
+        b += 1
+    return phases
+
+
+def ct_phases(phases):
+    # Cooley-Tukey butterflies undo the Gentleman-Sande phases in reverse
+    # order, starting from the layout the latter end in
+    kinds = {"ntt": "ct", "xntt": "xct"}
+    return [[op._replace(kind=kinds.get(op.kind, op.kind)) for op in phase]
+            for phase in reversed(phases)]
+
+
+def local_step(n_column, n_row, kind):
+    return [CrossCoreOp(kind, (c, r), ((0, c, r), (1, c, r)), None, None)
+            for c in range(n_column) for r in range(n_row)]
+
+
+def design_steps(design, n_column, n_row, exchange="shared"):
+    """Steps of one transform of the design, see LOCAL_KINDS.
+
+    polymul loads its inputs with the middle rows (columns) swapped, the
+    layout in which the Gentleman-Sande phases leave their output, so that
+    the Cooley-Tukey phases end in the natural layout.
+    """
+    phases = cross_core_phases(n_column, n_row, exchange)
+
+    def local(kind):
+        return [local_step(n_column, n_row, kind)]
+
+    if design == "polymul":
+        forward = ct_phases(phases)
+        return (local("load") + forward + local("local_ct") +
+                local("load") + forward + local("local_ct_mul") +
+                local("local_gs") + phases + local("write_back_scaled"))
+    write_back = {"ntt": "write_back", "intt": "write_back_scaled", "fourstep": "write_back_twiddle"}[design]
+    return local("local_gs") + phases + local(write_back)
+
+
+def shift_columns(op, offset):
+    c, r = op.core
+    return op._replace(core=(c + offset, r), bufs=tuple((h, bc + offset, br) for h, bc, br in op.bufs))
+
+
+def group_steps(design, n_column, n_row, n_groups, exchange="shared"):
+    """Steps of n_groups transforms run side by side.
+
+    Group g, an RNS limb or the four-step share of column g, runs the
+    design on its own n_column // n_groups columns starting at column
+    g * (n_column // n_groups), so the groups share no buffer and no lock.
+    """
+    group_columns = n_column // n_groups
+    return [[shift_columns(op, g * group_columns) for g in range(n_groups) for op in ops]
+            for ops in design_steps(design, group_columns, n_row, exchange)]
+
+
+def held_row(r, n_row, exchange="shared"):
+    # Row of the data core row r holds after the cross-core phases
+    return r if exchange == "memtile" else swap_middle(r, n_row)
+
+
+def is_neighbour(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1
+
+
+def lock_schedule(steps):
+    """Derive the lock handshakes ordering the steps of a design.
+
+    Whenever the next core to touch a buffer is not the previous one, the
+    previous core signals it through a depth-1 scalar object fifo once its
+    step is done. Such fifos only connect neighbours, so a hand-over between
+    two cores that merely share the owner's memory is relayed by the owner,
+    which forwards the signal before any other wait of that step so that
+    two owners relaying to each other do not deadlock.
+
+    Returns (pre, post), dicts keyed by (step, core) listing the
+    ("wait" | "signal", src, dst) handshakes to run before / after the step.
+    """
+    touches = {}
+    for s, ops in enumerate(steps):
+        for op in ops:
+            for buf in op.bufs:
+                # Exchanging cores only touch their own buffers, the MemTile
+                # orders the rest
+                if op.kind in EXCHANGE_KINDS and buf[1:] != op.core:
+                    continue
+                touches.setdefault(buf, []).append((s, op.core))
+
+    # (signal point, src, dst) -> first step of dst that needs the signal,
+    # a signal point (s, 1) is after step s and (s, 0) right before it
+    edges = {}
+    relayed = set()  # (step, owner, src) of the signals owners forward
+
+    def edge(point, src, dst, step):
+        key = (point, src, dst)
+        edges[key] = min(edges.get(key, step), step)
+
+    for (_, c, r), history in touches.items():
+        owner = (c, r)
+        for (s0, src), (s1, dst) in zip(history, history[1:]):
+            if src == dst:
+                continue
+            if is_neighbour(src, dst):
+                edge((s0, 1), src, dst, s1)
+            else:
+                edge((s0, 1), src, owner, s1)
+                edge((s1, 0), owner, dst, s1)
+                relayed.add((s1, owner, src))
+
+    # Each lock fifo must be waited on in the order it is signalled
+    ordered = sorted(edges, key=lambda k: (k[1], k[2], k[0]), reverse=True)
+    for key, prev in zip(ordered[1:], ordered):
+        if key[1:] == prev[1:]:
+            edges[key] = min(edges[key], edges[prev])
+
+    relay_waits = {}
+    forwards = {}
+    waits = {}
+    post = {}
+    for (point, src, dst), step in sorted(edges.items()):
+        group = relay_waits if (step, dst, src) in relayed else waits
+        group.setdefault((step, dst), []).append(("wait", src, dst))
+    for (point, src, dst), step in sorted(edges.items()):
+        s, after = point
+        if after:
+            post.setdefault((s, src), []).append(("signal", src, dst))
+        else:
+            forwards.setdefault((s, src), []).append(("signal", src, dst))
+    pre = {}
+    for key in sorted(set(relay_waits) | set(forwards) | set(waits)):
+        pre[key] = relay_waits.get(key, []) + forwards.get(key, []) + waits.get(key, [])
+    return pre, post
+
+
+def lock_name(src, dst):
+    direction = {(0, 1): "up", (0, -1): "down", (-1, 0): "left", (1, 0): "right"}
+    d = direction[(dst[0] - src[0], dst[1] - src[1])]
+    return f"lock_{d}{src[0]}{src[1]}_{dst[0]}{dst[1]}"
+
+
+# One pass over the data: every core runs `count` transforms of `steps`,
+# pre / post are the handshakes lock_schedule derived for them
+Pass = namedtuple("Pass", ["count", "steps", "pre", "post"])
+
+
+def design_passes(design, n_column, n_row, n_groups=1, exchange="shared", count=1):
+    """Schedule of a design, n_groups transforms side by side.
+
+    fourstep makes two passes, over the rows of its square with the twiddle
+    multiply and over the columns. The code generator emits the kernel
+    calls and lock fifos of every core from the returned passes, so other
+    schedules only need to produce the same structure.
+    """
+    designs = ["fourstep", "ntt"] if design == "fourstep" else [design]
+    passes = []
+    for d in designs:
+        steps = group_steps(d, n_column, n_row, n_groups, exchange)
+        passes.append(Pass(count, steps, *lock_schedule(steps)))
+    return passes
+
+
+def step_names(steps):
+    """Name of every step: the kind of its local ops, or of the cross-core
+    ops the busy cores run with the transform stage they compute, e.g.
+    "ntt n-4".
+    """
+    names = []
+    for ops in steps:
+        op = ops[0]
+        names.append(op.kind if op.stage is None else f"{op.kind} n-{op.stage + 1}")
+    return names
+
+
+def lock_pairs(passes):
+    # (src, dst) of every lock fifo the passes signal through
+    return sorted({(src, dst) for p in passes for handshakes in (p.pre, p.post)
+                   for actions in handshakes.values() for _, src, dst in actions})
+
+
+def core_program(passes, core):
+    # What one core runs: per pass and step the handshakes before, its ops
+    # and the handshakes after
+    return [[(p.pre.get((s, core), []), [op for op in ops if op.core == core], p.post.get((s, core), []))
+             for s, ops in enumerate(p.steps)] for p in passes]
+
+
+def summary(passes):
+    """Figures to compare schedules by, per transform of every pass.
+
+    steps:          steps each core goes through
+    calls:          kernel calls and loops of every kind over all cores
+    lock_fifos:     lock fifos between the cores
+    handshakes:     lock waits and signals over all cores
+    core_handshakes: handshakes of the busiest core
+    """
+    calls = Counter(op.kind for p in passes for ops in p.steps for op in ops)
+    per_core = Counter()
+    for p in passes:
+        for handshakes in (p.pre, p.post):
+            for (_, core), actions in handshakes.items():
+                per_core[core] += len(actions)
+    return {
+        "steps": sum(len(p.steps) for p in passes),
+        "calls": dict(calls),
+        "lock_fifos": len(lock_pairs(passes)),
+        "handshakes": sum(per_core.values()),
+        "core_handshakes": max(per_core.values(), default=0),
+    }
+
+
+def describe(passes):
+    # Human readable listing of the schedule, one line per op and handshake
+    lines = []
+    for i, p in enumerate(passes):
+        lines.append(f"pass {i}: {p.count} transform(s)")
+        for s, ops in enumerate(p.steps):
+            lines.append(f"  step {s}")
+            for core in sorted({op.core for op in ops}):
+                for action, src, dst in p.pre.get((s, core), []):
+                    lines.append(f"    {core} {action} {src} -> {dst}")
+                for op in ops:
+                    if op.core == core:
+                        detail = "" if op.stage is None else f" stage {op.stage} block {op.block}"
+                        lines.append(f"    {core} {op.kind} {list(op.bufs)}{detail}")
+                for action, src, dst in p.post.get((s, core), []):
+                    lines.append(f"    {core} {action} {src} -> {dst}")
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print the schedule of a design")
+    parser.add_argument("--design", default="ntt", help="design, see DESIGNS in aie2.py")
+    parser.add_argument("--columns", type=int, default=4, help="number of AIE columns (1, 2 or 4)")
+    parser.add_argument("--rows", type=int, default=4, help="number of compute rows per column (1, 2 or 4)")
+    parser.add_argument("--groups", type=int, default=1, help="transforms side by side, e.g. RNS limbs")
+    parser.add_argument("--exchange", choices=EXCHANGES, default="shared", help="data exchange of partners in a column")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opts = parse_args()
+    passes = design_passes(opts.design, opts.columns, opts.rows, opts.groups, opts.exchange)
+    print(describe(passes))
+    for key, value in summary(passes).items():
+        print(f"{key}: {value}")
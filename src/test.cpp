@@ -1,3 +1,4 @@
+#include <algorithm>
 #include <cstdint>
 #include <ctime>
 #include <fstream>
@@ -12,8 +13,9 @@ const int scaleFactor = 2;
 
 namespace po = boost::program_options;
 
-int32_t modPow(int32_t x, int32_t n, int32_t mod) {
-    int32_t ret;
+// Products of residues below a 31-bit prime take 64 bits
+int32_t modPow(int64_t x, int32_t n, int32_t mod) {
+    int64_t ret;
     if (n == 0) {
         ret = 1;
     } else if (n % 2 == 1) {
@@ -24,10 +26,19 @@ int32_t modPow(int32_t x, int32_t n, int32_t mod) {
     return ret;
 }
 
+// Smallest non-square mod p, as root_generator of aie2.py
+int32_t root_generator(int32_t p) {
+    int32_t g = 2;
+    while (modPow(g, (p - 1) / 2, p) != p - 1) {
+        g++;
+    }
+    return g;
+}
+
 void make_roots(int32_t n, std::vector<int32_t> &roots, int32_t p, int32_t g) {
-    int32_t w = modPow(g, (p - 1) / n, p);
+    int64_t w = modPow(g, (p - 1) / n, p);
     for (int i = 1; i < n; i++) {
-        roots[i] = (uint32_t) (((uint32_t) roots[i - 1] * w) % p);
+        roots[i] = (roots[i - 1] * w) % p;
     }
 }
 
@@ -45,9 +56,8 @@ void ntt(std::vector<int32_t> &a, int32_t n, std::vector<int32_t> &roots_rev,
                 int32_t root = roots_rev[h + i];
                 int32_t v0 = a[j];
                 int32_t v1 = a[j + t];
-                a[j] = (v0 + v1) % p;
-                a[j + t] =
-                    (static_cast<uint64_t>((v0 + p - v1) % p) * root) % p;
+                a[j] = ((int64_t) v0 + v1) % p;
+                a[j + t] = (((int64_t) v0 + p - v1) % p * root) % p;
             }
             j1 += 2 * t;
         }
@@ -59,25 +69,92 @@ void ntt(std::vector<int32_t> &a, int32_t n, std::vector<int32_t> &roots_rev,
     }
 }
 
-int main(int argc, const char *argv[]) {
-    // ============================
-    // Test Parameters
-    // ============================
-    constexpr int32_t n = 11;
-    constexpr int32_t test_stage = n - 1;
+int bit_reverse(int i, int bits) {
+    int ret = 0;
+    for (int b = 0; b < bits; b++) {
+        ret = (ret << 1) | ((i >> b) & 1);
+    }
+    return ret;
+}
+
+// Negacyclic transform inverted by the intt design: Cooley-Tukey
+// butterflies, natural order in, bit-reversed order out. psi_pow[i] = psi^i
+// for a primitive 2n-th root of unity psi.
+void ntt_negacyclic(std::vector<int32_t> &a, int32_t n,
+                    std::vector<int32_t> &psi_pow, int32_t p) {
+    int logn = 0;
+    while ((1 << logn) < n) {
+        logn++;
+    }
+    for (int m = 1, d = n / 2; d >= 1; m <<= 1, d >>= 1) {
+        for (int i = 0; i < m; i++) {
+            int64_t z = psi_pow[bit_reverse(m + i, logn)];
+            for (int j = 2 * i * d; j < 2 * i * d + d; j++) {
+                int64_t t = (a[j + d] * z) % p;
+                int64_t v0 = a[j];
+                a[j] = (v0 + t) % p;
+                a[j + d] = (v0 + p - t) % p;
+            }
+        }
+    }
+}
+
+// Cyclic transform computed by the fourstep design, natural order in and
+// out: a[k] = sum_j a[j] w^(jk) with roots[i] = w^i
+void ntt_cyclic(std::vector<int32_t> &a, int32_t n,
+                std::vector<int32_t> &roots, int32_t p) {
+    int logn = 0;
+    while ((1 << logn) < n) {
+        logn++;
+    }
+    for (int i = 0; i < n; i++) {
+        int j = bit_reverse(i, logn);
+        if (i < j) {
+            std::swap(a[i], a[j]);
+        }
+    }
+    for (int len = 2; len <= n; len <<= 1) {
+        for (int i = 0; i < n; i += len) {
+            for (int j = 0; j < len / 2; j++) {
+                int64_t z = roots[n / len * j];
+                int64_t t = (a[i + j + len / 2] * z) % p;
+                int64_t v0 = a[i + j];
+                a[i + j] = (v0 + t) % p;
+                a[i + j + len / 2] = (v0 + p - t) % p;
+            }
+        }
+    }
+}
+
+// c = a * b in Z_p[x]/(x^n + 1)
+void polymul_negacyclic(std::vector<int32_t> &a, std::vector<int32_t> &b,
+                        std::vector<int32_t> &c, int32_t n, int32_t p) {
+    std::vector<int64_t> acc(n, 0);
+    for (int i = 0; i < n; i++) {
+        for (int j = 0; j < n; j++) {
+            int64_t prod = (int64_t) a[i] * b[j] % p;
+            if (i + j < n) {
+                acc[i + j] += prod;
+            } else {
+                acc[i + j - n] += p - prod;
+            }
+        }
+    }
+    for (int i = 0; i < n; i++) {
+        c[i] = acc[i] % p;
+    }
+}
 
-    const int block_num = 16;
-    std::array<int, block_num> ans_order = {0, 2, 1, 3, 8,  10, 9,  11,
-                                            4, 6, 5, 7, 12, 14, 13, 15};
+// Coefficient i of operand k of batch entry b
+int32_t test_coeff(int i, int b, int k, int32_t p) {
+    return ((int64_t) (k + 1) * i + b) % p;
+}
 
+int main(int argc, const char *argv[]) {
     // ============================
     // Constants
     // ============================
-    constexpr int32_t p = 3329;
-    constexpr int32_t g = 3;
     constexpr bool VERIFY = true;
-    int IN_VOLUME = 1 << n;
-    int OUT_VOLUME = IN_VOLUME;
 
     // ============================
     // Program arguments parsing
@@ -85,12 +162,81 @@ int main(int argc, const char *argv[]) {
     po::options_description desc("Allowed options");
     po::variables_map vm;
     test_utils::add_default_options(desc);
+    desc.add_options()("logn", po::value<int>()->default_value(11),
+                       "log2 of the number of points")(
+        "columns", po::value<int>()->default_value(4),
+        "number of AIE columns of the design")(
+        "rows", po::value<int>()->default_value(4),
+        "number of compute rows per column of the design")(
+        "prime,p",
+        po::value<std::vector<int>>()->multitoken()->default_value(
+            std::vector<int>{3329}, "3329"),
+        "prime modulus, one per RNS limb")(
+        "batch", po::value<int>()->default_value(1),
+        "polynomials transformed per launch")(
+        "design", po::value<std::string>()->default_value("ntt"),
+        "design built by aie2.py --design: ntt, intt, polymul or fourstep")(
+        "reduction", po::value<std::string>()->default_value("barrett"),
+        "modular reduction built by aie2.py --reduction: barrett or "
+        "montgomery")(
+        "root-index", po::value<std::string>()->default_value("root_index.txt"),
+        "per-core root table indices written by aie2.py --root-index");
 
     test_utils::parse_options(argc, argv, desc, vm);
     int verbosity = vm["verbosity"].as<int>();
     int trace_size = vm["trace_sz"].as<int>();
     printf("trace size: %d\n", trace_size);
 
+    // ============================
+    // Test Parameters
+    // ============================
+    const int32_t n = vm["logn"].as<int>();
+    const int32_t test_stage = n - 1;
+    const std::vector<int> primes = vm["prime"].as<std::vector<int>>();
+    const int n_limbs = primes.size();
+    const int n_column = vm["columns"].as<int>();
+    const int n_row = vm["rows"].as<int>();
+    if (n_column % n_limbs != 0) {
+        std::cerr << n_limbs << " primes do not split " << n_column
+                  << " columns evenly" << std::endl;
+        return 1;
+    }
+    // The test coefficients stay below every prime
+    const int32_t p_in = *std::min_element(primes.begin(), primes.end());
+    const int batch = vm["batch"].as<int>();
+    const int N = 1 << n;
+    const std::string design = vm["design"].as<std::string>();
+    if (design != "ntt" && design != "intt" && design != "polymul" &&
+        design != "fourstep") {
+        std::cerr << "unknown design " << design << std::endl;
+        return 1;
+    }
+    const std::string reduction = vm["reduction"].as<std::string>();
+    if (reduction != "barrett" && reduction != "montgomery") {
+        std::cerr << "unknown reduction " << reduction << std::endl;
+        return 1;
+    }
+    // polymul takes two operands per batch entry, intt one input per limb,
+    // the other designs share their input between the limbs
+    const int n_inputs = design == "polymul" ? 2 : 1;
+    const int in_limbs = design == "intt" ? n_limbs : 1;
+    int IN_VOLUME = in_limbs * n_inputs * batch * N;
+    int OUT_VOLUME = n_limbs * batch * N;
+
+    // Every core receives only the roots it uses, aie2.py lists their
+    // indices into the full table
+    std::vector<int32_t> root_index;
+    std::ifstream root_index_file(vm["root-index"].as<std::string>());
+    if (!root_index_file) {
+        std::cerr << "cannot open " << vm["root-index"].as<std::string>()
+                  << std::endl;
+        return 1;
+    }
+    for (int32_t idx; root_index_file >> idx;) {
+        root_index.push_back(idx);
+    }
+    int ROOT_SIZE = root_index.size() * sizeof(int32_t);
+
     int IN_SIZE = IN_VOLUME * sizeof(int32_t);
     int OUT_SIZE = OUT_VOLUME * sizeof(int32_t) + trace_size;
 
@@ -117,7 +263,7 @@ int main(int argc, const char *argv[]) {
     auto bo_inA =
         xrt::bo(device, IN_SIZE, XRT_BO_FLAGS_HOST_ONLY, kernel.group_id(2));
     auto bo_root =
-        xrt::bo(device, IN_SIZE, XRT_BO_FLAGS_HOST_ONLY, kernel.group_id(3));
+        xrt::bo(device, ROOT_SIZE, XRT_BO_FLAGS_HOST_ONLY, kernel.group_id(3));
     auto bo_prime = xrt::bo(device, 1 * sizeof(int32_t), XRT_BO_FLAGS_HOST_ONLY,
                             kernel.group_id(4));
     auto bo_outC =
@@ -134,12 +280,50 @@ int main(int argc, const char *argv[]) {
     int32_t *bufRoot = bo_root.map<int32_t *>();
     int32_t *bufInFactor = bo_prime.map<int32_t *>();
     int32_t *bufOut = bo_outC.map<int32_t *>();
-    std::vector<int32_t> root(IN_VOLUME);
-    root[0] = 1;
-    make_roots(IN_VOLUME, root, p, g);
-    for (int i = 0; i < IN_VOLUME; i++) {
-        bufInA[i] = i;
-        bufRoot[i] = root[i];
+    // Powers of an N-th (ntt, fourstep) or 2N-th (negacyclic designs) root
+    // of unity of every prime, the root indices address them back to back.
+    // fourstep gets its twiddles from them.
+    int root_len = design == "ntt" || design == "fourstep" ? N : 2 * N;
+    std::vector<std::vector<int32_t>> roots(n_limbs);
+    for (int l = 0; l < n_limbs; l++) {
+        roots[l].resize(root_len);
+        roots[l][0] = 1;
+        make_roots(root_len, roots[l], primes[l], root_generator(primes[l]));
+    }
+    // Montgomery kernels take the roots times 2^32 mod p
+    for (size_t i = 0; i < root_index.size(); i++) {
+        int limb = root_index[i] / root_len;
+        int32_t root = roots[limb][root_index[i] % root_len];
+        if (reduction == "montgomery") {
+            root = ((uint64_t) root << 32) % primes[limb];
+        }
+        bufRoot[i] = root;
+    }
+    // Operand k of batch entry b holds ((k + 1) i + b) mod p_in, the intt
+    // design gets its transform under every prime and fourstep the
+    // coefficients in bit-reversed order
+    for (int l = 0; l < in_limbs; l++) {
+        for (int b = 0; b < batch; b++) {
+            for (int k = 0; k < n_inputs; k++) {
+                std::vector<int32_t> a(N);
+                for (int i = 0; i < N; i++) {
+                    a[i] = test_coeff(i, b, k, p_in);
+                }
+                if (design == "intt") {
+                    ntt_negacyclic(a, N, roots[l], primes[l]);
+                } else if (design == "fourstep") {
+                    std::vector<int32_t> x = a;
+                    for (int i = 0; i < N; i++) {
+                        a[i] = x[bit_reverse(i, n)];
+                    }
+                }
+                for (int i = 0; i < N; i++) {
+                    bufInA[((l * batch + b) * n_inputs + k) * N + i] = a[i];
+                }
+            }
+        }
+    }
+    for (int i = 0; i < OUT_VOLUME; i++) {
         bufOut[i] = 0;
     }
     *bufInFactor = (int32_t) scaleFactor;
@@ -171,7 +355,8 @@ int main(int argc, const char *argv[]) {
         float npu_time =
             std::chrono::duration_cast<std::chrono::microseconds>(stop - start)
                 .count();
-        std::cout << npu_time << std::endl;
+        std::cout << npu_time << " us, " << npu_time / batch
+                  << " us/poly" << std::endl;
     }
 
     // ============================
@@ -193,35 +378,45 @@ int main(int argc, const char *argv[]) {
     if (trace_size > 0) {
         std::cout << "Writing trace output to "
                   << vm["trace_file"].as<std::string>() << std::endl;
-        test_utils::write_out_trace(((char *) bufOut) + IN_SIZE, trace_size,
-                                    vm["trace_file"].as<std::string>());
+        test_utils::write_out_trace(
+            ((char *) bufOut) + OUT_VOLUME * sizeof(int32_t), trace_size,
+            vm["trace_file"].as<std::string>());
     }
 
     // ============================
     // CPU Reference
     // ============================
-    std::vector<int32_t> a_ref(IN_VOLUME);
-    for (int i = 0; i < IN_VOLUME; i++) {
-        a_ref[i] = i;
+    std::vector<int32_t> answers(OUT_VOLUME);
+    for (int l = 0; l < n_limbs; l++) {
+        const int32_t p = primes[l];
+        for (int b = 0; b < batch; b++) {
+            std::vector<int32_t> a_ref(N);
+            for (int i = 0; i < N; i++) {
+                a_ref[i] = test_coeff(i, b, 0, p_in);
+            }
+            if (design == "ntt") {
+                ntt(a_ref, N, roots[l], p, test_stage);
+            } else if (design == "polymul") {
+                std::vector<int32_t> b_ref(N);
+                for (int i = 0; i < N; i++) {
+                    b_ref[i] = test_coeff(i, b, 1, p_in);
+                }
+                polymul_negacyclic(a_ref, b_ref, a_ref, N, p);
+            } else if (design == "fourstep") {
+                ntt_cyclic(a_ref, N, roots[l], p);
+            }
+            std::copy(a_ref.begin(), a_ref.end(),
+                      answers.begin() + (l * batch + b) * N);
+        }
     }
-    ntt(a_ref, IN_VOLUME, root, p, test_stage);
 
     // ============================
     // Veryfy Results
     // ============================
-    std::vector<int32_t> answers(IN_VOLUME);
-    int block_size = IN_VOLUME / block_num;
-    for (int i = 0; i < block_num; i++) {
-        int base_i = ans_order[i] * block_size;
-        for (int j = 0; j < block_size; j++) {
-            answers[base_i + j] = a_ref[i * block_size + j];
-        }
-    }
-
     int errors = 0;
     std::cout << "Verifying results" << std::endl;
 
-    for (int32_t i = 0; i < IN_VOLUME; i++) {
+    for (int32_t i = 0; i < OUT_VOLUME; i++) {
         int32_t ref = answers[i];
         int32_t test = bufOut[i];
         if (test != ref) {
@@ -234,8 +429,21 @@ int main(int argc, const char *argv[]) {
         }
     }
 
+    std::cout << "  design: " << design << std::endl;
     std::cout << "  logN: " << n << std::endl;
-    std::cout << "  p: " << p << std::endl;
+    std::cout << "  cores: " << n_column << "x" << n_row << std::endl;
+    std::cout << "  p:";
+    for (int p : primes) {
+        std::cout << " " << p;
+    }
+    std::cout << std::endl;
+    std::cout << "  batch: " << batch << std::endl;
+    std::cout << "  reduction: " << reduction << std::endl;
+    float npu_time =
+        std::chrono::duration_cast<std::chrono::microseconds>(stop - start)
+            .count();
+    std::cout << "  time per polynomial: " << npu_time / batch << " us ("
+              << batch / npu_time * 1e6 << " poly/s)" << std::endl;
 
     if (!errors) {
         std::cout << "  PASS!" << std::endl;